@@ -0,0 +1,70 @@
+import os
+import numpy as np
+import pygame
+
+class Assets():
+    # Process-wide image registry. Each sprite is decoded once and shared by every entity that
+    # uses it, and is converted to the display's pixel format as soon as a display exists.
+    # If graphics/atlas.npz has been built (python assets.py), sprites come from that one file
+    # instead of one PNG each.
+
+    def __init__(self, directory='graphics', atlas='atlas.npz'):
+        self.directory = directory
+        self.atlas_path = os.path.join(directory, atlas)
+        self.atlas = None
+        self.surfaces = {}
+
+    def get(self, name):
+        surface = self.surfaces.get(name)
+        if surface is None:
+            surface = self.convert(self.load(name))
+            self.surfaces[name] = surface
+        return surface
+
+    def name_of(self, surface):
+        #Reverse lookup, for saving which shared sprite an entity uses.
+        for name, candidate in self.surfaces.items():
+            if candidate is surface:
+                return name
+        return None
+
+    def load(self, name):
+        if self.atlas is None and os.path.exists(self.atlas_path):
+            self.atlas = np.load(self.atlas_path)
+
+        if self.atlas is not None and name in self.atlas.files:
+            pixels = self.atlas[name]
+            return pygame.image.frombuffer(pixels.tobytes(), (pixels.shape[1], pixels.shape[0]), 'RGBA').copy()
+
+        return pygame.image.load(os.path.join(self.directory, name + '.png'))
+
+    def convert(self, surface):
+        #convert_alpha needs a display mode, so headless runs keep the decoded surfaces as they are.
+        if pygame.display.get_init() and pygame.display.get_surface() is not None:
+            return surface.convert_alpha()
+        return surface
+
+    def convert_all(self):
+        #Called once the display exists; entities created after this share the converted surfaces.
+        for name, surface in self.surfaces.items():
+            self.surfaces[name] = self.convert(surface)
+
+    def build_atlas(self):
+        #Packs every PNG in the graphics directory into one uncompressed .npz of RGBA arrays.
+        pixels = {}
+        for file_name in sorted(os.listdir(self.directory)):
+            name, extension = os.path.splitext(file_name)
+            if extension == '.png':
+                surface = pygame.image.load(os.path.join(self.directory, file_name))
+                w, h = surface.get_size()
+                pixels[name] = np.frombuffer(pygame.image.tostring(surface, 'RGBA'), dtype=np.uint8).reshape(h, w, 4)
+
+        np.savez(self.atlas_path, **pixels)
+        self.atlas = None
+        return sorted(pixels)
+
+assets = Assets()
+
+if __name__ == '__main__':
+    names = assets.build_atlas()
+    print("Packed %d sprites into %s" % (len(names), assets.atlas_path))
@@ -0,0 +1,733 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+
+#Rendering is benchmarked offscreen unless a video driver is chosen explicitly.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+from camera import *
+from world import *
+from physics import *
+from integrators import *
+from snapshot import *
+from replay import *
+from pipeline import *
+
+#Timings from this run in seconds, keyed 'benchmark/case/size', for --json and --baseline.
+results = {}
+
+def record(key, seconds):
+    results[key] = seconds
+    return seconds
+
+def timeit(function, repeat=5):
+    #Best wall time of several runs, in seconds.
+    best = inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def build_world(n_bodies, n_sources=2, seed=0):
+    rng = np.random.default_rng(seed)
+    sprite = pygame.Surface((41, 41))
+
+    sources = [GravitationalBody(X=rng.uniform(-10**4, 10**4, 2), m=10**19, sprites={'default' : sprite})
+               for i in range(n_sources)]
+    world = World(Ship(module_type="Core"), None, sources)
+
+    for i in range(n_bodies):
+        world.add_obj('free modules', Module(X=rng.uniform(-10**5, 10**5, 2), sprites={'default' : sprite}))
+
+    return world
+
+def net_forces(world):
+    objects = [obj for entry in world.p_obj.values() for obj in entry]
+    return np.array([obj.F for obj in objects], dtype=float)
+
+def reset_forces(world):
+    for entry in world.p_obj.values():
+        for obj in entry:
+            obj.F = np.array([0,0])
+
+### GRAVITY ###
+
+def bench_gravity(counts=(10, 100, 1000), tolerance=10**-12):
+    #Fails if the batched forces differ from the pairwise ones by more than rounding (tolerance).
+    failed = False
+    print("%8s %14s %14s %10s %12s %8s" % ("bodies", "pairwise (ms)", "batched (ms)", "speedup", "max rel err", ""))
+    for n in counts:
+        world = build_world(n)
+
+        world.apply_gravitation_pairwise()
+        F_pairwise = net_forces(world)
+        reset_forces(world)
+        world.apply_gravitation()
+        F_batched = net_forces(world)
+        error = np.max(np.abs(F_batched - F_pairwise)) / np.max(np.abs(F_pairwise))
+
+        t_pairwise = record('gravity/pairwise/%d' % n, timeit(world.apply_gravitation_pairwise))
+        t_batched = record('gravity/batched/%d' % n, timeit(world.apply_gravitation))
+        ok = error < tolerance
+        failed |= not ok
+        print("%8d %14.3f %14.3f %9.1fx %12.2e %8s" % (n, t_pairwise*1000, t_batched*1000, t_pairwise/t_batched, error, "ok" if ok else "FAIL"))
+
+    return not failed
+
+def random_bodies(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 10**4, (n, 2)), rng.uniform(10**15, 10**16, n)
+
+def bench_barnes_hut_accuracy(n=2000, thetas=(0., 0.3, 0.5, 0.7, 1.), median_bound=0.002, max_bound=0.06):
+    #Errors relative to the RMS direct force. The monopole error grows as theta^2, so this fails if
+    #the median error exceeds median_bound * theta^2 or the largest one max_bound * theta^2
+    #(with theta = 0 held to rounding).
+    X, m = random_bodies(n)
+    sources = np.arange(n)
+    F_direct = DirectGravity().forces(X, m, sources)
+    F_rms = sqrt(np.mean(np.sum(F_direct**2, axis=1)))
+
+    failed = False
+    print("%8s %14s %14s %12s %8s" % ("theta", "median err", "max err", "time (ms)", ""))
+    for theta in thetas:
+        engine = BarnesHutGravity(theta=theta)
+        F = engine.forces(X, m, sources)
+        error = np.linalg.norm(F - F_direct, axis=1) / F_rms
+        t = record('barnes-hut-accuracy/theta=%.2f/%d' % (theta, n), timeit(lambda: engine.forces(X, m, sources), 3))
+        ok = np.median(error) <= max(median_bound * theta**2, 10**-10) and error.max() <= max(max_bound * theta**2, 10**-10)
+        failed |= not ok
+        print("%8.2f %14.2e %14.2e %12.1f %8s" % (theta, np.median(error), error.max(), t*1000, "ok" if ok else "FAIL"))
+
+    return not failed
+
+def bench_barnes_hut(counts=(1000, 10000, 100000), theta=0.7):
+    print("%8s %14s %14s %16s" % ("bodies", "direct (ms)", "b-h (ms)", "b-h bodies/s"))
+    for n in counts:
+        X, m = random_bodies(n)
+        sources = np.arange(n)
+        t_direct = record('barnes-hut/direct/%d' % n, timeit(lambda: DirectGravity().forces(X, m, sources), 1)) if n <= 10000 else nan
+        t_tree = record('barnes-hut/tree/%d' % n, timeit(lambda: BarnesHutGravity(theta=theta).forces(X, m, sources), 1))
+        print("%8d %14.1f %14.1f %16.0f" % (n, t_direct*1000, t_tree*1000, n / t_tree))
+
+def planetary_system(n, planets=8, moons=2, seed=0):
+    #A star, planets with moons of their own, and n light bodies scattered in the planets' spheres of influence.
+    rng = np.random.default_rng(seed)
+    X_src, m_src = [np.zeros(2)], [2.*10**30]
+    for i in range(planets):
+        phi = rng.uniform(0, 2*pi)
+        planet = 10**10 * (i + 1) * np.array([cos(phi), sin(phi)])
+        X_src.append(planet)
+        m_src.append(rng.uniform(10**23, 10**26))
+        for j in range(moons):
+            phi = rng.uniform(0, 2*pi)
+            X_src.append(planet + 10**7 * (j + 1) * np.array([cos(phi), sin(phi)]))
+            m_src.append(rng.uniform(10**19, 10**22))
+
+    X_src, m_src = np.array(X_src), np.array(m_src)
+    home = rng.integers(1, len(X_src), n)
+    r = 10**4 * rng.uniform(1, 10**3, n)
+    phi = rng.uniform(0, 2*pi, n)
+    X = X_src[home] + r[:, np.newaxis] * np.stack([np.cos(phi), np.sin(phi)], axis=1)
+
+    return np.concatenate([X, X_src]), np.concatenate([rng.uniform(10**3, 10**5, n), m_src]), n + np.arange(len(X_src))
+
+def bench_soi(counts=(1000, 10000, 100000), median_bound=0.001, p99_bound=0.15):
+    #Errors relative to direct summation. Bodies near the edge of a sphere of influence feel the
+    #neighbour they ignore almost as strongly, so the largest error is printed but not bounded;
+    #this fails if the median error exceeds median_bound or the 99th percentile p99_bound.
+    failed = False
+    print("%8s %8s %14s %14s %14s %14s %14s %8s" % ("bodies", "sources", "direct (ms)", "soi (ms)", "median err", "p99 err", "max err", ""))
+    for n in counts:
+        X, m, sources = planetary_system(n)
+        engine = SphereOfInfluenceGravity()
+        a_direct = DirectGravity().accelerations(X, m, sources)
+        a = engine.accelerations(X, m, sources)
+        error = np.linalg.norm(a - a_direct, axis=1)[:n] / np.linalg.norm(a_direct, axis=1)[:n]
+        median, p99 = np.median(error), np.percentile(error, 99)
+
+        t_direct = record('soi/direct/%d' % n, timeit(lambda: DirectGravity().accelerations(X, m, sources), 3))
+        t_soi = record('soi/soi/%d' % n, timeit(lambda: engine.accelerations(X, m, sources), 3))
+        ok = median <= median_bound and p99 <= p99_bound
+        failed |= not ok
+        print("%8d %8d %14.1f %14.1f %14.2e %14.2e %14.2e %8s" % (n, len(sources), t_direct*1000, t_soi*1000, median, p99, error.max(), "ok" if ok else "FAIL"))
+
+    #Nesting many sources: from scratch, and again from the last nesting as the engine does every step.
+    print("%8s %8s %14s %14s %14s" % ("bodies", "sources", "nesting (ms)", "renesting (ms)", "soi (ms)"))
+    for planets in (100, 400, 1600):
+        X, m, sources = planetary_system(10000, planets=planets, moons=4)
+        X_src, m_src = X[sources], m[sources]
+        engine = SphereOfInfluenceGravity()
+        engine.accelerations(X, m, sources)
+        t_nest = record('soi/nesting/%d' % len(sources), timeit(lambda: soi_hierarchy(X_src, m_src), 3))
+        t_renest = record('soi/renesting/%d' % len(sources), timeit(lambda: engine.hierarchy(X_src, m_src), 3))
+        t_soi = record('soi/soi/10000/%d' % len(sources), timeit(lambda: engine.accelerations(X, m, sources), 3))
+        print("%8d %8d %14.2f %14.2f %14.1f" % (10000, len(sources), t_nest*1000, t_renest*1000, t_soi*1000))
+
+    return not failed
+
+### INTEGRATION ###
+
+def bench_integrate(counts=(10, 100, 1000, 10000)):
+    print("%8s %16s %14s %10s" % ("bodies", "per-object (ms)", "batched (ms)", "speedup"))
+    for n in counts:
+        world = build_world(n, n_sources=0)
+        objects = world.p_obj['free modules']
+        idx = world.store.indices(objects)
+
+        def per_object():
+            for obj in objects:
+                obj.update_physics(1/60)
+
+        t_object = record('integrate/update_physics/%d' % n, timeit(per_object))
+        t_batched = record('integrate/batched/%d' % n, timeit(lambda: world.store.integrate(idx, 1/60)))
+        print("%8d %16.3f %14.3f %9.1fx" % (n, t_object*1000, t_batched*1000, t_object/t_batched))
+
+def two_body_energy(X, v, m):
+    d = X[0] - X[1]
+    return 0.5 * np.sum(m * np.sum(v**2, axis=1)) - G * m[0] * m[1] / sqrt(d @ d)
+
+def bench_energy_drift(steps=10**6, names=('euler', 'verlet', 'rk4'), tolerance=10**-4):
+    #Regression check: a ship in a circular orbit around the Earth from initialize_world, stepped
+    #10^6 times at the default fixed dt. Fails if the relative energy error ever exceeds tolerance.
+    m = np.array([10**19, 20000.])
+    r = 1500.
+    X = np.array([[0., 0.], [r, 0.]])
+    v = np.array([[0., 0.], [0., -sqrt(G * m[0] / r)]])
+    sources = np.array([0, 1])
+    accel = lambda X: direct_accelerations(X, sources, X, m)
+    dt = SimulationClock().dt
+    E0 = two_body_energy(X, v, m)
+
+    failed = False
+    print("%8s %10s %14s %12s %8s" % ("scheme", "steps", "max |dE/E|", "time (s)", ""))
+    for name in names:
+        Xi, vi, a = X, v, None
+        drift = 0.
+        t0 = time.perf_counter()
+        for i in range(steps):
+            Xi, vi, a = integrators[name](Xi, vi, accel, dt, a)
+            if i % 1000 == 999:
+                drift = max(drift, abs(two_body_energy(Xi, vi, m) / E0 - 1))
+        ok = drift < tolerance
+        failed |= not ok
+        t = record('energy-drift/%s/%d' % (name, steps), time.perf_counter() - t0)
+        print("%8s %10d %14.2e %12.1f %8s" % (name, steps, drift, t, "ok" if ok else "FAIL"))
+
+    return not failed
+
+def orbiting_swarm(n, seed=0, moons=0):
+    #The solar system with the player and n free modules on circular orbits around the Earth, and
+    #moons small gravity sources on circular orbits further out.
+    rng = np.random.default_rng(seed)
+    world = solar_system()
+    earth = world.p_obj['gravity sources'][1]
+    mu = G * earth.m
+
+    def circular(r, phi):
+        u = np.array([cos(phi), sin(phi)])
+        return earth.X_cm + r * u, sqrt(mu / r) * np.array([-u[1], u[0]])
+
+    ship = world.p_obj['player ship'][0]
+    ship.X_cm, ship.v = circular(3000., 0.)
+    world.store.place(np.array([ship.index]))
+    ship.place_modules()
+    for i in range(n):
+        X, v = circular(rng.uniform(2000, 20000), rng.uniform(0, 2*pi))
+        world.add_obj('free modules', Module(X=X, v=v, module_type="Hull"))
+    for i in range(moons):
+        X, v = circular(rng.uniform(30000, 300000), rng.uniform(0, 2*pi))
+        world.add_obj('gravity sources', GravitationalBody(X=X, v=v, m=10**9, sprites={'default' : assets.get('Module')}))
+    return world
+
+def bench_warp(n=1000, warps=(1, 10, 1000, 10**5), frames=60, moons=(0, 2000)):
+    #Frame cost of the simulation alone at each warp factor; above 1 everything is on rails. With
+    #many sources the frame should still cost about the same at every warp above 1.
+    print("%8s %8s %8s %14s %18s %10s" % ("bodies", "sources", "warp", "frame (ms)", "game s / wall s", "state"))
+    for k in moons:
+        for warp in warps:
+            PhysicsObject.store = ComponentStore()
+            world = orbiting_swarm(n, moons=k)
+            world.set_warp(warp)
+
+            t0 = time.perf_counter()
+            for i in range(frames):
+                world.update(1/60)
+            elapsed = time.perf_counter() - t0
+
+            record('warp/%d/%d/%d' % (warp, n, k), elapsed / frames)
+            state = "on rails" if world.warp > 1 else (world.rails.reason or "integrated")
+            print("%8d %8d %8d %14.2f %18.0f %10s" % (n, k + 2, warp, elapsed / frames * 1000, world.clock.time / elapsed, state))
+
+def bench_trajectory(frames=600):
+    #Keeping the predicted path up to date every frame, against predicting it afresh each time.
+    PhysicsObject.store = ComponentStore()
+    world = orbiting_swarm(0)
+    predictor = world.trajectory
+    predictor.update(world)
+    while len(predictor.points) < predictor.horizon:
+        predictor.update(world)
+
+    t_cached = 0.
+    for i in range(frames):
+        world.step(world.clock.dt)
+        world.clock.time += world.clock.dt
+        t0 = time.perf_counter()
+        predictor.update(world)
+        t_cached += time.perf_counter() - t0
+
+    def afresh():
+        predictor.invalidate()
+        predictor.update(world)
+        predictor.extend(predictor.horizon - len(predictor.points))
+    t_afresh = timeit(afresh, 3)
+
+    record('trajectory/cached/%d' % predictor.horizon, t_cached / frames)
+    record('trajectory/afresh/%d' % predictor.horizon, t_afresh)
+    print("%8s %14s %14s %10s" % ("points", "cached (ms)", "afresh (ms)", "restarts"))
+    print("%8d %14.3f %14.1f %10d" % (predictor.horizon, t_cached / frames * 1000, t_afresh * 1000, predictor.restarts))
+
+### SHIP ASSEMBLY ###
+
+def grid_points(n):
+    #The n grid cells closest to the core, in an order where every cell touches an earlier one.
+    k = int(ceil(sqrt(n))) + 1
+    points = [(x, y) for x in range(-k, k + 1) for y in range(-k, k + 1) if (x, y) != (0, 0)]
+    return sorted(points, key=lambda p: (abs(p[0]) + abs(p[1]), p))[:n]
+
+def build_station(n):
+    ship = Ship(module_type="Core")
+    modules = []
+    for i, point in enumerate(grid_points(n)):
+        module_type = Thruster if i % 4 == 0 else Hull
+        modules.append(module_type(core_module=ship, module_coordinates=list(point), module_type=module_type.__name__, module_orientation=i % 4))
+    return ship, modules
+
+def attach_points(ship):
+    #Attachable cells recomputed from scratch.
+    occupied = set(tuple(module.module_coordinates) for module in ship.attached_modules)
+    return set((x + dx, y + dy) for x, y in occupied for dx, dy in Blueprint.neighbours) - occupied
+
+def bench_assembly(counts=(100, 1000, 5000)):
+    #Also checks that the blueprint's running sums and attach points match a full recompute.
+    print("%8s %14s %16s %16s %12s %8s" % ("modules", "attach (us)", "full reset (ms)", "full grid (ms)", "max rel err", "grid"))
+    passed = True
+    for n in counts:
+        ship, modules = build_station(n)
+
+        t0 = time.perf_counter()
+        for module in modules:
+            ship.attach(module)
+        t_attach = record('assembly/attach/%d' % n, (time.perf_counter() - t0) / n)
+
+        #Remove a quarter of the modules again, then compare with a full recompute.
+        for module in modules[1::4]:
+            ship.detach(module)
+
+        incremental = (ship.ship_m, np.array(ship.rel_X_cm), ship.I, ship.blueprint.torques()[1:])
+        t_reset = record('assembly/reset_params/%d' % n, timeit(ship.reset_params, 3))
+        t_points = record('assembly/attach_points/%d' % n, timeit(lambda: attach_points(ship), 3))
+        full = ship.mass_properties()
+        levers = [full[1] - Blueprint.offset(module) for module in ship.blueprint.thrusters[1:]]
+        torques = np.array([-(module.F_max[0]*lever[1] - module.F_max[1]*lever[0]) for module, lever in zip(ship.blueprint.thrusters[1:], levers)])
+
+        error = max(abs(incremental[0] / full[0] - 1), np.max(np.abs(incremental[1] - full[1])) / np.max(np.abs(full[1])),
+                    abs(incremental[2] / full[2] - 1), np.max(np.abs(incremental[3] - torques)) / np.max(np.abs(torques)))
+        grid = "ok" if ship.surrounding_points == attach_points(ship) else "FAIL"
+        print("%8d %14.1f %16.2f %16.2f %12.2e %8s" % (n, t_attach * 10**6, t_reset * 1000, t_points * 1000, error, grid))
+        passed &= error < 10**-9 and grid == "ok"
+
+    return passed
+
+def bench_controls(counts=(10, 100, 1000, 10000)):
+    print("%8s %10s %16s %16s" % ("modules", "thrusters", "controls (us)", "first frame (us)"))
+    for n in counts:
+        ship, modules = build_station(n)
+        for module in modules:
+            ship.attach(module)
+        for action in ship.actions:
+            setattr(ship, 'start_' + action, True)
+
+        #The first call after a layout change also rebuilds the allocation matrix.
+        t_first = record('controls/first/%d' % n, timeit(ship.controls, 1))
+        t_controls = record('controls/held/%d' % n, timeit(ship.controls))
+        print("%8d %10d %16.1f %16.1f" % (n, len(ship.blueprint.thrusters), t_controls * 10**6, t_first * 10**6))
+
+def bench_pose(counts=(10, 100, 1000, 10000)):
+    print("%8s %18s %14s %10s" % ("modules", "per-module (ms)", "batched (ms)", "speedup"))
+    for n in counts:
+        ship, modules = build_station(n)
+        for module in modules:
+            ship.attach(module)
+        ship.theta = 0.7
+
+        def per_module():
+            for module in ship.attached_modules:
+                module.follow(module.module_coordinates, module.module_orientation, ship)
+
+        t_module = record('pose/per-module/%d' % n, timeit(per_module, 3))
+        t_batched = record('pose/batched/%d' % n, timeit(ship.place_modules))
+        print("%8d %18.3f %14.3f %9.1fx" % (n, t_module * 1000, t_batched * 1000, t_module / t_batched))
+
+def bench_snapshot(counts=(100, 1000, 10000), path='benchmark.snap'):
+    print("%8s %12s %12s %12s %14s" % ("modules", "save (ms)", "open (ms)", "load (ms)", "rebuild (ms)"))
+    for n in counts:
+        ship, modules = build_station(n)
+        for module in modules:
+            ship.attach(module)
+        world = World(ship, None, [])
+
+        t_save = record('snapshot/save/%d' % n, timeit(lambda: save(world, path), 3))
+        t_open = record('snapshot/open/%d' % n, timeit(lambda: Snapshot(path), 3))
+        t_load = record('snapshot/load/%d' % n, timeit(lambda: Snapshot(path).world(), 1))
+
+        #Rebuilding the same station module by module, as the game does.
+        def rebuild():
+            ship, modules = build_station(n)
+            for module in modules:
+                ship.attach(module)
+        t_rebuild = record('snapshot/rebuild/%d' % n, timeit(rebuild, 1))
+        print("%8d %12.2f %12.2f %12.1f %14.1f" % (n, t_save*1000, t_open*1000, t_load*1000, t_rebuild*1000))
+    os.remove(path)
+
+### RENDERING ###
+
+def bench_draw(counts=(10, 100, 1000, 5000)):
+    #Camera.draw_world with every object on screen, after the sprite cache has warmed up.
+    pygame.init()
+    camera = Camera()
+    print("%8s %14s %16s" % ("objects", "draw (ms)", "per object (us)"))
+    for n in counts:
+        PhysicsObject.store = ComponentStore()
+        rng = np.random.default_rng(0)
+        world = World(Ship(module_type="Core"), None, [])
+        for i in range(n):
+            module = Module(X=rng.uniform(0, camera.display_size), module_type="Hull")
+            module.theta = rng.uniform(0, 2*pi)
+            world.add_obj('free modules', module)
+
+        camera.position = np.array([0, 0])
+        world.update_index()
+        camera.draw_world(world)
+
+        t = record('draw/draw_world/%d' % n, timeit(lambda: camera.draw_world(world)))
+        print("%8d %14.2f %16.1f" % (n, t * 1000, t / n * 10**6))
+
+def bench_render(n=500, moving=(0, 5, 50, 150, 500), tolerance=1.1):
+    #Whole Camera.render frames of a still view with some objects moving, full redraw vs retained.
+    #Retained must never be slower, give or take tolerance for timing noise.
+    pygame.init()
+    camera = Camera()
+    camera.FPS = 0
+    camera.track = lambda target: None
+    print("%8s %8s %14s %16s %10s %8s" % ("objects", "moving", "full (ms)", "retained (ms)", "speedup", "check"))
+    passed = True
+    for k in moving:
+        PhysicsObject.store = ComponentStore()
+        rng = np.random.default_rng(0)
+        world = World(Ship(module_type="Core"), None, [])
+        for i in range(n):
+            world.add_obj('free modules', Module(X=rng.uniform(0, camera.display_size), module_type="Hull"))
+        movers = world.p_obj['free modules'][:k]
+
+        def frame():
+            for module in movers:
+                module.X = module.X + 1
+            camera.render(world)
+
+        times = {}
+        for retained in (False, True):
+            camera.retained = retained
+            camera.view = None
+            camera.position = np.array([0., 0.])
+            frame()
+            times[retained] = record('render/%s/%d/%d' % ("retained" if retained else "full", n, k), timeit(frame, 20))
+        ok = times[True] <= times[False] * tolerance
+        passed &= ok
+        print("%8d %8d %14.2f %16.2f %9.1fx %8s" % (n, k, times[False] * 1000, times[True] * 1000, times[False] / times[True], "ok" if ok else "FAIL"))
+    return passed
+
+def bench_zoom(ships=200, modules=8, scales=(0.001, 0.01, 0.1, 1., 4., 16., 64.)):
+    #Camera.layout across the zoom range over the Earth and a fleet: time, layers drawn, the
+    #largest surface made, and the sprite cache's size. None of them should grow with the zoom.
+    pygame.init()
+    camera = Camera()
+    PhysicsObject.store = ComponentStore()
+    world = solar_system(camera)
+    earth = world.p_obj['gravity sources'][1]
+    rng = np.random.default_rng(0)
+    for i in range(ships):
+        ship = Enemy(X=earth.X + rng.uniform(-2000, 2000, 2), theta=rng.uniform(0, 2*pi))
+        for x, y in grid_points(modules):
+            ship.attach(Hull(core_module=ship, module_coordinates=[x, y], module_type="Hull"))
+        ship.place_modules()
+        world.p_obj['other ships'].append(ship)
+    world.update_index()
+
+    print("%8s %12s %8s %18s %12s" % ("scale", "layout (ms)", "layers", "largest surface", "cache (MB)"))
+    for scale in scales:
+        camera.scale = scale
+        camera.sprite_cache.clear()
+        camera.position = earth.X - camera.display_size / 2 / scale
+        t = record('zoom/layout/%g' % scale, timeit(lambda: camera.layout(world)))
+        layers = camera.layout(world)
+        largest = max(surface.get_width() * surface.get_height() for key, surface, rect in layers)
+        print("%8g %12.2f %8d %18d %12.1f" % (scale, t * 1000, len(layers), largest, camera.sprite_cache.bytes / 2**20))
+
+### END TO END ###
+
+def scripted_session(path, frames=1200):
+    # Records a fixed session: spawn a module beside the ship and drag it onto the attach point
+    # to the right of the core, thrust, turn, zoom and spawn an enemy. Returns how many modules
+    # the ship ended up with.
+    PhysicsObject.store = ComponentStore()
+    world = solar_system(Viewport())
+    player = Player(world.p_obj['player ship'][0])
+    recorder = Recorder(path)
+    Event = pygame.event.Event
+
+    script = {10 : [Event(pygame.KEYDOWN, key=pygame.K_h)],
+              11 : [Event(pygame.MOUSEBUTTONDOWN, button=1)],
+              30 : [Event(pygame.MOUSEBUTTONUP, button=1), Event(pygame.KEYDOWN, key=pygame.K_w)],
+              200 : [Event(pygame.KEYDOWN, key=pygame.K_q), Event(pygame.MOUSEBUTTONDOWN, button=4)],
+              400 : [Event(pygame.KEYUP, key=pygame.K_w), Event(pygame.KEYDOWN, key=pygame.K_n)],
+              600 : [Event(pygame.KEYUP, key=pygame.K_q), Event(pygame.KEYDOWN, key=pygame.K_s)]}
+    for i in range(frames):
+        #The cursor starts clear of the ship, where the module is spawned, and releases it one cell right of the core.
+        events, mouse = script.get(i, []), (820, 405) if i <= 11 else (760, 405) if i <= 30 else (720, 405)
+        player.get_controls(world, events, mouse)
+        world.update(1/60)
+        recorder.record(1/60, events, mouse, world)
+    recorder.close()
+    return len(player.ship.attached_modules)
+
+def bench_replay(path=None):
+    #Replays a recording (a scripted one if no path is given) and checks every state digest.
+    #The scripted session must attach its module, so that the replay goes through attach_module too.
+    attached = None
+    if path is None:
+        path = 'benchmark.rec'
+        attached = scripted_session(path)
+    world, elapsed, diverged = replay(path)
+    frames = len(read(path)[1])
+    record('replay/frame/%d' % frames, elapsed / frames)
+
+    modules = len(world.p_obj['player ship'])
+    print("%8s %12s %14s %10s %10s" % ("frames", "time (s)", "frames/s", "modules", "state"))
+    print("%8d %12.2f %14.0f %10d %10s" % (frames, elapsed, frames / elapsed, modules, "ok" if diverged is None else "frame %d" % diverged))
+    if path == 'benchmark.rec':
+        os.remove(path)
+    if attached is not None and (attached != 2 or modules != 2):
+        print("the scripted module was not attached (%d modules recorded, %d replayed)" % (attached, modules))
+        return False
+    return diverged is None
+
+def bench_pipeline(seconds=3.):
+    #The solar system drawn on the main thread while the simulation runs on its own, against
+    #simulating and drawing one after the other. The display runs unthrottled in both cases.
+    pygame.init()
+    camera = Camera()
+    camera.FPS = 0
+
+    PhysicsObject.store = ComponentStore()
+    world = solar_system(camera)
+    player = Player(world.p_obj['player ship'][0])
+    frames, t0 = 0, time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        player.get_controls(world, [], (720, 405))
+        world.update(world.clock.dt)
+        frames += 1
+    serial = (time.perf_counter() - t0) / frames
+
+    PhysicsObject.store = ComponentStore()
+    camera.profiler = FrameProfiler()
+    world = solar_system(Viewport(camera.display_size))
+    simulation = Simulation(world, Player(world.p_obj['player ship'][0]))
+    simulation.start()
+    frames, t0 = 0, time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        simulation.send([], (720, 405))
+        previous, current, alpha = simulation.latest(time.perf_counter())
+        if current is not None:
+            camera.present(previous, current, alpha)
+            frames += 1
+    elapsed = time.perf_counter() - t0
+    world.game_exit = True
+    simulation.stop()
+
+    record('pipeline/serial/frame', serial)
+    record('pipeline/threaded/frame', elapsed / frames)
+    print("%10s %14s %14s %14s" % ("pipeline", "frame (ms)", "frames/s", "steps/s"))
+    print("%10s %14.2f %14.0f %14.0f" % ("serial", serial * 1000, 1 / serial, 1 / serial))
+    print("%10s %14.2f %14.0f %14.0f" % ("threaded", elapsed / frames * 1000, frames / elapsed, simulation.steps / elapsed))
+
+### COLLISIONS ###
+
+def build_crowd(n, density=0.05, seed=0, circles=0):
+    #n moving modules packed so that about density of the area is covered. With circles, that many
+    #of them are small gravity sources instead, like asteroid_belt's, with a planet in the middle.
+    PhysicsObject.store = ComponentStore()
+    rng = np.random.default_rng(seed)
+    world = World(Ship(module_type="Core"), None, [])
+    width = sqrt(n * 32**2 / density)
+    for i in range(n):
+        if i < circles:
+            world.add_obj('gravity sources', GravitationalBody(X=rng.uniform(0, width, 2), v=rng.uniform(-100, 100, 2), m=10**9,
+                                                               sprites={'default' : assets.get('Module')}))
+            continue
+        module = Module(X=rng.uniform(0, width, 2), v=rng.uniform(-100, 100, 2), module_type="Hull")
+        module.theta = rng.uniform(0, 2*pi)
+        world.add_obj('free modules', module)
+    if circles:
+        world.add_obj('gravity sources', GravitationalBody(X=np.array([width / 2, width / 2]), m=10**19, sprites={'default' : assets.get('Earth')}))
+    return world
+
+def overlapping_pairs(collisions, X, theta):
+    #Every pair of shapes from different bodies whose bounding boxes overlap, by brute force.
+    c, s = np.abs(np.cos(theta)), np.abs(np.sin(theta))
+    circle = collisions.kind == collisions.CIRCLE
+    extent = np.where(circle[:, np.newaxis], collisions.half[:, :1],
+                      np.stack([collisions.half[:, 0] * c + collisions.half[:, 1] * s, collisions.half[:, 0] * s + collisions.half[:, 1] * c], axis=1))
+    lo, hi = X - extent, X + extent
+    overlap = np.all((lo[:, np.newaxis] <= hi[np.newaxis]) & (lo[np.newaxis] <= hi[:, np.newaxis]), axis=2)
+    overlap &= collisions.body[:, np.newaxis] != collisions.body[np.newaxis]
+    return set(zip(*np.nonzero(np.triu(overlap, 1))))
+
+def bench_collisions(counts=(1000, 10000), circles=(1000, 4000), check=2000):
+    #Also checks the broad phase pairs against every pair of overlapping bounding boxes, with and
+    #without gravity sources among the shapes. Only the crowds without sources are stepped, as
+    #direct gravity between thousands of sources would swamp the step time.
+    passed = True
+    for k in (0, check // 2):
+        world = build_crowd(check, circles=k)
+        collisions = world.collisions
+        rows = collisions.shapes(world)
+        X, theta = world.store.X[rows], world.store.theta[rows]
+        i, j = collisions.broad_phase(X, theta)
+        passed &= set(zip(np.minimum(i, j), np.maximum(i, j))) == overlapping_pairs(collisions, X, theta)
+
+    print("%8s %8s %10s %10s %14s %14s %8s" % ("objects", "circles", "pairs", "contacts", "resolve (ms)", "step (ms)", "pairs"))
+    for n, k in [(n, 0) for n in counts] + [(n, n) for n in circles]:
+        world = build_crowd(n, circles=k)
+        world.collisions.resolve(world)
+        t_resolve = record('collisions/resolve/%d%s' % (n, '/circles' if k else ''), timeit(lambda: world.collisions.resolve(world)))
+        t_step = record('collisions/step/%d' % n, timeit(lambda: world.step(world.clock.dt))) if not k else nan
+        print("%8d %8d %10d %10d %14.2f %14.2f %8s" % (n, k, world.collisions.pairs, world.collisions.contacts, t_resolve * 1000, t_step * 1000,
+                                                       "ok" if passed else "FAIL"))
+    return passed
+
+### AI ###
+
+def bench_steering(counts=(100, 1000, 5000)):
+    #Every enemy steered in one batch, split evenly between the behaviours.
+    print("%8s %14s %14s %16s" % ("enemies", "steer (ms)", "step (ms)", "run_away (ms)"))
+    for n in counts:
+        PhysicsObject.store = ComponentStore()
+        rng = np.random.default_rng(0)
+        world = solar_system()
+        for i in range(n):
+            world.add_obj('other ships', Enemy(X=rng.uniform(-3000, 3000, 2), v=rng.uniform(-300, 300, 2), behaviour=behaviours[i % len(behaviours)]))
+
+        player = world.p_obj['player ship'][0]
+        def run_away():
+            for enemy in world.p_obj['other ships']:
+                enemy.run_away(player)
+
+        t_steer = record('steering/batched/%d' % n, timeit(world.apply_other_thrusters))
+        t_step = record('steering/step/%d' % n, timeit(lambda: world.step(world.clock.dt)))
+        t_run_away = timeit(run_away)
+        print("%8d %14.2f %14.2f %16.2f" % (n, t_steer * 1000, t_step * 1000, t_run_away * 1000))
+
+### ENTITIES ###
+
+def bench_construction(n=2000):
+    print("%10s %16s %16s %10s" % ("class", "instances/s", "bytes/instance", "__dict__"))
+    for cls in (Module, Hull, Thruster, Enemy):
+        ship = Ship(module_type="Core")
+        kwargs = {'core_module' : ship} if cls is not Module else {}
+
+        t0 = time.perf_counter()
+        objects = [cls(**kwargs) for i in range(n)]
+        rate = n / (time.perf_counter() - t0)
+        record('construction/%s' % cls.__name__, 1 / rate)
+        for obj in objects:
+            obj.release()
+
+        #Memory is measured on a second batch, so that store rows are already allocated.
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [cls(**kwargs) for i in range(n)]
+        size = (tracemalloc.get_traced_memory()[0] - before) / n
+        tracemalloc.stop()
+
+        print("%10s %16.0f %16.0f %10s" % (cls.__name__, rate, size, hasattr(objects[0], '__dict__')))
+        for obj in objects:
+            obj.release()
+
+benchmarks = {
+    'gravity' : bench_gravity,
+    'integrate' : bench_integrate,
+    'barnes-hut-accuracy' : bench_barnes_hut_accuracy,
+    'barnes-hut' : bench_barnes_hut,
+    'soi' : bench_soi,
+    'energy-drift' : bench_energy_drift,
+    'warp' : bench_warp,
+    'trajectory' : bench_trajectory,
+    'assembly' : bench_assembly,
+    'controls' : bench_controls,
+    'pose' : bench_pose,
+    'draw' : bench_draw,
+    'render' : bench_render,
+    'zoom' : bench_zoom,
+    'snapshot' : bench_snapshot,
+    'replay' : bench_replay,
+    'pipeline' : bench_pipeline,
+    'steering' : bench_steering,
+    'collisions' : bench_collisions,
+    'construction' : bench_construction,
+}
+
+def compare(baseline, threshold):
+    #Cases that got more than threshold slower than in the baseline file, as (key, old, new).
+    with open(baseline) as f:
+        old = json.load(f)['results']
+    return [(key, old[key], results[key]) for key in sorted(results)
+            if key in old and results[key] > old[key] * (1 + threshold)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the named benchmarks, or all of them.")
+    parser.add_argument('names', nargs='*', metavar='name', help=", ".join(benchmarks))
+    parser.add_argument('--json', help="write the timings to this file")
+    parser.add_argument('--baseline', help="compare against timings written earlier with --json")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed slowdown over the baseline (default 0.25)")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in benchmarks:
+            parser.error("unknown benchmark %s" % name)
+
+    passed = True
+    for name in args.names or benchmarks:
+        print("### %s ###" % name)
+        passed &= benchmarks[name]() is not False
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python' : platform.python_version(), 'numpy' : np.__version__, 'pygame' : pygame.version.ver,
+                       'machine' : platform.machine(), 'results' : results}, f, indent=1, sort_keys=True)
+
+    if args.baseline:
+        regressions = compare(args.baseline, args.threshold)
+        print("### regressions over %d%% ###" % (args.threshold * 100))
+        for key, old, new in regressions:
+            print("%40s %12.3f ms -> %12.3f ms (%+.0f%%)" % (key, old * 1000, new * 1000, (new / old - 1) * 100))
+        if not regressions:
+            print("none")
+        passed &= not regressions
+
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,213 @@
+from math import *
+import numpy as np
+
+class Blueprint():
+    # Layout of a ship on its module grid. Occupied cells and attachable cells are hashed, and the
+    # mass, first moment and second moment of the ship are kept as running sums, so attaching or
+    # removing a module updates the mass, centre of mass and moment of inertia in O(1).
+
+    neighbours = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+    def __init__(self):
+        self.modules = {}
+        self.attach_points = set()
+
+        self.m = 0.
+        self.first_moment = np.zeros(2)
+        self.second_moment = 0.
+
+        #Thrusters are kept in flat arrays (grown by doubling) so that all of their torques come out
+        #of one expression. Only the first len(self.thrusters) rows are in use.
+        self.thrusters = []
+        self.F = np.zeros((4, 2))
+        self.r = np.zeros((4, 2))
+        self.thrust = 0.
+
+        #Every module's store row, grid offset and orientation, for posing the whole ship at once.
+        self.posed = []
+        self.rows = np.zeros(4, dtype=int)
+        self.offsets = np.zeros((4, 2))
+        self.orientations = np.zeros(4)
+
+        #Bumped on every layout change, so anything derived from the layout knows when to rebuild.
+        self.version = 0
+        self.allocation_version = -1
+        self.drawing = None
+
+    @staticmethod
+    def offset(module):
+        #Position of a module's centre relative to the core, in the same units reset_params uses.
+        return np.multiply(module.module_coordinates, module.size[0]).astype(float)
+
+    def add(self, module, point):
+        point = (int(point[0]), int(point[1]))
+        self.modules[point] = module
+
+        r = self.offset(module)
+        self.m += module.m
+        self.first_moment += module.m * r
+        self.second_moment += module.I + module.m * (r @ r)
+
+        self.attach_points.discard(point)
+        for dx, dy in self.neighbours:
+            neighbour = (point[0] + dx, point[1] + dy)
+            if neighbour not in self.modules:
+                self.attach_points.add(neighbour)
+
+        slot = len(self.posed)
+        if slot == len(self.rows):
+            self.rows = np.concatenate([self.rows, np.zeros_like(self.rows)])
+            self.offsets = np.concatenate([self.offsets, np.zeros_like(self.offsets)])
+            self.orientations = np.concatenate([self.orientations, np.zeros_like(self.orientations)])
+        self.rows[slot] = module.index
+        self.offsets[slot] = np.multiply(module.module_coordinates, module.size)
+        self.orientations[slot] = module.module_orientation
+        self.posed.append(module)
+        module.pose_slot = slot
+
+        #Thrusters, and ships (including enemies) whose core is a thruster too.
+        if hasattr(module, "F_max"):
+            slot = len(self.thrusters)
+            if slot == len(self.F):
+                self.F = np.concatenate([self.F, np.zeros_like(self.F)])
+                self.r = np.concatenate([self.r, np.zeros_like(self.r)])
+            self.F[slot] = module.F_max
+            self.r[slot] = r
+            self.thrust += hypot(*self.F[slot])
+            self.thrusters.append(module)
+            module.thruster_slot = slot
+
+        self.version += 1
+
+    def add_many(self, modules, points):
+        # Same as calling add for each module in turn, with the sums and arrays filled in one go.
+        if not len(modules):
+            return
+        points = [(int(point[0]), int(point[1])) for point in points]
+        self.modules.update(zip(points, modules))
+
+        store = modules[0].store
+        rows = np.fromiter((module.index for module in modules), dtype=int, count=len(modules))
+        size = np.array([module.size for module in modules], dtype=float)
+        coordinates = np.array([module.module_coordinates for module in modules], dtype=float)
+        r = coordinates * size[:, :1]
+        m, I = store.m[rows], store.I[rows]
+        self.m += m.sum()
+        self.first_moment += m @ r
+        self.second_moment += (I + m * np.einsum('ij,ij->i', r, r)).sum()
+
+        self.attach_points |= {(x + dx, y + dy) for x, y in points for dx, dy in self.neighbours}
+        self.attach_points -= self.modules.keys()
+
+        start, end = len(self.posed), len(self.posed) + len(modules)
+        while end > len(self.rows):
+            self.rows = np.concatenate([self.rows, np.zeros_like(self.rows)])
+            self.offsets = np.concatenate([self.offsets, np.zeros_like(self.offsets)])
+            self.orientations = np.concatenate([self.orientations, np.zeros_like(self.orientations)])
+        self.rows[start:end] = rows
+        self.offsets[start:end] = coordinates * size
+        self.orientations[start:end] = [module.module_orientation for module in modules]
+        self.posed.extend(modules)
+        for slot, module in enumerate(modules, start):
+            module.pose_slot = slot
+
+        #Thrusters, and ships (including enemies) whose core is a thruster too.
+        thrusters = [k for k, module in enumerate(modules) if hasattr(module, "F_max")]
+        if thrusters:
+            start, end = len(self.thrusters), len(self.thrusters) + len(thrusters)
+            while end > len(self.F):
+                self.F = np.concatenate([self.F, np.zeros_like(self.F)])
+                self.r = np.concatenate([self.r, np.zeros_like(self.r)])
+            self.F[start:end] = [modules[k].F_max for k in thrusters]
+            self.r[start:end] = r[thrusters]
+            self.thrust += np.hypot(self.F[start:end, 0], self.F[start:end, 1]).sum()
+            for slot, k in enumerate(thrusters, start):
+                self.thrusters.append(modules[k])
+                modules[k].thruster_slot = slot
+
+        self.version += 1
+
+    def remove(self, point):
+        point = (int(point[0]), int(point[1]))
+        module = self.modules.pop(point)
+
+        r = self.offset(module)
+        self.m -= module.m
+        self.first_moment -= module.m * r
+        self.second_moment -= module.I + module.m * (r @ r)
+
+        #The freed cell can be attached to again if it still touches the ship, and neighbours
+        #that only touched the removed module no longer can.
+        if any((point[0] + dx, point[1] + dy) in self.modules for dx, dy in self.neighbours):
+            self.attach_points.add(point)
+        for dx, dy in self.neighbours:
+            neighbour = (point[0] + dx, point[1] + dy)
+            if neighbour not in self.modules and \
+               not any((neighbour[0] + ex, neighbour[1] + ey) in self.modules for ex, ey in self.neighbours):
+                self.attach_points.discard(neighbour)
+
+        #Swap-remove, moving the last module into the freed slot.
+        slot = module.pose_slot
+        last = self.posed.pop()
+        if last is not module:
+            self.posed[slot] = last
+            last.pose_slot = slot
+            self.rows[slot] = self.rows[len(self.posed)]
+            self.offsets[slot] = self.offsets[len(self.posed)]
+            self.orientations[slot] = self.orientations[len(self.posed)]
+        module.pose_slot = None
+
+        if getattr(module, 'thruster_slot', None) is not None:
+            slot = module.thruster_slot
+            self.thrust -= hypot(*self.F[slot])
+            last = self.thrusters.pop()
+            if last is not module:
+                self.thrusters[slot] = last
+                last.thruster_slot = slot
+                self.F[slot] = self.F[len(self.thrusters)]
+                self.r[slot] = self.r[len(self.thrusters)]
+            module.thruster_slot = None
+
+        self.version += 1
+        return module
+
+    def center_of_mass(self):
+        return self.first_moment / self.m
+
+    def inertia(self):
+        #Parallel-axis theorem about the centre of mass.
+        com = self.center_of_mass()
+        return self.second_moment - self.m * (com @ com)
+
+    def pose_arrays(self):
+        n = len(self.posed)
+        return self.rows[:n], self.offsets[:n], self.orientations[:n]
+
+    def allocation(self):
+        # Thruster allocation matrix, rebuilt once per layout change. Column j of matrix is the
+        # body-frame (F_x, F_y, tau) of thruster j at full power, and groups[k, j] says whether
+        # thruster j fires for control axis k (forward, left, backward, right, rotate +, rotate -).
+        if self.allocation_version != self.version:
+            n = len(self.thrusters)
+            F, lever = self.F[:n], self.center_of_mass() - self.r[:n]
+            tau = -(F[:, 0] * lever[:, 1] - F[:, 1] * lever[:, 0])
+
+            self.matrix = np.stack([F[:, 0], F[:, 1], tau])
+            self.groups = np.stack([F[:, 0] > 0, F[:, 1] < 0, F[:, 0] < 0, F[:, 1] > 0,
+                                    tau > 0.1, tau < -0.1]).astype(float)
+            self.allocation_version = self.version
+        return self.matrix, self.groups
+
+    def layout(self):
+        # (version, rows, sprites, offsets, orientations) of every module, rebuilt once per
+        # layout change, for drawing the whole ship as one image. Nothing in it is ever modified,
+        # so it can be handed to another thread as it is.
+        if self.drawing is None or self.drawing[0] != self.version:
+            n = len(self.posed)
+            self.drawing = (self.version, self.rows[:n].copy(), tuple(module.current_sprite for module in self.posed),
+                            self.offsets[:n].copy(), self.orientations[:n].copy())
+        return self.drawing
+
+    def torques(self):
+        #Torque each thruster exerts about the centre of mass.
+        return self.allocation()[0][2]
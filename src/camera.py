@@ -2,31 +2,74 @@ from math import *
 import numpy as np
 import pygame
 
-class Camera():
+from sprites import *
+from assets import *
+from profiler import *
 
-    def __init__(self):
-        
-        self.display_size = np.array([1440, 810])
-        self.display = pygame.display.set_mode(np.ndarray.tolist(self.display_size), pygame.RESIZABLE)
+def merge_rects(rects):
+    #Rects that overlap are replaced by their union until none of them overlap.
+    merged = []
+    for rect in rects:
+        rect = rect.copy()
+        overlapping = rect.collidelistall(merged)
+        while overlapping:
+            rect.unionall_ip([merged[j] for j in overlapping])
+            merged = [other for j, other in enumerate(merged) if j not in overlapping]
+            overlapping = rect.collidelistall(merged)
+        merged.append(rect)
+    return merged
+
+class Viewport():
+    # What the player is looking at, without any drawing: where the view is, how far it is zoomed
+    # and where the cursor is. Headless runs (such as replays) use this in place of a Camera, so
+    # that everything the controls depend on behaves exactly as it does on screen.
+
+    def __init__(self, display_size=(1440, 810)):
+
+        self.display_size = np.array(display_size)
         self.position = np.array([0,0])
         self.scale = 1.
 
-        self.font = pygame.font.SysFont(None, 25)
-        self.clock = pygame.time.Clock()
-        self.FPS = 60
-
-        self.white = (255,255,255)
-        self.black = (0,0,0)
+        #Zooming stops at these scales, between seeing the whole Earth as a dot and its pixels as tiles.
+        self.min_scale = 0.001
+        self.max_scale = 64.
 
         self.mode = 0
 
+        #Cursor position in display pixels, set once per frame by Player.get_controls.
+        self.mouse = np.array([0,0])
+
+        #Toggled with F3: per-phase frame time percentiles from world.profiler.
+        self.show_profile = False
+
+        #Toggled with P: the player ship's predicted path, from world.trajectory.
+        self.show_trajectory = True
+
+    def render(self, world):
+        ship = world.p_obj['player ship'][0]
+        self.track(ship if self.mode == 0 else world.p_obj['gravity sources'][1])
+
+        #Free modules held by the mouse follow the cursor and snap onto the ship.
+        with world.profiler.phase('follow'):
+            for module in world.p_obj['free modules']:
+                if module.following_mouse:
+                    module.follow_mouse(self.get_mouse_pos() + self.position)
+                    new_point = self.mouse_to_relative_point(ship)
+                    if new_point:
+                        module.follow(new_point, module.module_orientation, ship)
+
+        #Picking goes through the spatial index, so it is kept current even when nothing is drawn.
+        with world.profiler.phase('index'):
+            world.update_index()
+
     def track(self, target):
         self.position = (target.X if abs(target.omega) < 2*pi else target.X_cm) - (self.display_size/2)/self.scale
 
     def resize(self, w, h):
         self.display_size = np.array([w, h])
-        pygame.display.set_mode((w, h), pygame.RESIZABLE)
-        pygame.display.update()
+
+    def zoom(self, increment):
+        self.scale = min(max(self.scale * increment, self.min_scale), self.max_scale)
 
     def mouse_to_relative_point(self, ship):
         mouse = self.get_mouse_pos()
@@ -38,13 +81,210 @@ class Camera():
         relative_point[0] = distance*cos(ship.theta - theta0)
         relative_point[1] = distance*sin(ship.theta - theta0)
         relative_point = np.round(relative_point).tolist()
-        if relative_point in ship.surrounding_points:
+        if tuple(relative_point) in ship.surrounding_points:
             return relative_point
         else:
             return False
 
     def get_mouse_pos(self):
-        return np.asarray(pygame.mouse.get_pos()) / self.scale
+        return np.asarray(self.mouse) / self.scale
+
+class Camera(Viewport):
+
+    def __init__(self):
+
+        super().__init__()
+        self.display = pygame.display.set_mode(np.ndarray.tolist(self.display_size), pygame.RESIZABLE)
+        assets.convert_all()
+
+        self.font = pygame.font.SysFont(None, 25)
+        self.clock = pygame.time.Clock()
+        self.FPS = 60
+
+        self.white = (255,255,255)
+        self.black = (0,0,0)
+        self.red = (200,0,0)
+
+        self.sprite_cache = SpriteCache(self.transform)
+        self.mipmaps = Mipmaps()
+        self.cull_margin = 1000
+
+        #Level of detail: a sprite under point_size pixels across is drawn as a dot of its average
+        #colour, and a ship under impostor_size pixels across as one image of the whole ship. A
+        #sprite larger than the screen only has its visible part scaled. Dots and impostors are
+        #kept like scaled sprites, least recently used first out once over their byte budgets.
+        self.point_size = 2
+        self.impostor_size = 32
+        self.points = SurfaceCache(4 * 2**20)
+        self.impostors = SurfaceCache(32 * 2**20)
+        self.clipped = {}
+        self.frame_clipped = {}
+
+        #Retained rendering: only rectangles that changed since the last frame are redrawn and
+        #flipped, unless the view itself moved, more than max_dirty_area of the screen changed,
+        #or redrawing the changes would take more than max_redraw of the blits and fills of
+        #redrawing everything (clipped blits cost nearly as much as whole ones).
+        self.retained = True
+        self.max_dirty_area = 0.3
+        self.max_redraw = 0.5
+        self.view = None
+        self.drawn = {}
+
+        #The predicted path is drawn with a point every trajectory_spacing pixels at most.
+        self.trajectory_spacing = 4
+        self.trajectory_color = (120,120,200)
+        self.path = (None, None, None)
+
+        #Frame times of the display thread, when the simulation runs on a thread of its own.
+        self.profiler = FrameProfiler()
+
+        #HUD lines by key, as (text, surface, rect); text is only re-rendered when it changes.
+        self.hud = {}
+        self.frame_hud = {}
+
+    def render(self, world):
+        super().render(world)
+        ship = world.p_obj['player ship'][0]
+        profiler = world.profiler
+
+        with profiler.phase('wait'):
+            self.clock.tick(self.FPS)
+
+        if self.show_trajectory:
+            with profiler.phase('predict'):
+                points = world.trajectory.update(world)
+
+        with profiler.phase('draw'):
+            sprites = self.layout(world)
+            if self.show_trajectory:
+                path = self.trajectory_layer(points)
+                if path is not None:
+                    sprites.append(path)
+
+        with profiler.phase('hud'):
+            pygame.display.set_caption("%.1f FPS, sprite cache hit rate %.1f%%" % (self.clock.get_fps(), 100 * self.sprite_cache.stats()['hit rate']))
+            self.print_stats(ship)
+            self.print_warp(world.warp, world.rails.reason)
+            if self.show_profile:
+                self.print_profile(profiler.percentiles())
+
+        self.flip(sprites, profiler)
+
+    def present(self, previous, current, alpha):
+        # Draws a RenderState published by a pipeline.Simulation, interpolated alpha of the way
+        # from previous to current. Runs on the display thread, and never touches the world.
+        profiler = self.profiler
+
+        with profiler.phase('wait'):
+            self.clock.tick(self.FPS)
+
+        with profiler.phase('draw'):
+            if current.scale != self.scale:
+                self.scale = current.scale
+                self.sprite_cache.clear()
+            X, theta, self.position = current.interpolate(previous, alpha)
+
+            sprites = self.layers(current.keys, X, theta, current.sprites, current.size, current.ships)
+            if current.trajectory is not None:
+                path = self.trajectory_layer(current.trajectory)
+                if path is not None:
+                    sprites.append(path)
+
+        with profiler.phase('hud'):
+            pygame.display.set_caption("%.1f FPS, sprite cache hit rate %.1f%%" % (self.clock.get_fps(), 100 * self.sprite_cache.stats()['hit rate']))
+            self.print_stats(current.ship)
+            self.print_warp(current.warp, current.reason)
+            if current.profile is not None:
+                #Simulation phases come from the simulation thread, the rest from this one. Each
+                #thread has its own other and total; the simulation's include its sleep.
+                shown = profiler.percentiles()
+                for name, p in current.profile.items():
+                    if name in ('other', 'total'):
+                        shown['sim ' + name] = p
+                    elif name not in ('events', 'draw', 'hud', 'flip', 'wait'):
+                        shown[name] = p
+                self.print_profile(shown)
+
+        self.flip(sprites, profiler)
+        profiler.frame()
+
+    def flip(self, sprites, profiler):
+        with profiler.phase('draw'):
+            dirty = self.compose(sprites)
+            self.clipped, self.frame_clipped = self.frame_clipped, {}
+
+        with profiler.phase('flip'):
+            if dirty is None:
+                pygame.display.update()
+            elif dirty:
+                pygame.display.update(dirty)
+
+    def compose(self, sprites):
+        # Draws the frame and returns the rects to flip, or None for the whole screen. sprites is
+        # the frame's [(key, surface, rect)] in draw order, and the HUD is in self.frame_hud.
+        hud = [(key, surface, rect) for key, (text, surface, rect) in self.frame_hud.items()]
+        view = (tuple(np.round(self.position * self.scale).astype(int)), self.scale, tuple(self.display_size))
+        layers = sprites + hud
+        redraw = None if not self.retained or view != self.view else self.dirty_rects(layers)
+
+        if redraw is None:
+            dirty = None
+            self.display.fill(self.white)
+            for key, surface, rect in layers:
+                self.display.blit(surface, rect)
+        else:
+            #Each dirty rect is cleared and everything overlapping it is redrawn, clipped to it.
+            dirty = [area for area, overlapping in redraw]
+            for area, overlapping in redraw:
+                self.display.set_clip(area)
+                self.display.fill(self.white, area)
+                for j in overlapping:
+                    self.display.blit(layers[j][1], layers[j][2])
+            self.display.set_clip(None)
+
+        self.view = view
+        self.drawn = {key : (surface, rect) for key, surface, rect in layers}
+        self.hud, self.frame_hud = self.frame_hud, {}
+        return dirty
+
+    def dirty_rects(self, layers):
+        # [(rect, indices of the layers overlapping it)] to clear and redraw: the old and new rects
+        # of everything that appeared, vanished, moved or changed image, merged where they
+        # overlap. None when redrawing the whole screen is cheaper.
+        dirty = []
+        current = set()
+        for key, surface, rect in layers:
+            current.add(key)
+            old = self.drawn.get(key)
+            if old is None or old[0] is not surface or old[1] != rect:
+                dirty.append(rect)
+                if old is not None:
+                    dirty.append(old[1])
+        for key, (surface, rect) in self.drawn.items():
+            if key not in current:
+                dirty.append(rect)
+
+        #The area is checked before merging as well, since merging many rects costs more than it saves.
+        budget = self.max_dirty_area * self.display_size[0] * self.display_size[1]
+        dirty = [rect.clip(self.display.get_rect()) for rect in dirty]
+        dirty = [rect for rect in dirty if rect.w and rect.h]
+        if sum(rect.w * rect.h for rect in dirty) > budget:
+            return None
+        dirty = merge_rects(dirty)
+        if sum(rect.w * rect.h for rect in dirty) > budget:
+            return None
+
+        rects = [rect for key, surface, rect in layers]
+        redraw = [(area, area.collidelistall(rects)) for area in dirty]
+        if sum(len(overlapping) + 1 for area, overlapping in redraw) > self.max_redraw * (len(layers) + 1):
+            return None
+        return redraw
+
+    def resize(self, w, h):
+        super().resize(w, h)
+        pygame.display.set_mode((w, h), pygame.RESIZABLE)
+        pygame.display.update()
+        self.view = None
 
     ### Sprite Transformations ###
 
@@ -58,23 +298,168 @@ class Camera():
         return rot_image
 
     def zoom(self, increment):
-        self.scale *= increment
+        super().zoom(increment)
+        self.sprite_cache.clear()
 
-    def scale_sprite(self, target):
+    def scale_sprite(self, target, scale=None):
+        scale = self.scale if scale is None else scale
         w, h = target.get_size()
-        return pygame.transform.scale(target, (ceil(self.scale * w), ceil(self.scale * h)))
+        return pygame.transform.scale(target, (ceil(scale * w), ceil(scale * h)))
+
+    def transform(self, image, angle, scale):
+        image, scale = self.mipmaps.get(image, scale)
+        return self.scale_sprite(self.rot_center(image, angle), scale)
+
+    def place(self, target):
+        return self.place_at(target.X, target.theta, target.current_sprite, target.size)
+
+    def place_at(self, X, theta, sprite, size):
+        #Scaled sprite and screen rect of a sprite at X, or None if it is off screen.
+        if self.position[0] - self.cull_margin <=  X[0] <= self.position[0] + self.display_size[0] / self.scale and self.position[1] - self.cull_margin <= X[1] <= self.position[1] + self.display_size[1] / self.scale:
+            w, h = sprite.get_size()
+            if max(w, h) * self.scale < self.point_size:
+                return self.place_point(X, sprite)
+
+            translated_position = (X - size/2 - self.position) * self.scale
+            if w * h * self.scale**2 > self.display_size[0] * self.display_size[1]:
+                return self.place_clipped(sprite, degrees(theta), translated_position)
+
+            scaled_sprite = self.sprite_cache.get(sprite, degrees(theta), self.scale)
+            return scaled_sprite, pygame.Rect(int(translated_position[0]), int(translated_position[1]), *scaled_sprite.get_size())
+        return None
+
+    def place_point(self, X, sprite):
+        #A square of the sprite's average colour, as many pixels across as the sprite would be.
+        n = max(1, int(round(max(sprite.get_size()) * self.scale)))
+        point = self.points.lookup((id(sprite), n), sprite)
+        if point is None:
+            point = pygame.Surface((n, n))
+            point.fill(pygame.transform.average_color(sprite)[:3])
+            self.points.store((id(sprite), n), sprite, point)
+
+        center = (X - self.position) * self.scale
+        return point, pygame.Rect(int(center[0]) - n // 2, int(center[1]) - n // 2, n, n)
+
+    def place_clipped(self, sprite, angle, translated_position):
+        # Only the part of a sprite that is on screen, scaled, for sprites larger than the screen.
+        # The rotated sprite comes from the cache at full size, and the part cut out of it is kept
+        # for the next frame in case the view stands still.
+        rotated = self.sprite_cache.get(sprite, angle, 1.)
+        w, h = rotated.get_size()
+        full = pygame.Rect(int(translated_position[0]), int(translated_position[1]), ceil(w * self.scale), ceil(h * self.scale))
+        visible = full.clip(pygame.Rect((0, 0), self.display_size.tolist()))
+        if not visible.w or not visible.h:
+            return None
+
+        #The source pixels under the visible rect, widened to whole pixels.
+        x0, y0 = int((visible.left - full.left) / self.scale), int((visible.top - full.top) / self.scale)
+        x1, y1 = min(ceil((visible.right - full.left) / self.scale), w), min(ceil((visible.bottom - full.top) / self.scale), h)
+        rect = pygame.Rect(full.left + int(x0 * self.scale), full.top + int(y0 * self.scale), ceil((x1 - x0) * self.scale), ceil((y1 - y0) * self.scale))
+
+        key = (id(rotated), self.scale, x0, y0, x1, y1, rect.w, rect.h)
+        entry = self.clipped.get(key)
+        if entry is None or entry[0] is not rotated:
+            entry = (rotated, pygame.transform.scale(rotated.subsurface((x0, y0, x1 - x0, y1 - y0)), rect.size))
+        self.frame_clipped[key] = entry
+        return entry[1], rect
+
+    def impostor(self, core, layout):
+        #The whole ship drawn unrotated around its core, rebuilt whenever its layout changes.
+        #Everything made from the impostor it replaces goes with it.
+        surface = self.impostors.lookup(core, layout)
+        if surface is not None:
+            return surface
+        entry = self.impostors.entries.get(core)
+        if entry is not None:
+            for cache in (self.sprite_cache, self.mipmaps, self.points):
+                cache.discard_source(entry[1])
+
+        version, rows, sprites, offsets, orientations = layout
+        radius = max(np.sqrt(np.einsum('ij,ij->i', offsets, offsets)).max() + max(max(sprite.get_size()) for sprite in sprites) / sqrt(2), 1.)
+        side = 2 * int(ceil(radius))
+        surface = pygame.Surface((side, side), pygame.SRCALPHA)
+        for sprite, offset, orientation in zip(sprites, offsets, orientations):
+            module = self.rot_center(sprite, 90 * orientation)
+            rect = module.get_rect()
+            rect.center = (int(round(side / 2 + offset[0])), int(round(side / 2 + offset[1])))
+            surface.blit(module, rect)
+
+        return self.impostors.store(core, layout, surface)
 
     def draw(self, target):
-        if self.position[0] - 1000 <=  target.X[0] <= self.position[0] + self.display_size[0] / self.scale and self.position[1] - 1000 <= target.X[1] <= self.position[1] + self.display_size[1] / self.scale:
-            rotated_sprite = self.rot_center(target.current_sprite, degrees(target.theta))
-            scaled_sprite = self.scale_sprite(rotated_sprite)
-            translated_position = (target.X - target.size/2 - self.position) * self.scale
-            self.display.blit(scaled_sprite, translated_position)
+        placed = self.place(target)
+        if placed is not None:
+            self.display.blit(*placed)
+
+    def layout(self, world):
+        #Only objects in grid cells overlapping the (padded) viewport are considered at all.
+        lo = self.position - self.cull_margin
+        hi = self.position + self.display_size / self.scale + self.cull_margin
+        objects = world.objects_in(lo, hi)
+        ships = {obj.index : obj.blueprint.layout() for obj in objects if getattr(obj, 'blueprint', None) is not None}
+        return self.layers([obj.index for obj in objects], [obj.X for obj in objects], [obj.theta for obj in objects],
+                           [obj.current_sprite for obj in objects], [obj.size for obj in objects], ships)
+
+    def layers(self, keys, X, theta, sprites, size, ships):
+        # [(key, surface, rect)] for objects keys at X and theta, with ships {core key : blueprint
+        # layout} whose cores are among them. A ship that is small on screen takes the place of
+        # all of its modules as one impostor, drawn where its core is.
+        impostors, hidden = {}, set()
+        for core, layout in ships.items():
+            impostor = self.impostor(core, layout)
+            if impostor.get_width() * self.scale < self.impostor_size:
+                impostors[core] = impostor
+                hidden.update(layout[1].tolist())
+
+        layers = []
+        for k, key in enumerate(keys):
+            if key in impostors:
+                #The core's sprite is offset from its position by its alpha buffer, and so is the impostor.
+                impostor = impostors[key]
+                buffer = np.array(sprites[k].get_size()) - size[k]
+                placed = self.place_at(X[k], theta[k], impostor, np.array(impostor.get_size()) - buffer)
+                key = ('ship', key)
+            elif key in hidden:
+                continue
+            else:
+                placed = self.place_at(X[k], theta[k], sprites[k], size[k])
+            if placed is not None:
+                layers.append((key, placed[0], placed[1]))
+        return layers
+
+    def trajectory_layer(self, points):
+        # The predicted path as a (key, surface, rect) layer. Points are thinned out in screen
+        # space, so the number of segments drawn depends on how far the path reaches on screen
+        # at this zoom rather than on how many points are cached.
+        P = (points - self.position) * self.scale
+        step = np.sqrt(np.einsum('ij,ij->i', np.diff(P, axis=0), np.diff(P, axis=0)))
+        arc = np.concatenate([[0.], np.cumsum(step)])
+        keep = np.unique((arc // self.trajectory_spacing).astype(int), return_index=True)[1]
+        P = np.append(P[keep], P[-1:], axis=0)
+
+        #Anything far off screen is pulled in to just outside it, which pygame can still draw.
+        margin = self.display_size.max()
+        P = np.round(np.clip(P, -margin, self.display_size + margin)).astype(int)
+        if len(P) < 2:
+            return None
+
+        key = P.tobytes()
+        if key == self.path[0]:
+            return ('trajectory',) + self.path[1:]
+
+        lo = np.maximum(P.min(axis=0) - 1, 0)
+        hi = np.minimum(P.max(axis=0) + 2, self.display_size.astype(int))
+        if np.any(hi <= lo):
+            return None
+        surface = pygame.Surface(hi - lo, pygame.SRCALPHA)
+        pygame.draw.lines(surface, self.trajectory_color, False, (P - lo).tolist())
+        self.path = (key, surface, pygame.Rect(lo.tolist(), (hi - lo).tolist()))
+        return ('trajectory',) + self.path[1:]
 
     def draw_world(self, world):
-        for entry in world.p_obj.values():
-            for obj in entry:
-                self.draw(obj)
+        #Immediate-mode drawing of every visible object, without any bookkeeping.
+        for key, surface, rect in self.layout(world):
+            self.display.blit(surface, rect)
             
     def text_objects(self, text, color):
         textSurface = self.font.render(text, True, color)
@@ -90,8 +475,37 @@ class Camera():
         self.message_to_screen("Welcome to my Space Sim! Press any key to start.", self.black, self.display_size[0]/2, self.display_size[1]/2)
         pygame.display.update()
 
+    def hud_line(self, key, msg, color, center=None, topleft=None):
+        #Queues a line of HUD text for this frame, reusing last frame's surface if msg is unchanged.
+        old = self.hud.get(key)
+        if old is not None and old[0] == msg:
+            surface = old[1]
+        else:
+            surface = self.font.render(msg, True, color)
+
+        rect = surface.get_rect()
+        if center is not None:
+            rect.center = center
+        else:
+            rect.topleft = topleft
+        self.frame_hud[key] = (msg, surface, rect)
+
     def print_stats(self, ship):
-        self.message_to_screen("Velocity: " + str('%.1f'%(ship.v[0]/8)) + " m/s, " + str('%.1f'%(ship.v[1]/8)) + " m/s", self.black, self.display_size[0] - 120, 20)
-        self.message_to_screen("Position: " + str('%.1f'%(ship.X[0]/8)) + " m, " + str('%.1f'%(ship.X[1]/8)) + " m", self.black, self.display_size[0] - 145, 60)
-        self.message_to_screen("Accel: " + str('%.1f'%(hypot(ship.a[0], ship.a[1])/(8*9.81)) + " g"), self.black, self.display_size[0] - 120, 100)
+        self.hud_line('hud velocity', "Velocity: " + str('%.1f'%(ship.v[0]/8)) + " m/s, " + str('%.1f'%(ship.v[1]/8)) + " m/s", self.black, center=(self.display_size[0] - 120, 20))
+        self.hud_line('hud position', "Position: " + str('%.1f'%(ship.X[0]/8)) + " m, " + str('%.1f'%(ship.X[1]/8)) + " m", self.black, center=(self.display_size[0] - 145, 60))
+        self.hud_line('hud accel', "Accel: " + str('%.1f'%(hypot(ship.a[0], ship.a[1])/(8*9.81)) + " g"), self.black, center=(self.display_size[0] - 120, 100))
+
+    def print_warp(self, warp, reason):
+        if warp > 1:
+            self.hud_line('hud warp', "Warp: %dx" % warp, self.black, center=(self.display_size[0] - 120, 140))
+        elif reason is not None:
+            self.hud_line('hud warp', "Warp stopped: " + reason, self.red, center=(self.display_size[0] - 160, 140))
+
+    def print_profile(self, percentiles):
+        #One line per phase, left-aligned in the top left corner.
+        lines = ["%-12s %6s %6s %6s" % ("ms", "p50", "p95", "p99")]
+        for name, p in percentiles.items():
+            lines.append("%-12s %6.2f %6.2f %6.2f" % ((name,) + p))
+        for k, line in enumerate(lines):
+            self.hud_line('hud profile %d' % k, line, self.black, topleft=(10, 10 + 20 * k))
 
@@ -0,0 +1,285 @@
+from math import *
+import numpy as np
+
+### NARROW PHASE ###
+
+# Shapes are oriented boxes (every module and ship) and circles (gravity sources). A shape at
+# angle theta has its local x axis along (cos theta, -sin theta) and its local y axis along
+# (sin theta, cos theta), which is how Camera draws the sprite. Every function below works on
+# arrays of pairs (A, B) and returns, for each pair, the penetration depth (<= 0 if they do not
+# touch), the contact normal pointing from A to B, and a contact point.
+
+def axes(theta):
+    c, s = np.cos(theta), np.sin(theta)
+    return np.stack([c, -s], axis=1), np.stack([s, c], axis=1)
+
+def dot(a, b):
+    return np.einsum('ij,ij->i', a, b)
+
+def corners(c, h, u, w):
+    #(N, 4, 2) corners of each box.
+    sign = np.array([[1., 1.], [1., -1.], [-1., 1.], [-1., -1.]])
+    return c[:, np.newaxis] + (sign[:, 0] * h[:, 0, np.newaxis])[:, :, np.newaxis] * u[:, np.newaxis] \
+                            + (sign[:, 1] * h[:, 1, np.newaxis])[:, :, np.newaxis] * w[:, np.newaxis]
+
+def box_box(cA, hA, tA, cB, hB, tB):
+    #Separating axis test over the two axes of each box.
+    uA, wA = axes(tA)
+    uB, wB = axes(tB)
+    d = cB - cA
+
+    depth = np.full(len(cA), inf)
+    normal = np.zeros_like(cA)
+    reference_A = np.zeros(len(cA), dtype=bool)
+    for k, L in enumerate((uA, wA, uB, wB)):
+        rA = hA[:, 0] * np.abs(dot(uA, L)) + hA[:, 1] * np.abs(dot(wA, L))
+        rB = hB[:, 0] * np.abs(dot(uB, L)) + hB[:, 1] * np.abs(dot(wB, L))
+        projection = dot(d, L)
+        overlap = rA + rB - np.abs(projection)
+        better = overlap < depth
+        depth = np.where(better, overlap, depth)
+        normal = np.where(better[:, np.newaxis], L * np.where(projection < 0, -1., 1.)[:, np.newaxis], normal)
+        reference_A = np.where(better, k < 2, reference_A)
+
+    #The contact is the corner of the other box that reaches deepest into the reference box.
+    corners_A = corners(cA, hA, uA, wA)
+    corners_B = corners(cB, hB, uB, wB)
+    deepest_A = corners_A[np.arange(len(cA)), np.argmax(np.einsum('ikj,ij->ik', corners_A, normal), axis=1)]
+    deepest_B = corners_B[np.arange(len(cB)), np.argmin(np.einsum('ikj,ij->ik', corners_B, normal), axis=1)]
+    point = np.where(reference_A[:, np.newaxis], deepest_B, deepest_A)
+
+    return depth, normal, point
+
+def box_circle(cA, hA, tA, cB, rB):
+    #Closest point of the box to the circle's centre, found in the box's own frame.
+    uA, wA = axes(tA)
+    d = cB - cA
+    local = np.stack([dot(d, uA), dot(d, wA)], axis=1)
+    closest = np.clip(local, -hA, hA)
+    point = cA + closest[:, :1] * uA + closest[:, 1:] * wA
+
+    gap = cB - point
+    distance = np.sqrt(dot(gap, gap))
+    outside = distance > 0
+    normal = gap / np.where(outside, distance, 1)[:, np.newaxis]
+    depth = rB - distance
+
+    #A centre inside the box is pushed out through the nearest face.
+    if not np.all(outside):
+        inside = ~outside
+        room = hA[inside] - np.abs(local[inside])
+        along_u = room[:, 0] < room[:, 1]
+        face = np.where(along_u[:, np.newaxis], uA[inside], wA[inside])
+        side = np.where(along_u, local[inside, 0], local[inside, 1])
+        normal[inside] = face * np.where(side < 0, -1., 1.)[:, np.newaxis]
+        depth[inside] = rB[inside] + np.min(room, axis=1)
+        point[inside] = cB[inside]
+
+    return depth, normal, point
+
+def circle_circle(cA, rA, cB, rB):
+    d = cB - cA
+    distance = np.sqrt(dot(d, d))
+    normal = np.where((distance > 0)[:, np.newaxis], d / np.maximum(distance, 1e-12)[:, np.newaxis], np.array([1., 0.]))
+    return rA + rB - distance, normal, cA + normal * rA[:, np.newaxis]
+
+### COLLISIONS ###
+
+class Collisions():
+    # Finds touching shapes with a sorted uniform grid and resolves them with impulses.
+    #
+    # The shapes' order sorted by grid cell is kept between steps, and since things move little
+    # in one step the previous order is nearly sorted already, which a stable sort handles in
+    # close to linear time. Shape sizes and owners are only gathered again when the set of
+    # shapes changes.
+    #
+    # Shapes belong to bodies: a ship's attached modules all push on the ship's core with the
+    # mass and inertia of the whole ship, and shapes of the same body never collide.
+
+    BOX = 0
+    CIRCLE = 1
+
+    def __init__(self, restitution=0.3, rest_speed=60., iterations=4, slop=0.5, correction=0.8, big_circle=4.):
+        #Contacts closing slower than rest_speed don't bounce, so resting on a planet doesn't jitter.
+        self.restitution = restitution
+        self.rest_speed = rest_speed
+        self.iterations = iterations
+        self.slop = slop
+        self.correction = correction
+
+        #Circles more than big_circle times the size of the largest box stay out of the broad phase grid.
+        self.big_circle = big_circle
+
+        self.rows = np.zeros(0, dtype=int)
+        self.order = np.zeros(0, dtype=int)
+        self.pairs = 0
+        self.contacts = 0
+
+    def shapes(self, world):
+        #Store rows of every shape, with the row of the body each one belongs to.
+        ship = world.p_obj['player ship'][0]
+        others = world.p_obj['other ships']
+        modules = [module for other in others for module in other.attached_modules if module is not other]
+        objects = list(world.p_obj['player ship']) + others + modules + world.p_obj['gravity sources'] + \
+                  [module for module in world.p_obj['free modules'] if not module.following_mouse]
+
+        rows = world.store.indices(objects)
+        if len(rows) != len(self.rows) or np.any(rows != self.rows):
+            n_ship = len(world.p_obj['player ship'])
+            n_circle = len(world.p_obj['gravity sources'])
+            n_other = len(others) + len(modules)
+
+            self.rows = rows
+            self.body = rows.copy()
+            self.body[:n_ship] = ship.index
+            #Modules of the other ships belong to their ship's core.
+            self.body[n_ship + len(others):n_ship + n_other] = world.store.indices(module.core_module for module in modules)
+            self.kind = np.full(len(rows), self.BOX)
+            self.kind[n_ship + n_other:n_ship + n_other + n_circle] = self.CIRCLE
+            self.half = np.array([np.asarray(obj.size, dtype=float) / 2 for obj in objects]).reshape(-1, 2)
+            self.bodies = np.unique(self.body)
+            self.order = np.arange(len(rows))
+
+            #Ships collide with the mass of all their modules.
+            self.ships = [ship] + world.p_obj['other ships']
+
+        return self.rows
+
+    def broad_phase(self, X, theta):
+        # Candidate pairs (i, j) of shape slots whose bounding boxes overlap. The bounding box of
+        # a rotated box is found from its half extents, a circle's from its radius.
+        c, s = np.abs(np.cos(theta)), np.abs(np.sin(theta))
+        circle = self.kind == self.CIRCLE
+        extent = np.where(circle[:, np.newaxis], self.half[:, :1],
+                          np.stack([self.half[:, 0] * c + self.half[:, 1] * s, self.half[:, 0] * s + self.half[:, 1] * c], axis=1))
+        lo, hi = X - extent, X + extent
+
+        #Shapes go in a grid at least twice as wide as any of them, keyed by the cell of their lower
+        #corner, so a shape can only touch shapes keyed to its own or a neighbouring cell. Circles
+        #(gravity sources) go in as well, unless they are more than big_circle times the size of
+        #the largest box: those few planets and stars would blow up the cell size for everything.
+        box_extent = extent[~circle].max() if np.any(~circle) else 1.
+        large = circle & (extent[:, 0] > self.big_circle * box_extent)
+        cell = 2 * max(extent[~large].max(), 1.) if np.any(~large) else 1.
+        keys = np.floor(lo / cell).astype(np.int64) + 2**31
+        key = keys[:, 0] * 2**32 + keys[:, 1]
+
+        #Stable sort from last step's order: nearly sorted input, nearly linear time.
+        self.order = self.order[np.argsort(key[self.order], kind='stable')]
+        order = self.order[~large[self.order]]
+        sorted_key = key[order]
+
+        #Occupied cells, with the range of sorted shapes in each.
+        boundary = np.flatnonzero(np.diff(sorted_key)) + 1
+        cell_start = np.concatenate([[0], boundary]).astype(int)
+        cell_end = np.append(boundary, len(order)).astype(int)
+        cell_key = sorted_key[cell_start]
+        cell_of = np.repeat(np.arange(len(cell_key)), cell_end - cell_start)
+
+        #Pairs within a cell, then with the cells to the right and the one below. Each pair of
+        #neighbouring cells is visited from one side only, so no pair comes up twice.
+        first, second = [], []
+        for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+            if dx == 0 and dy == 0:
+                start, end = np.arange(len(order)) + 1, cell_end[cell_of]
+            else:
+                target = cell_key + dx * 2**32 + dy
+                neighbour = np.minimum(np.searchsorted(cell_key, target), len(cell_key) - 1)
+                found = cell_key[neighbour] == target
+                start = np.where(found, cell_start[neighbour], 0)[cell_of]
+                end = np.where(found, cell_end[neighbour], 0)[cell_of]
+            counts = np.maximum(end - start, 0)
+            a = np.repeat(np.arange(len(order)), counts)
+            b = np.repeat(start, counts) + np.arange(len(a)) - np.repeat(np.cumsum(counts) - counts, counts)
+            first.append(order[a])
+            second.append(order[b])
+
+        #Large circles are few, and are tested against everything.
+        for k in np.nonzero(large)[0]:
+            others = np.arange(len(X))
+            others = others[(others != k) & (~large | (others > k))]
+            first.append(np.full(len(others), k))
+            second.append(others)
+
+        i, j = np.concatenate(first), np.concatenate(second)
+        keep = (lo[i, 0] <= hi[j, 0]) & (lo[j, 0] <= hi[i, 0]) & (lo[i, 1] <= hi[j, 1]) & (lo[j, 1] <= hi[i, 1]) & \
+               (self.body[i] != self.body[j])
+        return i[keep], j[keep]
+
+    def narrow_phase(self, i, j, X, theta):
+        #Contacts as (shape A, shape B, depth, normal from A to B, point), circles always as B.
+        swap = (self.kind[i] == self.CIRCLE) & (self.kind[j] == self.BOX)
+        i, j = np.where(swap, j, i), np.where(swap, i, j)
+
+        results = []
+        for a, b in ((self.BOX, self.BOX), (self.BOX, self.CIRCLE), (self.CIRCLE, self.CIRCLE)):
+            pick = (self.kind[i] == a) & (self.kind[j] == b)
+            A, B = i[pick], j[pick]
+            if not len(A):
+                continue
+            if b == self.BOX:
+                depth, normal, point = box_box(X[A], self.half[A], theta[A], X[B], self.half[B], theta[B])
+            elif a == self.BOX:
+                depth, normal, point = box_circle(X[A], self.half[A], theta[A], X[B], self.half[B, 0])
+            else:
+                depth, normal, point = circle_circle(X[A], self.half[A, 0], X[B], self.half[B, 0])
+            touching = depth > 0
+            results.append((A[touching], B[touching], depth[touching], normal[touching], point[touching]))
+
+        if not results:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0), np.zeros((0, 2)), np.zeros((0, 2))
+        return tuple(np.concatenate(column) for column in zip(*results))
+
+    def resolve(self, world):
+        store = world.store
+        rows = self.shapes(world)
+        if len(rows) < 2:
+            return
+
+        X, theta = store.X[rows], store.theta[rows]
+        i, j = self.broad_phase(X, theta)
+        A, B, depth, normal, point = self.narrow_phase(i, j, X, theta)
+        self.pairs, self.contacts = len(i), len(A)
+        if not len(A):
+            return
+
+        body_A, body_B = self.body[A], self.body[B]
+
+        #Inverse mass and inertia per store row, with ships counting all of their modules.
+        inv_m = np.zeros(store.capacity)
+        inv_I = np.zeros(store.capacity)
+        inv_m[self.bodies] = 1 / store.m[self.bodies]
+        inv_I[self.bodies] = 1 / store.I[self.bodies]
+        for ship in self.ships:
+            inv_m[ship.index] = 1 / ship.ship_m
+
+        r_A = point - store.X_cm[body_A]
+        r_B = point - store.X_cm[body_B]
+        #Torque arm, matching the way store.place turns omega into motion.
+        k_A = r_A[:, 1] * normal[:, 0] - r_A[:, 0] * normal[:, 1]
+        k_B = r_B[:, 1] * normal[:, 0] - r_B[:, 0] * normal[:, 1]
+        K = inv_m[body_A] + inv_m[body_B] + k_A**2 * inv_I[body_A] + k_B**2 * inv_I[body_B]
+
+        for iteration in range(self.iterations):
+            omega = store.omega
+            v_A = store.v[body_A] + omega[body_A, np.newaxis] * np.stack([r_A[:, 1], -r_A[:, 0]], axis=1)
+            v_B = store.v[body_B] + omega[body_B, np.newaxis] * np.stack([r_B[:, 1], -r_B[:, 0]], axis=1)
+            approach = dot(v_B - v_A, normal)
+
+            #Only contacts that are still closing get an impulse.
+            if iteration == 0:
+                e = np.where(approach < -self.rest_speed, self.restitution, 0.)
+            J = np.maximum(0, -(1 + e) * approach / K)
+            if not np.any(J):
+                break
+            np.add.at(store.v, body_A, -(J * inv_m[body_A])[:, np.newaxis] * normal)
+            np.add.at(store.v, body_B, (J * inv_m[body_B])[:, np.newaxis] * normal)
+            np.add.at(store.omega, body_A, -J * k_A * inv_I[body_A])
+            np.add.at(store.omega, body_B, J * k_B * inv_I[body_B])
+
+        #Overlap is removed a bit at a time, split by inverse mass.
+        push = np.maximum(depth - self.slop, 0) * self.correction / (inv_m[body_A] + inv_m[body_B])
+        np.add.at(store.X_cm, body_A, -(push * inv_m[body_A])[:, np.newaxis] * normal)
+        np.add.at(store.X_cm, body_B, (push * inv_m[body_B])[:, np.newaxis] * normal)
+        pushed = push > 0
+        world.edited(np.concatenate([body_A[pushed], body_B[pushed]]))
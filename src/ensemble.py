@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import time
+import inspect
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from scenarios import *
+
+### PARAMETER SPACES ###
+
+def grid(**axes):
+    #Every combination of the listed values, e.g. grid(vy=[-400, -500], earth_m=[10**19, 2*10**19]).
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+def sample(n, seed=0, **ranges):
+    #n independent uniform draws from (low, high) ranges.
+    rng = np.random.default_rng(seed)
+    names = sorted(ranges)
+    return [{name : float(rng.uniform(*ranges[name])) for name in names} for i in range(n)]
+
+def scenario_params(params):
+    #vx/vy are folded into the launch velocity; everything else goes to the scenario as is.
+    params = dict(params)
+    if 'vx' in params or 'vy' in params:
+        params['v'] = np.array([params.pop('vx', 0.), params.pop('vy', -500.)])
+    return params
+
+### SINGLE RUN ###
+
+def primary(world, ship):
+    #The gravity source pulling hardest on the ship.
+    sources = world.p_obj['gravity sources']
+    return max(sources, key=lambda body: body.m / np.sum((body.X_cm - ship.X_cm)**2))
+
+def run_one(run_id, scenario, params, steps, seed, sample_every=10):
+    #Runs in a worker process: builds a fresh headless world and returns its summary metrics.
+    PhysicsObject.store = ComponentStore()
+    np.random.seed(seed)
+    if 'seed' in inspect.signature(scenarios[scenario]).parameters:
+        world = scenarios[scenario](seed=seed, **scenario_params(params))
+    else:
+        world = scenarios[scenario](**scenario_params(params))
+
+    ship = world.p_obj['player ship'][0]
+    body = primary(world, ship)
+    mu = GravitationalBody.G * body.m
+
+    r, angle, energy = [], [], []
+    t0 = time.perf_counter()
+    for i in range(0, steps, sample_every):
+        d = ship.X_cm - body.X_cm
+        u = ship.v - body.v
+        r.append(sqrt(d @ d))
+        angle.append(atan2(d[1], d[0]))
+        energy.append(0.5 * (u @ u) - mu / r[-1])
+        world.run(min(sample_every, steps - i))
+    elapsed = time.perf_counter() - t0
+
+    #Period from the mean angular rate about the primary.
+    swept = abs(np.unwrap(angle)[-1] - angle[0])
+    sim_time = (len(angle) - 1) * sample_every * world.clock.dt
+
+    return {
+        'run' : run_id,
+        'seed' : seed,
+        'params' : params,
+        'steps' : steps,
+        'orbit period' : 2*pi * sim_time / swept if swept > 0 else None,
+        'min radius' : min(r),
+        'max radius' : max(r),
+        'energy drift' : abs(energy[-1] / energy[0] - 1) if energy[0] != 0 else None,
+        'wall time' : elapsed,
+    }
+
+### ENSEMBLE ###
+
+def run_ensemble(param_sets, results_path, scenario='solar system', steps=10000, seed=0, workers=None):
+    #Runs every parameter set in its own process and appends one JSON line per run to
+    #results_path as soon as it finishes. Run i always gets the i-th seed spawned from seed.
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(len(param_sets))]
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool, open(results_path, 'a') as results:
+        futures = [pool.submit(run_one, i, scenario, params, steps, seeds[i]) for i, params in enumerate(param_sets)]
+        for future in as_completed(futures):
+            results.write(json.dumps(future.result()) + '\n')
+            results.flush()
+
+if __name__ == '__main__':
+    results_path = sys.argv[1] if len(sys.argv) > 1 else 'ensemble.jsonl'
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    #Launch speed around the Earth crossed with the Earth's mass.
+    param_sets = grid(vy=list(np.linspace(-300, -700, 9)), earth_m=[0.5*10**19, 10**19, 2*10**19])
+
+    t0 = time.perf_counter()
+    run_ensemble(param_sets, results_path, steps=steps)
+    print("%d runs of %d steps in %.1f s, results in %s" % (len(param_sets), steps, time.perf_counter() - t0, results_path))
@@ -0,0 +1,399 @@
+from math import *
+import numpy as np
+
+G = 6.67408 * 10**-11
+
+def direct_accelerations(X, sources, X_src, m_src, softening=0., chunk=2**20):
+    # Accelerations at every position in X (N,2) caused by the point masses at X_src (M,2).
+    # sources[j] is the row of X that holds source j (or -1), so a source never pulls on itself.
+    a = np.zeros((len(X), 2))
+    step = max(1, chunk // max(1, len(X)))
+
+    for j0 in range(0, len(X_src), step):
+        j1 = min(j0 + step, len(X_src))
+        d = X_src[j0:j1, np.newaxis, :] - X[np.newaxis, :, :]
+        r_squared = np.einsum('ijk,ijk->ij', d, d) + softening**2
+
+        own = sources[j0:j1] >= 0
+        r_squared[np.arange(j1 - j0)[own], sources[j0:j1][own]] = np.inf
+        inv_r_cubed = r_squared**-1.5
+
+        a += G * np.einsum('ij,ijk->jk', m_src[j0:j1, np.newaxis] * inv_r_cubed, d)
+
+    return a
+
+def dynamical_time(X, m, sources, heaviest=8):
+    # Shortest orbital time scale sqrt(r^3 / GM) between any body and one of the heaviest sources.
+    sources = np.asarray(sources, dtype=int)
+    if len(sources) == 0:
+        return inf
+
+    sources = sources[np.argsort(m[sources])[::-1][:heaviest]]
+    d = X[sources, np.newaxis, :] - X[np.newaxis, :, :]
+    r_squared = np.einsum('ijk,ijk->ij', d, d)
+    r_squared[np.arange(len(sources)), sources] = np.inf
+
+    return sqrt(np.min(r_squared**1.5 / (G * m[sources, np.newaxis])))
+
+class DirectGravity():
+    # Exact O(N*M) sum over every (source, object) pair.
+
+    def __init__(self, softening=0.):
+        self.softening = softening
+
+    def accelerations(self, X, m, sources):
+        sources = np.asarray(sources, dtype=int)
+        return direct_accelerations(X, sources, X[sources], m[sources], self.softening)
+
+    def forces(self, X, m, sources):
+        return m[:, np.newaxis] * self.accelerations(X, m, sources)
+
+class QuadTree():
+    # Linear quadtree over a set of point masses, built one level at a time. Nodes are stored
+    # in flat arrays, and the children of every node sit next to each other so that a whole
+    # level of the traversal can be expanded with a single np.repeat.
+
+    def __init__(self, X, m, leaf_size=1, max_depth=32):
+        self.lo = X.min(axis=0)
+        self.width = max(np.ptp(X, axis=0).max(), 1.) * (1 + 1e-9)
+
+        mass, com, cell, depth, leaf = [], [], [], [], []
+        child_start, child_count = [], []
+
+        #Every body starts in the root node.
+        members = np.arange(len(X))
+        node_of = np.zeros(len(X), dtype=int)
+        n_nodes = 0
+
+        for d in range(max_depth + 1):
+            if len(members) == 0:
+                break
+
+            n = 2**d
+            c = np.clip(np.floor((X[members] - self.lo) / (self.width / n)).astype(np.int64), 0, n - 1)
+
+            #Children are keyed by (parent, quadrant) so that siblings are contiguous after sorting.
+            key = node_of[members] * 4 + (c[:, 0] & 1) * 2 + (c[:, 1] & 1) if d else np.zeros(len(members), dtype=np.int64)
+            keys, first, inverse, counts = np.unique(key, return_index=True, return_inverse=True, return_counts=True)
+
+            level_m = np.bincount(inverse, weights=m[members])
+            level_com = np.stack([np.bincount(inverse, weights=m[members] * X[members, 0]),
+                                  np.bincount(inverse, weights=m[members] * X[members, 1])], axis=1)
+            level_com /= np.where(level_m > 0, level_m, 1)[:, np.newaxis]
+            level_leaf = (counts <= leaf_size) | (d == max_depth)
+
+            ids = n_nodes + np.arange(len(keys))
+            if d:
+                parents, parent_first = np.unique(keys // 4, return_index=True)
+                child_start[parents] = ids[parent_first]
+                child_count[parents] = np.diff(np.append(parent_first, len(keys)))
+
+            mass.append(level_m)
+            com.append(level_com)
+            cell.append(c[first])
+            depth.append(np.full(len(keys), d))
+            leaf.append(level_leaf)
+
+            n_nodes += len(keys)
+            child_start = np.concatenate([child_start, np.zeros(len(keys), dtype=int)]).astype(int)
+            child_count = np.concatenate([child_count, np.zeros(len(keys), dtype=int)]).astype(int)
+
+            node_of[members] = ids[inverse]
+            members = members[~level_leaf[inverse]]
+
+        self.m = np.concatenate(mass)
+        self.com = np.concatenate(com)
+        self.cell = np.concatenate(cell)
+        self.depth = np.concatenate(depth)
+        self.leaf = np.concatenate(leaf)
+        self.child_start = child_start
+        self.child_count = child_count
+        self.size = self.width / 2.**self.depth
+
+        #The leaf each body ended up in, so that it can be left out of its own pull.
+        self.body_leaf = node_of
+
+    def contains(self, nodes, X):
+        n = 2**self.depth[nodes]
+        c = np.clip(np.floor((X - self.lo) / self.size[nodes, np.newaxis]).astype(np.int64), 0, n[:, np.newaxis] - 1)
+        return np.all(c == self.cell[nodes], axis=1)
+
+    def accelerations(self, X, X_m, members, theta, softening=0.):
+        # Accelerations at the positions X (N,2). members[i] is the tree body stored at X[i],
+        # or -1 if X[i] is not part of the tree; X_m[i] is its mass.
+        a = np.zeros((len(X), 2))
+        bodies = np.arange(len(X))
+        nodes = np.zeros(len(X), dtype=int)
+
+        while len(bodies):
+            d = self.com[nodes] - X[bodies]
+            r_squared = np.einsum('ij,ij->i', d, d)
+
+            inside = self.contains(nodes, X[bodies])
+            accept = self.leaf[nodes] | (~inside & (self.size[nodes]**2 < theta**2 * r_squared))
+
+            b, n = bodies[accept], nodes[accept]
+            M, com = self.m[n], self.com[n]
+
+            #A body only feels the rest of its own leaf.
+            own = (members[b] >= 0) & (self.body_leaf[np.maximum(members[b], 0)] == n)
+            if np.any(own):
+                M = M.copy()
+                com = com.copy()
+                M[own] -= X_m[b[own]]
+                rest = M[own] > 0
+                com[own] = np.where(rest[:, np.newaxis],
+                                    (self.m[n[own], np.newaxis] * com[own] - X_m[b[own], np.newaxis] * X[b[own]]) / np.where(rest, M[own], 1)[:, np.newaxis],
+                                    X[b[own]])
+                M[own] = np.where(rest, M[own], 0)
+
+            d = com - X[b]
+            r_squared = np.einsum('ij,ij->i', d, d) + softening**2
+            with np.errstate(divide='ignore', invalid='ignore'):
+                k = np.where((M > 0) & (r_squared > 0), G * M * r_squared**-1.5, 0)
+            a[:, 0] += np.bincount(b, weights=k * d[:, 0], minlength=len(X))
+            a[:, 1] += np.bincount(b, weights=k * d[:, 1], minlength=len(X))
+
+            #Everything else is opened up into its children.
+            b, n = bodies[~accept], nodes[~accept]
+            counts = self.child_count[n]
+            bodies = np.repeat(b, counts)
+            offsets = np.arange(len(bodies)) - np.repeat(np.cumsum(counts) - counts, counts)
+            nodes = np.repeat(self.child_start[n], counts) + offsets
+
+        return a
+
+class BarnesHutGravity():
+    # Approximate O(N log N) gravity. A quadtree is built over the sources every step, and any
+    # node whose width over distance is below the opening angle theta is treated as a point mass.
+
+    def __init__(self, theta=0.5, softening=0., leaf_size=1, max_depth=32):
+        self.theta = theta
+        self.softening = softening
+        self.leaf_size = leaf_size
+        self.max_depth = max_depth
+
+    def accelerations(self, X, m, sources):
+        sources = np.asarray(sources, dtype=int)
+        if len(sources) == 0:
+            return np.zeros((len(X), 2))
+
+        tree = QuadTree(X[sources], m[sources], self.leaf_size, self.max_depth)
+
+        members = np.full(len(X), -1)
+        members[sources] = np.arange(len(sources))
+
+        return tree.accelerations(X, m, members, self.theta, self.softening)
+
+    def forces(self, X, m, sources):
+        return m[:, np.newaxis] * self.accelerations(X, m, sources)
+
+def point_accelerations(X, X_src, m_src, softening=0.):
+    #Acceleration at each X[i] towards the single point mass X_src[i], m_src[i].
+    d = X_src - X
+    r_squared = d[:, 0]**2 + d[:, 1]**2 + softening**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.where(r_squared > 0, G * m_src * r_squared**-1.5, 0)
+    return k[:, np.newaxis] * d
+
+def sphere_pairs(P, C, r, spread=16., brute_force=4096):
+    # Pairs (i, k) of points P[i] strictly inside spheres C[k] of radius r[k], for every finite
+    # r. Spheres are grouped into size classes a factor spread apart, each with a grid of cells
+    # twice as wide as its largest sphere, so every sphere is entered in the one to four cells
+    # its bounding box overlaps and every point only looks in its own. Cells are hashed to single
+    # keys; a collision only adds candidates, which the exact test at the end throws out.
+    finite = np.nonzero(np.isfinite(r) & (r > 0))[0]
+    if len(finite) == 0 or len(P) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    #A handful of spheres are simply tested against every point.
+    if len(finite) * len(P) <= brute_force:
+        dx = P[:, 0, np.newaxis] - C[finite, 0]
+        dy = P[:, 1, np.newaxis] - C[finite, 1]
+        i, k = np.nonzero(dx*dx + dy*dy < r[finite]**2)
+        return i, finite[k]
+
+    size_class = np.floor(np.log(r[finite]) / log(spread)).astype(int)
+
+    first, second = [], []
+    for level in np.unique(size_class):
+        k = finite[size_class == level]
+        cell = 2 * r[k].max()
+        lo = np.floor((C[k] - r[k, np.newaxis]) / cell).astype(np.int64)
+        hi = np.floor((C[k] + r[k, np.newaxis]) / cell).astype(np.int64)
+        wide, tall = hi[:, 0] != lo[:, 0], hi[:, 1] != lo[:, 1]
+        cells = np.concatenate([lo, np.stack([hi[wide, 0], lo[wide, 1]], axis=1), np.stack([lo[tall, 0], hi[tall, 1]], axis=1), hi[wide & tall]])
+        owner = np.concatenate([k, k[wide], k[tall], k[wide & tall]])
+
+        sphere_key = cells[:, 0] * 2654435761 + cells[:, 1]
+        by_key = np.argsort(sphere_key)
+        sphere_key, owner = sphere_key[by_key], owner[by_key]
+
+        points = np.floor(P / cell).astype(np.int64)
+        key = points[:, 0] * 2654435761 + points[:, 1]
+        start = np.searchsorted(sphere_key, key, side='left')
+        counts = np.searchsorted(sphere_key, key, side='right') - start
+        a = np.repeat(np.arange(len(P)), counts)
+        b = np.repeat(start, counts) + np.arange(len(a)) - np.repeat(np.cumsum(counts) - counts, counts)
+        first.append(a)
+        second.append(owner[b])
+
+    i, k = np.concatenate(first), np.concatenate(second)
+    d = P[i] - C[k]
+    inside = d[:, 0]**2 + d[:, 1]**2 < r[k]**2
+    return i[inside], k[inside]
+
+def smallest_containing(n, i, k, r, default):
+    #For each of n points, the k of smallest radius among its pairs (i, k), or default if it has none.
+    chosen = np.full(n, default)
+    if len(i):
+        by_size = np.lexsort((r[k], i))
+        i, k = i[by_size], k[by_size]
+        first = np.concatenate([[True], i[1:] != i[:-1]])
+        chosen[i[first]] = k[first]
+    return chosen
+
+def soi_radius(X_src, m_src, parent):
+    #Radius of every source's sphere of influence about its parent, infinite for the root.
+    radius = np.full(len(m_src), inf)
+    rest = parent >= 0
+    d = X_src[rest] - X_src[parent[rest]]
+    radius[rest] = np.sqrt(d[:, 0]**2 + d[:, 1]**2) * (m_src[rest] / m_src[parent[rest]])**0.4
+    return radius
+
+def soi_hierarchy(X_src, m_src, previous=None, max_iterations=32):
+    # Nests the sources into spheres of influence. The heaviest source is the root, with an
+    # infinite sphere; every other source belongs to the smallest sphere it lies inside of among
+    # heavier sources, and its own sphere has the radius r * (m / M)**(2/5) about that parent.
+    # As the spheres depend on the nesting and the other way round, both are iterated from a
+    # guess until the nesting stops changing. The guess is everything under the root, or the
+    # nesting previous returned for the same masses, in which case nothing changes unless a
+    # source crossed a sphere. Returns (parent, radius, depth, order), with parent -1 for the
+    # root and parents coming before their children in order.
+    n = len(m_src)
+    if previous is not None:
+        parent, order = previous[0], previous[3]
+    else:
+        order = np.argsort(-m_src, kind='stable')
+        parent = np.full(n, order[0])
+        parent[order[0]] = -1
+    rank = np.empty(n, dtype=int)
+    rank[order] = np.arange(n)
+    root = order[0]
+
+    #With two sources or fewer, the only heavier source is the root.
+    if n <= 2:
+        parent = np.where(rank > 0, root, -1)
+        return parent, soi_radius(X_src, m_src, parent), rank, order
+
+    for iteration in range(max_iterations):
+        radius = soi_radius(X_src, m_src, parent)
+        i, k = sphere_pairs(X_src, X_src, radius)
+        heavier = rank[k] < rank[i]
+        nested = smallest_containing(n, i[heavier], k[heavier], radius, root)
+        nested[root] = -1
+        if np.array_equal(nested, parent):
+            break
+        parent = nested
+    else:
+        radius = soi_radius(X_src, m_src, parent)
+    if previous is not None and iteration == 0:
+        return parent, radius, previous[2], order
+
+    #Depth by walking every source up to the root at once, one level per pass.
+    depth = np.zeros(n, dtype=int)
+    up = parent.copy()
+    while np.any(up >= 0):
+        climbing = up >= 0
+        depth[climbing] += 1
+        up[climbing] = parent[up[climbing]]
+
+    return parent, radius, depth, order
+
+class SphereOfInfluenceGravity():
+    # Patched-conic gravity, roughly O(N log N). Every body only feels its primary, the source
+    # with the smallest sphere of influence it is inside of, plus the sources listed as perturbers. The
+    # primary's own acceleration is passed down as the acceleration of its frame, so the pull of
+    # the bodies further up the hierarchy is felt as if it were uniform across the sphere. Every
+    # pull is taken from offsets to a nearby body, which keeps the sums precise far from the
+    # origin. Primaries are worked out afresh on every evaluation, so crossing into or out of a
+    # sphere hands a body over to its new primary immediately. The nesting of the sources is
+    # kept from one evaluation to the next, and only worked out again when a source crosses a
+    # sphere or the sources change.
+
+    def __init__(self, perturbers=(), softening=0.):
+        #perturbers are positions in the world's list of gravity sources.
+        self.perturbers = list(perturbers)
+        self.softening = softening
+        self.nesting = None
+
+    def hierarchy(self, X_src, m_src):
+        #soi_hierarchy, starting from the last nesting found for the same sources.
+        previous = None
+        if self.nesting is not None and np.array_equal(self.nesting[0], m_src):
+            previous = self.nesting[1]
+        hierarchy = soi_hierarchy(X_src, m_src, previous)
+        self.nesting = (m_src.copy(), hierarchy)
+        return hierarchy
+
+    def primaries(self, X, m, sources):
+        # (primary, parent, radius, depth, order), where primary[i] is the position in sources of
+        # the primary of X[i] (-1 for the root source itself), and the rest is soi_hierarchy's.
+        sources = np.asarray(sources, dtype=int)
+        parent, radius, depth, order = self.hierarchy(X[sources], m[sources])
+
+        #Anything outside every finite sphere is the root's.
+        i, k = sphere_pairs(X, X[sources], radius)
+        primary = smallest_containing(len(X), i, k, radius, order[0])
+
+        #A source's primary is always its parent, whatever it is inside of.
+        primary[sources] = parent
+        return primary, parent, radius, depth, order
+
+    def accelerations(self, X, m, sources):
+        sources = np.asarray(sources, dtype=int)
+        if len(sources) == 0:
+            return np.zeros((len(X), 2))
+
+        primary, parent, radius, depth, order = self.primaries(X, m, sources)
+        X_src, m_src = X[sources], m[sources]
+        has_primary = primary >= 0
+        p = np.maximum(primary, 0)
+
+        #Every body's own pull towards its primary, relative to the primary's frame.
+        a = np.where(has_primary[:, np.newaxis], point_accelerations(X, X_src[p], m_src[p], self.softening), 0.)
+
+        #A perturber already felt through the frame (it is the primary or one of its ancestors)
+        #is left out; otherwise the body feels its tidal pull, the difference between its pull
+        #here and on the primary, since the frame already carries the latter. The perturber
+        #itself feels no pull of its own, so its frame's pull on its parent is taken back out.
+        for k in self.perturbers:
+            #Sources nested inside k's sphere, k included.
+            within = np.zeros(len(sources), dtype=bool)
+            within[k] = True
+            for level in range(depth[k] + 1, depth.max() + 1):
+                at = np.nonzero(depth == level)[0]
+                within[at] |= within[parent[at]]
+
+            feels = ~(has_primary & within[p])
+            kth = np.full(np.count_nonzero(feels), k)
+            tidal = point_accelerations(X[feels], X_src[kth], m_src[kth], self.softening)
+            frame = has_primary[feels]
+            tidal[frame] -= point_accelerations(X_src[p[feels][frame]], X_src[kth[frame]], m_src[kth[frame]], self.softening)
+            a[feels] += tidal
+
+        #Frame accelerations are accumulated down the hierarchy a level at a time...
+        a_src = a[sources]
+        for level in range(1, depth.max() + 1):
+            at = np.nonzero(depth == level)[0]
+            a_src[at] += a_src[parent[at]]
+
+        #...and then handed to everything orbiting each source.
+        rest = np.ones(len(X), dtype=bool)
+        rest[sources] = False
+        a[rest] += np.where(has_primary[rest, np.newaxis], a_src[p[rest]], 0.)
+        a[sources] = a_src
+        return a
+
+    def forces(self, X, m, sources):
+        return m[:, np.newaxis] * self.accelerations(X, m, sources)
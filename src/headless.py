@@ -0,0 +1,22 @@
+import sys
+import time
+
+from scenarios import *
+
+def run(scenario, steps, **params):
+    #Builds the scenario without a display and advances it steps times as fast as possible.
+    world = scenarios[scenario](**params)
+
+    t0 = time.perf_counter()
+    world.run(steps)
+    return world, time.perf_counter() - t0
+
+if __name__ == '__main__':
+    scenario = sys.argv[1] if len(sys.argv) > 1 else 'solar system'
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    world, elapsed = run(scenario, steps)
+    ship = world.p_obj['player ship'][0]
+
+    print("%s: %d steps in %.2f s (%.0f steps/s, %.0fx real time)" % (scenario, steps, elapsed, steps / elapsed, world.clock.time / elapsed))
+    print("Ship position: %.1f, %.1f  velocity: %.1f, %.1f" % (ship.X_cm[0], ship.X_cm[1], ship.v[0], ship.v[1]))
@@ -0,0 +1,65 @@
+from math import *
+import numpy as np
+
+### INTEGRATORS ###
+
+# Each integrator advances positions X and velocities v (both (N,2)) by h, given accel(X), the
+# total acceleration at a set of positions. a is the acceleration at X if it is already known.
+# They return the new X and v, and the acceleration at the new X when it came for free.
+
+def semi_implicit_euler(X, v, accel, h, a=None):
+    if a is None:
+        a = accel(X)
+    v = v + a * h
+    X = X + v * h
+    return X, v, None
+
+def velocity_verlet(X, v, accel, h, a=None):
+    #Kick-drift-kick leapfrog
+    if a is None:
+        a = accel(X)
+    v = v + a * (h/2)
+    X = X + v * h
+    a = accel(X)
+    v = v + a * (h/2)
+    return X, v, a
+
+def rk4(X, v, accel, h, a=None):
+    k1_X, k1_v = v, (accel(X) if a is None else a)
+    k2_X, k2_v = v + k1_v * (h/2), accel(X + k1_X * (h/2))
+    k3_X, k3_v = v + k2_v * (h/2), accel(X + k2_X * (h/2))
+    k4_X, k4_v = v + k3_v * h, accel(X + k3_X * h)
+
+    X = X + (k1_X + 2*k2_X + 2*k3_X + k4_X) * (h/6)
+    v = v + (k1_v + 2*k2_v + 2*k3_v + k4_v) * (h/6)
+    return X, v, None
+
+integrators = {
+    'euler' : semi_implicit_euler,
+    'verlet' : velocity_verlet,
+    'rk4' : rk4,
+}
+
+class SimulationClock():
+    # Fixed-timestep clock. Wall-clock frame times are added to an accumulator, which is then
+    # drained in steps of exactly dt, so the physics does not depend on the render rate.
+
+    def __init__(self, dt=1/60, max_frame_time=0.25):
+        self.dt = dt
+        self.max_frame_time = max_frame_time
+        self.accumulator = 0.
+        self.time = 0.
+
+    def advance(self, frame_time):
+        #Long frames are clamped so that one hitch can't turn into a huge burst of steps.
+        self.accumulator += min(frame_time, self.max_frame_time)
+
+        steps = int(self.accumulator // self.dt)
+        self.accumulator -= steps * self.dt
+        self.time += steps * self.dt
+        return steps
+
+    @property
+    def alpha(self):
+        #How far the render time is between the last two physics steps, in [0, 1).
+        return self.accumulator / self.dt
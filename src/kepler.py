@@ -0,0 +1,309 @@
+from math import *
+import numpy as np
+
+from gravity import *
+
+### ORBITS ###
+
+def stumpff(z):
+    #Stumpff functions C(z) and S(z), by their series near z = 0 where the closed forms cancel.
+    small = np.abs(z) < 1e-3
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        root = np.sqrt(np.abs(z))
+        C = np.where(z > 0, (1 - np.cos(root)) / z, (np.cosh(root) - 1) / -z)
+        S = np.where(z > 0, (root - np.sin(root)) / root**3, (np.sinh(root) - root) / root**3)
+    C = np.where(small, 1/2 - z/24 + z**2/720, C)
+    S = np.where(small, 1/6 - z/120 + z**2/5040, S)
+    return C, S
+
+class Orbits():
+    # Two-body orbits in closed form, one per row. Built from positions and velocities relative to
+    # the body being orbited and its G*M, an orbit can then be evaluated at any time after the
+    # epoch in the same constant cost, however far ahead that is. States come from the universal
+    # variable form of Kepler's equation, which holds for ellipses, hyperbolae and straight falls
+    # alike; the classical elements are kept as well for timing radius crossings.
+
+    def __init__(self, r, v, mu):
+        r_norm = np.sqrt(np.einsum('ij,ij->i', r, r))
+        v_squared = np.einsum('ij,ij->i', v, v)
+        r_dot_v = np.einsum('ij,ij->i', r, v)
+
+        self.r0, self.v0, self.mu = r, v, mu
+        self.r0_norm = r_norm
+        self.sigma0 = r_dot_v / np.sqrt(mu)
+        self.alpha = 2 / r_norm - v_squared / mu
+        with np.errstate(divide='ignore'):
+            self.period = np.where(self.alpha > 0, 2*pi / np.sqrt(mu * np.abs(self.alpha)**3), inf)
+
+        #The orbit plane is the screen, and sense is +1 for counterclockwise motion.
+        self.sense = np.where(r[:, 0] * v[:, 1] - r[:, 1] * v[:, 0] < 0, -1., 1.)
+
+        #Eccentricity vector, pointing at periapsis. Radial orbits are nudged off e = 1.
+        e_vector = ((v_squared - mu / r_norm)[:, np.newaxis] * r - r_dot_v[:, np.newaxis] * v) / mu[:, np.newaxis]
+        e = np.sqrt(np.einsum('ij,ij->i', e_vector, e_vector))
+        self.e = np.where(np.abs(e - 1) < 1e-9, 1 - 1e-9, e)
+        self.omega = np.arctan2(e_vector[:, 1], e_vector[:, 0])
+        self.a = -mu / (2 * (v_squared / 2 - mu / r_norm))
+        self.elliptic = self.e < 1
+        self.n = np.sqrt(mu / np.abs(self.a)**3)
+
+        #Mean anomaly at the epoch, from the true anomaly measured in the sense of motion.
+        nu = self.sense * (np.arctan2(r[:, 1], r[:, 0]) - self.omega)
+        e, ell = self.e, self.elliptic
+        with np.errstate(invalid='ignore'):
+            E = 2 * np.arctan2(np.sqrt(np.where(ell, 1 - e, 0)) * np.sin(nu / 2), np.sqrt(1 + e) * np.cos(nu / 2))
+            H = 2 * np.arctanh(np.clip(np.sqrt(np.where(ell, 0, (e - 1) / (e + 1))) * np.tan(nu / 2), -1 + 1e-16, 1 - 1e-16))
+        self.M0 = np.where(ell, E - e * np.sin(E), e * np.sinh(H) - H)
+
+    def __len__(self):
+        return len(self.e)
+
+    def mean_anomaly(self, t):
+        M = self.M0 + self.n * t
+        return np.where(self.elliptic, (M + pi) % (2*pi) - pi, M)
+
+    def state(self, t, tolerance=1e-12, iterations=50):
+        #Positions and velocities relative to the body being orbited, t seconds after the epoch.
+        r0, sigma0, alpha, sqrt_mu = self.r0_norm, self.sigma0, self.alpha, np.sqrt(self.mu)
+
+        #Bound orbits repeat, so only the time since the last whole period matters.
+        t = np.where(self.alpha > 0, t % np.where(np.isfinite(self.period), self.period, 1), t)
+
+        #The universal anomaly x solves F(x) = 0, and F grows with x, so Newton's method is kept
+        #inside a bracket and falls back on bisection whenever it would step out of it. Only the
+        #rows that have not converged yet are iterated on.
+        def kepler(x, k):
+            z = alpha[k] * x**2
+            C, S = stumpff(z)
+            F = sigma0[k] * x**2 * C + (1 - r0[k] * alpha[k]) * x**3 * S + r0[k] * x - sqrt_mu[k] * t[k]
+            r = sigma0[k] * x * (1 - z * S) + (1 - r0[k] * alpha[k]) * x**2 * C + r0[k]
+            return F, r
+
+        lo = np.zeros(len(t))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            hi = np.where(alpha > 0, 2*pi / np.sqrt(np.abs(alpha)), np.sqrt(r0))
+        active = np.arange(len(t))
+        for i in range(4 * iterations):
+            active = active[kepler(hi[active], active)[0] < 0]
+            if len(active) == 0:
+                break
+            lo[active], hi[active] = hi[active], 2 * hi[active]
+
+        #Bound orbits start from the guess for a circle, the rest from the middle of the bracket.
+        x = np.where(alpha > 0, np.clip(sqrt_mu * alpha * t, lo, hi), (lo + hi) / 2)
+        active = np.arange(len(t))
+        for i in range(iterations):
+            F, r = kepler(x[active], active)
+            below = F < 0
+            lo[active] = np.where(below, x[active], lo[active])
+            hi[active] = np.where(below, hi[active], x[active])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                newton = x[active] - F / r
+            inside = (newton >= lo[active]) & (newton <= hi[active])
+            x_new = np.where(inside, newton, (lo[active] + hi[active]) / 2)
+            done = np.abs(x_new - x[active]) <= tolerance * np.maximum(1, np.abs(x_new))
+            x[active] = x_new
+            active = active[~done]
+            if len(active) == 0:
+                break
+
+        #Lagrange coefficients carry the epoch state forward.
+        z = alpha * x**2
+        C, S = stumpff(z)
+        r = sigma0 * x * (1 - z * S) + (1 - r0 * alpha) * x**2 * C + r0
+        f = 1 - x**2 / r0 * C
+        g = t - x**3 / sqrt_mu * S
+        f_dot = sqrt_mu / (r * r0) * x * (z * S - 1)
+        g_dot = 1 - x**2 / r * C
+        return (f[:, np.newaxis] * self.r0 + g[:, np.newaxis] * self.v0,
+                f_dot[:, np.newaxis] * self.r0 + g_dot[:, np.newaxis] * self.v0)
+
+    def time_to_radius(self, t, R, inbound=True):
+        # Time after t until each orbit next falls to (or, if not inbound, climbs out to) the
+        # distance R; inf if it never does.
+        e, a, ell = self.e, self.a, self.elliptic
+        M = self.mean_anomaly(t)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c = (1 - R / a) / e
+            E = np.where(ell, np.arccos(np.clip(c, -1, 1)), np.arccosh(np.maximum(c, 1)))
+            M_R = np.where(ell, E - e * np.sin(E), e * np.sinh(E) - E)
+            target = -M_R if inbound else M_R
+
+            #Ellipses come round again; hyperbolae only pass each radius once each way.
+            dt = np.where(ell, ((target - M) % (2*pi)) / self.n, np.where(target > M, (target - M) / self.n, inf))
+            reached = np.where(ell, np.abs(c) <= 1, c >= 1)
+        return np.where(reached, dt, inf)
+
+### RAILS ###
+
+class Rails():
+    # Time warp on rails. Every moving body is put on the Keplerian orbit about its primary that
+    # matches its current state, and from then on its position is evaluated in closed form, so a
+    # frame costs the same at any warp factor. Bodies resting on their primary are carried along
+    # with it. Primaries come from the same sphere-of-influence hierarchy as
+    # SphereOfInfluenceGravity, and the heaviest source drifts in a straight line. Leaving a sphere
+    # re-patches the orbits at the crossing; firing the player's thrusters or falling within
+    # encounter times a source's radius drops the world back to numerical integration.
+
+    def __init__(self, encounter=2., max_events=8):
+        self.encounter = encounter
+        self.max_events = max_events
+        self.rows = None
+
+        #Kept across boardings, so the sphere-of-influence nesting is only redone when it changes.
+        self.gravity = SphereOfInfluenceGravity()
+
+        #Why warp last dropped back to 1, for the HUD.
+        self.reason = None
+
+    def clear(self):
+        self.rows = None
+
+    def board(self, world):
+        # Fits an orbit to every moving body. Returns False, with the reason set, if something is
+        # already too close to a source to go on rails.
+        store = world.store
+        moving = world.moving_objects()
+        sources = world.p_obj['gravity sources']
+        if not sources:
+            self.reason = 'no gravity sources'
+            return False
+
+        idx = store.indices(moving)
+        row = {obj.index : i for i, obj in enumerate(moving)}
+        source_rows = np.array([row[source.index] for source in sources], dtype=int)
+        X, v, m = store.X_cm[idx], store.v[idx], store.m[idx]
+
+        primary, parent, radius, depth, order = self.gravity.primaries(X, m, source_rows)
+        is_source = np.zeros(len(idx), dtype=bool)
+        is_source[source_rows] = True
+        p = np.maximum(primary, 0)
+        p_row = np.where(primary >= 0, source_rows[p], -1)
+
+        #Sources get their place in the hierarchy; everything else sits one level below its primary.
+        level = depth[p] + 1
+        level[source_rows] = depth
+
+        #Distance at which each body counts as a close encounter with its primary, and the
+        #sphere it would leave its primary through (sources keep theirs, the root has none).
+        R = self.encounter * np.array([source.size[0] / 2 for source in sources])
+        encounter = np.where(primary >= 0, R[p], 0.)
+        soi = np.where(is_source | (primary < 0), inf, radius[p])
+
+        r = X - X[np.maximum(p_row, 0)]
+        u = v - v[np.maximum(p_row, 0)]
+        distance = np.sqrt(np.einsum('ij,ij->i', r, r))
+        speed = np.sqrt(np.einsum('ij,ij->i', u, u))
+        near = (primary >= 0) & (distance < encounter)
+        landed = near & ~is_source & (speed < world.collisions.rest_speed)
+        if np.any(near & ~landed):
+            self.reason = 'close encounter'
+            return False
+
+        kepler = (primary >= 0) & ~landed
+        self.idx = idx
+        self.rows = np.nonzero(kepler)[0]
+        self.primary = primary
+        self.p_row = p_row
+        self.levels = [np.nonzero(level == k)[0] for k in range(level.max() + 1)]
+        self.X0, self.v0 = X, v
+        self.offset = r
+        self.landed = landed
+        self.encounter_R = encounter[kepler]
+        self.soi = soi[kepler]
+        self.orbits = Orbits(r[kepler], u[kepler], G * m[p_row[kepler]])
+        self.t = 0.
+
+        #Spheres grow and shrink with their source's distance from its parent. A body can only be
+        #handed over if the range of distances its conic covers about its primary meets the range
+        #swept by the sphere of another source orbiting the same primary, or goes beyond the
+        #smallest its primary's sphere gets. Only those bodies, and the sources themselves, are
+        #watched for handover; leaving the sphere as it is now is found by advance.
+        e, a = self.orbits.e, self.orbits.a
+        rp = a * (1 - e)
+        ra = np.where(self.orbits.elliptic, a * (1 + e), inf)
+        src = np.full(len(idx), -1)
+        src[source_rows] = np.arange(len(sources))
+        k = src[self.rows] >= 0
+        c = src[self.rows[k]]
+        reach = radius[c] * ra[k] / np.maximum(distance[self.rows[k]], 1e-9)
+        lo, hi = np.full(len(sources), inf), np.full(len(sources), -inf)
+        np.minimum.at(lo, primary[self.rows[k]], rp[k] - reach)
+        np.maximum.at(hi, primary[self.rows[k]], ra[k] + reach)
+        smallest = radius.copy()
+        smallest[c] = radius[c] * rp[k] / np.maximum(distance[self.rows[k]], 1e-9)
+        P = primary[self.rows]
+        watched = self.rows[~k & (((rp <= hi[P]) & (ra >= lo[P])) | (ra > smallest[P]))]
+        self.watch = np.union1d(watched, source_rows)
+        self.watch_sources = np.searchsorted(self.watch, source_rows)
+        return True
+
+    def state(self, t):
+        #Positions and velocities of every boarded body t seconds after boarding, primaries first.
+        X, v = self.X0 + self.v0 * t, self.v0.copy()
+        r, u = np.zeros_like(X), np.zeros_like(v)
+        r[self.rows], u[self.rows] = self.orbits.state(t)
+        r[self.landed] = self.offset[self.landed]
+
+        for rows in self.levels[1:]:
+            X[rows] = X[self.p_row[rows]] + r[rows]
+            v[rows] = v[self.p_row[rows]] + u[rows]
+        return X, v
+
+    def drop(self, world, reason):
+        world.warp = 1
+        self.reason = reason
+        self.clear()
+
+    def advance(self, world, dt):
+        # Moves the world dt seconds along the rails, re-patching at every sphere crossing on the
+        # way, and writes the result into the store.
+        ship = world.p_obj['player ship'][0]
+        if any(getattr(ship, 'start_' + action) for action in ship.actions):
+            self.drop(world, 'thrust')
+            return
+        if self.rows is None and not self.board(world):
+            world.warp = 1
+            return
+
+        store = world.store
+        for event in range(self.max_events):
+            t_encounter = self.orbits.time_to_radius(self.t, self.encounter_R, inbound=True)
+            t_exit = self.orbits.time_to_radius(self.t, self.soi, inbound=False)
+            first_encounter = t_encounter.min(initial=inf)
+            first_exit = t_exit.min(initial=inf)
+            step = min(dt, first_encounter, first_exit)
+
+            #Crossings are stepped just past, so the re-patched orbit starts outside the sphere.
+            if step == first_exit:
+                step = step * (1 + 1e-9) + 1e-6
+            self.t += step
+            dt -= step
+            X, v = self.state(self.t)
+            store.X_cm[self.idx] = X
+            store.v[self.idx] = v
+            store.rotate(self.idx, step)
+            store.place(self.idx)
+            world.clock.time += step
+
+            if step == first_encounter and step < inf:
+                self.drop(world, 'close encounter')
+                break
+            if dt <= 0:
+                break
+            if not self.board(world):
+                self.drop(world, self.reason)
+                break
+
+        #Handover into a smaller sphere is only noticed at the end of the frame.
+        if self.rows is not None:
+            changed = len(world.moving_objects()) != len(self.idx)
+            if not changed:
+                watch = self.idx[self.watch]
+                primary = self.gravity.primaries(store.X_cm[watch], store.m[watch], self.watch_sources)[0]
+                changed = np.any(primary != self.primary[self.watch])
+            if changed:
+                if not self.board(world):
+                    self.drop(world, self.reason)
+
+        world.place_ships()
@@ -1,3 +1,4 @@
+import sys
 import pygame
 import time
 import numpy as np
@@ -6,40 +7,111 @@ from camera import *
 from world import *
 from physics import *
 from player import *
+from scenarios import *
+from snapshot import *
+from replay import *
+from pipeline import *
 
 pygame.init()
 
-def initialize_world():
+def initialize_world(camera):
 
     ### WORLD'S INITIAL SETTINGS ###
 
-    initial_objects = [GravitationalBody(X = np.array([1.5*10**11, 0]), m = 1.989*10**32, sprites = {'default' : pygame.image.load('graphics/Sun.png')}),
-                       GravitationalBody(X = np.array([-1500, 0]), m = 10**19, sprites = {'default' : pygame.image.load('graphics/Earth.png')})]
-
-    player_ship = Ship(module_type="Core", v = np.array([0,-500]))
-    world = World(player_ship, Camera(), initial_objects)
-
+    #The same scenario can be run without a display through headless.run.
+    world = solar_system(camera)
+    world.attach(Autosave('autosave.snap'))
     return world
 
 def gameLoop():
 
+    #python main.py --record path logs every frame's input for replay.py, --profile path
+    #streams every frame's per-phase times to a CSV file, and --pipeline serial runs the
+    #simulation and the drawing one after the other on the main thread.
+    options = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+    recorder = Recorder(options['--record']) if '--record' in options else None
+
+    if options.get('--pipeline', 'threaded') == 'threaded':
+        threadedLoop(options, recorder)
+    else:
+        serialLoop(options, recorder)
+
+    if recorder is not None:
+        recorder.close()
+
+    pygame.quit()
+    quit()
+
+def serialLoop(options, recorder):
+
     t0 = time.time()
 
-    world = initialize_world()
+    world = initialize_world(Camera())
     player = Player(world.p_obj['player ship'][0])
+
+    if '--profile' in options:
+        world.profiler.open_csv(options['--profile'])
     
     while not world.game_exit:
 
         while world.game_over: world.welcome()
-              
-        player.get_controls(world)
+
+        with world.profiler.phase('events'):
+            events, mouse = pygame.event.get(), pygame.mouse.get_pos()
+            player.get_controls(world, events, mouse)
 
         dt = time.time() - t0
         t0 = time.time()
 
         world.update(dt)
 
-    pygame.quit()
-    quit()
+        if recorder is not None:
+            recorder.record(dt, events, mouse, world)
+
+    world.profiler.close()
+
+def threadedLoop(options, recorder):
+
+    #The world only ever sees a Viewport; the Camera draws whatever the simulation publishes.
+    camera = Camera()
+    world = initialize_world(Viewport(camera.display_size))
+    player = Player(world.p_obj['player ship'][0])
+    simulation = Simulation(world, player, recorder)
+
+    #--profile streams the simulation's phases; the display's own are shown with F3.
+    if '--profile' in options:
+        world.profiler.open_csv(options['--profile'])
+
+    waiting = True
+    while waiting and not world.game_exit:
+        camera.print_welcome()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                world.game_exit = True
+            elif event.type == pygame.KEYDOWN:
+                waiting = False
+
+    world.game_over = False
+    simulation.start()
+
+    while not world.game_exit:
+
+        with camera.profiler.phase('events'):
+            events, mouse = pygame.event.get(), pygame.mouse.get_pos()
+            simulation.send(events, mouse)
+
+            #The window belongs to this thread, so it is resized and closed here as well.
+            for event in events:
+                if event.type == pygame.VIDEORESIZE:
+                    camera.resize(event.w, event.h)
+                elif event.type == pygame.QUIT:
+                    world.game_exit = True
+
+        previous, current, alpha = simulation.latest(time.perf_counter())
+        if current is not None:
+            camera.present(previous, current, alpha)
+
+    simulation.stop()
+    world.profiler.close()
 
 gameLoop()
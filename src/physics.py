@@ -2,11 +2,33 @@ from math import *
 import numpy as np
 import pygame
 
+from store import *
+from assets import *
+from blueprint import *
+
 class PhysicsObject():
     # All physics terms are represented by their common letters. All vector quantities follow
     # standard convention (X[0] = X, X[1] = y, F[0] = F_X, F[1] = F_y, etc.)
 
-    default_params = {
+    #State that is integrated every frame lives in one shared ComponentStore; these are views into it.
+    store = ComponentStore()
+
+    X = component('X')
+    X_cm = component('X_cm')
+    v = component('v')
+    a = component('a')
+    F = component('F')
+    rel_X_cm = component('rel_X_cm')
+
+    theta = component('theta')
+    omega = component('omega')
+    alpha = component('alpha')
+    tau = component('tau')
+    m = component('m')
+    I = component('I')
+
+    #Each class lists only the parameters it adds; an instance gets the merged schema of its MRO.
+    params = {
         'F' : np.array([0,0]),
         'a' : np.array([0,0]),
         'X' : np.array([0,0]),
@@ -29,23 +51,41 @@ class PhysicsObject():
         'alpha_buffer' : 9
     }
 
+    __slots__ = ('index', 'p', 'L', 'orientation', 'size', 'sprites', 'alpha_buffer', 'current_sprite')
+
+    schemas = {}
+
+    @classmethod
+    def schema(cls):
+        if cls not in PhysicsObject.schemas:
+            merged = {}
+            for klass in reversed(cls.__mro__):
+                merged.update(klass.__dict__.get('params', {}))
+            PhysicsObject.schemas[cls] = merged
+        return PhysicsObject.schemas[cls]
+
     def __init__(self, **kwargs):
 
-        for var in self.default_params:
-            exec('self.%s = kwargs.pop("%s", self.default_params["%s"])' % (var,var,var))
+        self.index = self.store.add(self)
+
+        for var, default in self.schema().items():
+            if var in kwargs:
+                setattr(self, var, kwargs[var])
+            else:
+                setattr(self, var, default.copy() if isinstance(default, (list, dict)) else default)
             
         self.I = (self.m * self.size**2) / 6
         self.X_cm = self.X + self.rel_X_cm
 
         if 'default' not in self.sprites.keys():
-            self.sprites = {'default' : pygame.image.load("graphics/" + type(self).__name__ + ".png")}
+            self.sprites = {'default' : assets.get(type(self).__name__)}
         
         self.current_sprite = self.sprites['default']
         self.size = np.asarray(self.current_sprite.get_size()) - self.alpha_buffer
 
-    def add_params(self, **kwargs):
-        for new_param, default in kwargs.items():
-            self.default_params[str(new_param)] = default
+    def release(self):
+        #Hands this object's row back to the store once it has left the world.
+        self.store.remove(self.index)
 
     def change_F(self, dF):
         self.F = self.F + dF
@@ -54,36 +94,22 @@ class PhysicsObject():
         self.tau = self.tau + dtau
         
     def update_physics(self, dt):
-        self.alpha = self.tau / self.I
-        self.omega = self.omega + self.alpha * dt
-        self.theta = (self.theta + self.omega * dt) % (2*pi)
-
-        self.a = self.F / self.m
-        self.v = self.v + self.a * dt
-        self.X_cm = self.X_cm + self.v * dt
-        
-        #Distance and Angle relative to X_cm
-        distance = hypot(self.rel_X_cm[1], self.rel_X_cm[0])
-        theta0 = atan2(self.rel_X_cm[1], self.rel_X_cm[0])
-        
-        self.X[0] = self.X_cm[0] - distance*cos(self.theta - theta0)
-        self.X[1] = self.X_cm[1] + distance*sin(self.theta - theta0)
-
-        self.F = np.array([0,0])
-        self.tau = 0
+        self.store.integrate([self.index], dt)
 
 class Module(PhysicsObject):
 
-    module_orientation = 0
+    params = {'module_type' : "Hull", 'health' : 0, 'module_orientation' : 0}
+
+    __slots__ = ('module_type', 'health', 'module_orientation', 'following_mouse', 'pose_slot')
 
     def __init__(self, **kwargs):
         
-        self.add_params(module_type="Hull", health=0)
         super().__init__(**kwargs)
 
-        self.sprites['default'] = pygame.image.load("graphics/" + type(self).__name__ + ".png")
+        self.sprites['default'] = assets.get(type(self).__name__)
                   
         self.following_mouse = False
+        self.pose_slot = None
         
 
     def follow_mouse(self, mouse_position):
@@ -91,19 +117,14 @@ class Module(PhysicsObject):
         self.X_cm = self.X
 
     def follow(self, point, orientation, target):
-        sized_position = np.multiply(point, self.size)
-        
-        distance = hypot(target.rel_X_cm[1] - sized_position[1], target.rel_X_cm[0] - sized_position[0])
-        theta0 = atan2(target.rel_X_cm[1] - sized_position[1], target.rel_X_cm[0] - sized_position[0])
-
-        self.X[0] = target.X_cm[0] - distance*cos(target.theta - theta0)
-        self.X[1] = target.X_cm[1] + distance*sin(target.theta - theta0)
-        self.theta = target.theta + orientation * (pi/2)
+        target.place_modules([self.index], np.multiply([point], self.size), np.array([orientation]))
 
 class GravitationalBody(PhysicsObject):
 
     G = 6.67408 * 10**-11
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
 
         super().__init__(**kwargs)
@@ -116,25 +137,38 @@ class GravitationalBody(PhysicsObject):
 
 class AttachedModule(Module):
 
+    #A module with no core_module is its own core.
+    params = {'module_coordinates' : [0,0], 'core_module' : None}
+
+    __slots__ = ('module_coordinates', 'core_module')
+
     def __init__(self, **kwargs):
         
-        self.add_params(module_coordinates=[0,0], module_orientation=0, core_module=self)
         super().__init__(**kwargs)
 
+        if self.core_module is None:
+            self.core_module = self
+
 class Hull(AttachedModule):
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         
         super().__init__(**kwargs)
         
 class Thruster(AttachedModule):
+
+    params = {'F_max' : 2000000, 'tau_max' : 0}
+
+    __slots__ = ('F_max', '_tau_max', 'thruster_slot')
                                     
     def __init__(self, **kwargs):
         
-        self.add_params(F_max=2000000, tau_max=0)
+        self.thruster_slot = None
         super().__init__(**kwargs)
 
-        self.sprites['on'] = pygame.image.load("graphics/" + type(self).__name__ + "_on.png")
+        self.sprites['on'] = assets.get(type(self).__name__ + "_on")
         
         if self.module_orientation == 0:
             self.F_max = np.array([self.F_max, 0])
@@ -144,31 +178,45 @@ class Thruster(AttachedModule):
             self.F_max = np.array([-self.F_max, 0])
         elif self.module_orientation == 3:
             self.F_max = np.array([0, self.F_max])
-        
-        self.start_thruster = False
-        self.stop_thruster = False
-            
-    def thruster(self):
-        if self.stop_thruster == True:
-            
-            self.stop_thruster = False
-            self.start_thruster = False
 
-            self.current_sprite = self.sprites['default']
+    #Once attached, a thruster's torque comes from its ship's blueprint, which only rebuilds its
+    #allocation matrix after the layout (and with it the centre of mass) has changed.
+    @property
+    def tau_max(self):
+        blueprint = getattr(self.core_module, 'blueprint', None)
+        if blueprint is None or self.thruster_slot is None:
+            return self._tau_max
+        return blueprint.torques()[self.thruster_slot]
+
+    @tau_max.setter
+    def tau_max(self, value):
+        self._tau_max = value
             
-        elif self.start_thruster == True:
-            self.core_module.net_turn += self.tau_max
-            self.core_module.net_thrust += self.F_max
-            
-            self.current_sprite = self.sprites['on']
-
 class Ship(Thruster):
+
+    params = {'attached_modules' : None}
+
+    #These are for determining whether the ship's thrusters are on or off.
+    actions = ('forward','left','backward','right','rotate_positive','rotate_negative')
+
+    __slots__ = ('attached_modules', 'blueprint', 'surrounding_points',
+                 'ship_m', 'ship_I', 'ship_F_max', 'ship_rel_X_cm',
+                 'core_m', 'core_I', 'core_F_max', 'core_rel_X_cm', 'core_tau_max',
+                 'net_turn', 'net_thrust', 'firing', 'firing_version') + \
+                tuple('start_' + action for action in actions) + tuple('stop_' + action for action in actions)
                                     
     def __init__(self, **kwargs):
 
-        self.add_params(surrounding_points = [[1,0],[0,1],[-1,0],[0,-1]], attached_modules=[self])
         super().__init__(**kwargs)
 
+        if self.attached_modules is None:
+            self.attached_modules = [self]
+
+        #Occupied and attachable grid cells, plus running mass sums for the whole ship.
+        self.blueprint = Blueprint()
+        self.blueprint.add(self, (0, 0))
+        self.surrounding_points = self.blueprint.attach_points
+
         #Here are replacement variables to determine mass of the whole ship.
         self.ship_m = self.m
         self.ship_I = self.I
@@ -182,136 +230,102 @@ class Ship(Thruster):
         self.core_rel_X_cm = np.array(self.rel_X_cm)
         self.core_tau_max = -np.cross(self.core_F_max, self.rel_X_cm)
 
-        #These params are for determining whether the ship's thrusters are on or off.
-        self.actions = ['forward','left','backward','right','rotate_positive','rotate_negative']
-        
         for action in self.actions:
-            exec('self.start_' + action + ' = False')
-            exec('self.stop_' + action + ' = False')
+            setattr(self, 'start_' + action, False)
+            setattr(self, 'stop_' + action, False)
         
         #These params are for consolidating the components of net torque and force from the ship.
         self.net_turn = 0
         self.net_thrust = np.array([0,0])
+
+        #Which of the blueprint's thrusters fired last frame.
+        self.firing = None
+        self.firing_version = -1
         
-    def reset_params(self):
+    def place_modules(self, rows=None, offsets=None, orientations=None):
+        #Moves modules rigidly with the ship: one rotation for all of them. Defaults to every
+        #attached module, using the offsets the blueprint keeps for them.
+        if rows is None:
+            rows, offsets, orientations = self.blueprint.pose_arrays()
+        self.store.pose(self.index, rows, offsets, orientations)
+
+    def attach(self, module):
+        self.attached_modules.append(module)
+        self.blueprint.add(module, module.module_coordinates)
+        self.update_mass_properties()
+
+    def detach(self, module):
+        self.attached_modules.remove(module)
+        self.blueprint.remove(module.module_coordinates)
+        self.update_mass_properties()
+
+    def update_mass_properties(self):
+        #O(1): everything comes from the blueprint's running sums.
+        self.set_mass_properties(self.blueprint.m, self.blueprint.center_of_mass(), self.blueprint.inertia())
+
+    def set_mass_properties(self, m, rel_X_cm, I):
         old_rel_X_cm = np.array(self.rel_X_cm)
-        
-        self.ship_m = 0
-        self.ship_tau_max = 0
-        self.ship_F_max = np.array([0,0])
-        self.rel_X_cm = np.array([0,0])
-        
+
+        self.ship_m = m
+        self.rel_X_cm = rel_X_cm
+
+        #This makes it so that the ship doesn't jump once the center of mass changes
+        self.X_cm = self.X_cm + (self.rel_X_cm - old_rel_X_cm)
+        self.I = I
+
+    def mass_properties(self):
+        #Full O(n) recompute over attached_modules, kept as the reference for the blueprint's sums.
+        ship_m = 0
+        rel_X_cm = np.array([0.,0.])
+
         #Recalculating ship's mass
         for module in self.attached_modules:
-            self.ship_m += module.m
+            ship_m += module.m
             
         #Recaclulating ship's center of mass
         for module in self.attached_modules:
-            self.rel_X_cm[0] += (1 / self.ship_m)*(module.m * (module.module_coordinates[0]*module.size[0]))
-            self.rel_X_cm[1] += (1 / self.ship_m)*(module.m * (module.module_coordinates[1]*module.size[0]))
-
-        #This makes it so that the ship doesn't jump once the center of mass changes
-        deltarel_X_cm = np.add(self.rel_X_cm, -old_rel_X_cm)
-        self.X_cm = self.X_cm + deltarel_X_cm
-
-        self.I = self.core_I
+            rel_X_cm[0] += (1 / ship_m)*(module.m * (module.module_coordinates[0]*module.size[0]))
+            rel_X_cm[1] += (1 / ship_m)*(module.m * (module.module_coordinates[1]*module.size[0]))
 
         #Recalculating ship's moment of inertia using parallel-axis theorem
+        I = 0
         for module in self.attached_modules:
-            d = hypot((module.module_coordinates[0]*module.size[0]) - self.rel_X_cm[0],
-                           (module.module_coordinates[1]*module.size[0]) - self.rel_X_cm[1])
-            self.I += module.I + module.m*d**2
-        self.I -= self.core_I
+            d = hypot((module.module_coordinates[0]*module.size[0]) - rel_X_cm[0],
+                           (module.module_coordinates[1]*module.size[0]) - rel_X_cm[1])
+            I += (self.core_I if module is self else module.I) + module.m*d**2
 
-        #Recalculating each module's torque
-        for module in self.attached_modules:
-            if type(module).__name__ == "Thruster" or type(module).__name__ == "Ship":
-                module.tau_max = -np.cross(module.F_max, np.add(self.rel_X_cm, -np.multiply(module.module_coordinates,module.size[0])))
+        return ship_m, rel_X_cm, I
+
+    def reset_params(self):
+        self.set_mass_properties(*self.mass_properties())
 
     def controls(self):
         self.reset_thrust()
-        
-        #Forward
-        if self.stop_forward == True:
-            for module in self.attached_modules:
-                module.stop_thruster = True
-
-            self.start_forward = False
-            self.stop_forward = False
-        
-        elif self.start_forward == True:
-            for module in self.attached_modules:
-                if (type(module).__name__ == "Thruster" or type(module).__name__ == "Ship") and module.F_max[0] > 0:
-                    module.start_thruster = True
-    
-        #Left
-        if self.stop_left == True:
-            for module in self.attached_modules:
-                module.stop_thruster = True
-
-            self.start_left = False
-            self.stop_left = False
-        
-        elif self.start_left == True:
-            for module in self.attached_modules:
-                if (type(module).__name__ == "Thruster" or type(module).__name__ == "Ship") and module.F_max[1] < 0:
-                    module.start_thruster = True
-
-        #Backward
-        if self.stop_backward == True:
-            for module in self.attached_modules:
-                module.stop_thruster = True
-
-            self.start_backward = False
-            self.stop_backward = False
-        
-        elif self.start_backward == True:
-            for module in self.attached_modules:
-                if (type(module).__name__ == "Thruster" or type(module).__name__ == "Ship") and module.F_max[0] < 0:
-                    module.start_thruster = True
-
-        #Right
-        if self.stop_right == True:
-            for module in self.attached_modules:
-                module.stop_thruster = True
-
-            self.start_right = False
-            self.stop_right = False
-        
-        elif self.start_right == True:
-            for module in self.attached_modules:
-                if (type(module).__name__ == "Thruster" or type(module).__name__ == "Ship") and module.F_max[1] > 0:
-                    module.start_thruster = True
-
-        #Rotate Positive
-        if self.stop_rotate_positive == True:
-            for module in self.attached_modules:
-                module.stop_thruster = True
-
-            self.start_rotate_positive = False
-            self.stop_rotate_positive = False
-        
-        elif self.start_rotate_positive == True:
-            for module in self.attached_modules:
-                if (type(module).__name__ == "Thruster" or type(module).__name__ == "Ship") and module.tau_max > 0.1:
-                    module.start_thruster = True
-                    
-        #Rotate Negative
-        if self.stop_rotate_negative == True:
-            for module in self.attached_modules:
-                module.stop_thruster = True
-
-            self.start_rotate_negative = False
-            self.stop_rotate_negative = False
-            
-        elif self.start_rotate_negative == True:
-            for module in self.attached_modules:
-                if (type(module).__name__ == "Thruster" or type(module).__name__ == "Ship") and module.tau_max < -0.1:
-                    module.start_thruster = True
 
-        for module in self.attached_modules:
-            if type(module).__name__ == "Thruster" or type(module).__name__ == "Ship":
-                module.thruster()
+        #A stop_ flag releases its key; whatever is still held keeps firing.
+        held = np.zeros(len(self.actions))
+        for k, action in enumerate(self.actions):
+            if getattr(self, 'stop_' + action):
+                setattr(self, 'start_' + action, False)
+                setattr(self, 'stop_' + action, False)
+            held[k] = getattr(self, 'start_' + action)
+
+        #Every thruster in a held group fires, and the net body-frame force and torque is one product.
+        matrix, groups = self.blueprint.allocation()
+        firing = held @ groups > 0
+        self.net_thrust = matrix[:2] @ firing
+        self.net_turn = matrix[2] @ firing
+
+        #Only thrusters that switched on or off this frame change sprite.
+        if self.firing is None or self.firing_version != self.blueprint.version:
+            changed = np.ones(len(firing), dtype=bool)
+        else:
+            changed = firing != self.firing
+        for slot in np.nonzero(changed)[0]:
+            thruster = self.blueprint.thrusters[slot]
+            thruster.current_sprite = thruster.sprites['on' if firing[slot] else 'default']
+        self.firing = firing
+        self.firing_version = self.blueprint.version
 
         self.apply_thrust()
 
@@ -347,6 +361,11 @@ class Ship(Thruster):
     '''
 
 class Enemy(Ship):
+
+    #One of steering.behaviours, carried out for every enemy at once by World.apply_other_thrusters.
+    params = {'behaviour' : 'flee'}
+
+    __slots__ = ('behaviour',)
                                     
     def __init__(self, **kwargs):
         
@@ -373,3 +392,6 @@ class Enemy(Ship):
             self.F = [self.F_max[0], self.F_max]
         else:
             self.F = [0,0]
+
+#Attachable module classes by module_type, so that modules can be rebuilt from their type name.
+module_types = {cls.__name__ : cls for cls in (Module, Hull, Thruster, Ship, Enemy)}
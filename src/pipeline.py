@@ -0,0 +1,148 @@
+import time
+import threading
+import collections
+import types
+from math import *
+import numpy as np
+
+from camera import *
+
+### RENDER STATE ###
+
+class RenderState():
+    # Everything the display needs to draw one simulation step, copied out of the world when the
+    # step ends. A RenderState is never modified once it is published, so the display thread can
+    # read it while the simulation thread is already writing the next one.
+
+    __slots__ = ('time', 'wall', 'keys', 'X', 'theta', 'sprites', 'size', 'position', 'scale',
+                 'show_profile', 'ships', 'ship', 'warp', 'reason', 'trajectory', 'profile')
+
+    def interpolate(self, previous, alpha):
+        # Sprite positions, angles and view position alpha of the way from previous to this
+        # state. Objects that are new in this state are drawn where they are now.
+        X, theta, position = self.X, self.theta, self.position
+        if previous is None or alpha >= 1:
+            return X, theta, position
+
+        k = np.searchsorted(previous.keys, self.keys)
+        k = np.minimum(k, len(previous.keys) - 1)
+        found = previous.keys[k] == self.keys if len(previous.keys) else np.zeros(len(self.keys), dtype=bool)
+
+        X_0, theta_0 = X.copy(), theta.copy()
+        X_0[found], theta_0[found] = previous.X[k[found]], previous.theta[k[found]]
+
+        #Angles are interpolated the short way round, so a wrap from 2pi to 0 does not spin.
+        turn = (theta - theta_0 + pi) % (2*pi) - pi
+        return X_0 + (X - X_0) * alpha, theta - turn * (1 - alpha), previous.position + (position - previous.position) * alpha
+
+def capture_render_state(world, wall, margin=1000):
+    # RenderState of the world as it is now, holding only objects near the view.
+    view = world.camera
+    ship = world.p_obj['player ship'][0]
+    lo = view.position - margin
+    hi = view.position + view.display_size / view.scale + margin
+    objects = world.objects_in(lo, hi)
+
+    state = RenderState()
+    state.time = world.clock.time
+    state.wall = wall
+    state.keys = np.array([obj.index for obj in objects], dtype=int)
+    state.X = world.store.X[state.keys].copy()
+    state.theta = world.store.theta[state.keys].copy()
+    state.sprites = [obj.current_sprite for obj in objects]
+    state.size = [np.array(obj.size) for obj in objects]
+    state.position = np.array(view.position, dtype=float)
+    state.scale = view.scale
+    state.show_profile = view.show_profile
+    state.ships = {obj.index : obj.blueprint.layout() for obj in objects if getattr(obj, 'blueprint', None) is not None}
+
+    #print_stats only reads v, X and a, so a plain copy of those stands in for the ship.
+    state.ship = types.SimpleNamespace(v=ship.v.copy(), X=ship.X.copy(), a=np.array(ship.a))
+    state.warp = world.warp
+    state.reason = world.rails.reason
+    state.trajectory = world.trajectory.points.copy() if view.show_trajectory else None
+    state.profile = world.profiler.percentiles() if view.show_profile else None
+    return state
+
+### SIMULATION THREAD ###
+
+class Simulation():
+    # Runs the world on a thread of its own, one fixed step of world.clock.dt at a time, while
+    # the main thread only draws. Input goes in through commands, a deque of (events, mouse)
+    # pairs: appending and popping at opposite ends of a deque are atomic, so neither thread
+    # ever waits on a lock. Output comes back through published, a (previous, current) pair of
+    # RenderStates that is replaced with a single assignment after every step, so the display
+    # always sees two consecutive states to interpolate between.
+    #
+    # The world's camera must be a Viewport: the Camera and everything else that touches the
+    # display stays on the main thread.
+
+    def __init__(self, world, player, recorder=None):
+        self.world = world
+        self.player = player
+        self.recorder = recorder
+        self.dt = world.clock.dt
+
+        self.commands = collections.deque()
+        self.published = (None, None)
+        self.steps = 0
+        self.running = False
+        self.thread = None
+        world.attach(self)
+
+    def send(self, events, mouse):
+        self.commands.append((events, mouse))
+
+    def render(self, world):
+        #Called by the world at the end of every step, after the Viewport has tracked the ship.
+        if world.camera.show_trajectory:
+            with world.profiler.phase('predict'):
+                world.trajectory.update(world)
+        self.published = (self.published[1], capture_render_state(world, time.perf_counter()))
+
+    def tick(self):
+        #All input that arrived since the last step is applied at once, keeping the last cursor.
+        events, mouse = [], self.world.camera.mouse
+        while self.commands:
+            more, mouse = self.commands.popleft()
+            events.extend(more)
+
+        world = self.world
+        with world.profiler.phase('events'):
+            self.player.get_controls(world, events, mouse)
+        world.update(self.dt)
+        self.steps += 1
+
+        if self.recorder is not None:
+            self.recorder.record(self.dt, events, mouse, world)
+
+    def run(self):
+        next_step = time.perf_counter()
+        while self.running and not self.world.game_exit:
+            self.tick()
+            next_step += self.dt
+            delay = next_step - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -self.world.clock.max_frame_time:
+                #Too far behind to catch up; carry on from now rather than bursting.
+                next_step = time.perf_counter()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def latest(self, now):
+        # (previous, current, alpha) for drawing at wall time now. The display runs one step
+        # behind the simulation, so alpha places it between the last two published states.
+        previous, current = self.published
+        if previous is None:
+            return previous, current, 1.
+        alpha = (now - self.dt - previous.wall) / max(current.wall - previous.wall, 1e-9)
+        return previous, current, min(max(alpha, 0.), 1.)
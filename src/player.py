@@ -8,9 +8,14 @@ class Player():
     def __init__(self, ship):
         self.ship = ship
 
-    def get_controls(self, world):
+    def get_controls(self, world, events=None, mouse=None):
+        #Live play reads pygame directly; a replay passes in the recorded events and cursor instead.
+        if events is None:
+            events = pygame.event.get()
+            mouse = pygame.mouse.get_pos()
+        world.camera.mouse = np.asarray(mouse)
 
-        for event in pygame.event.get():
+        for event in events:
 
             if event.type == pygame.QUIT:
                 world.game_exit = True
@@ -28,6 +33,17 @@ class Player():
                 if event.key == pygame.K_c:
                     world.camera.mode = (world.camera.mode + 1) % 2
 
+                if event.key == pygame.K_F3:
+                    world.camera.show_profile = not world.camera.show_profile
+
+                if event.key == pygame.K_p:
+                    world.camera.show_trajectory = not world.camera.show_trajectory
+
+                if event.key == pygame.K_PERIOD:
+                    world.set_warp(world.warp * 10)
+                if event.key == pygame.K_COMMA:
+                    world.set_warp(world.warp // 10)
+
                 if event.key == pygame.K_n:
                     world.p_obj['other ships'].append(Enemy(X=np.add(world.camera.get_mouse_pos(),world.camera.position)))
                 if event.key == pygame.K_m:
@@ -50,6 +66,7 @@ class Player():
 
                 if event.key == pygame.K_r:
                     self.reset()
+                    world.edited()
 
             if event.type == pygame.KEYUP:
                 if event.key == pygame.K_w:
@@ -67,8 +84,14 @@ class Player():
 
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
-                    for module in world.p_obj['free modules']:
-                        
+                    #Only free modules near the cursor in the world's spatial index are tested.
+                    mouse = world.camera.get_mouse_pos() + world.camera.position
+                    reach = max(self.ship.current_sprite.get_size()) * world.camera.scale
+                    free = set(world.p_obj['free modules'])
+                    for module in world.objects_in(mouse - reach, mouse + reach):
+                        if module not in free:
+                            continue
+
                         min_x = module.X[0] - module.current_sprite.get_size()[0]/2 * world.camera.scale
                         max_x = module.X[0] + module.current_sprite.get_size()[0]/2 * world.camera.scale
                         min_y = module.X[1] - module.current_sprite.get_size()[1]/2 * world.camera.scale
@@ -107,6 +130,7 @@ class Player():
                             new_point = world.camera.mouse_to_relative_point(self.ship)
                             if new_point != False:
                                 self.attach_module(world.p_obj['free modules'].pop(world.p_obj['free modules'].index(following_module)), new_point, module.module_orientation)
+                                world.edited()
 
                     '''
                     for module in self.ship.attached_modules:
@@ -124,31 +148,13 @@ class Player():
 
     def attach_module(self, old_module, point, orientation):
 
-        self.ship.attached_modules.append(eval(old_module.module_type)(m=old_module.m,X=old_module.X,
-                                                                  core_module=self.ship,module_coordinates=point,
-                                                                  module_type=old_module.module_type,
-                                                                  module_orientation=orientation))  
-        self.gen_surrounding_points(point)
-        self.ship.reset_params()
+        self.ship.attach(module_types[old_module.module_type](m=old_module.m,X=old_module.X,
+                                                              core_module=self.ship,module_coordinates=point,
+                                                              module_type=old_module.module_type,
+                                                              module_orientation=orientation))
+        old_module.release()
 
     def remove_module(self, old_module, point, orientation):
 
-        self.ship.attached_modules.remove(old_module)
-
-        self.gen_surrounding_points(point)
-        self.ship.reset_params()
-
-    def gen_surrounding_points(self, point):
-        for i in [-1,1]:
-            if [point[0]+i, point[1]] not in self.ship.surrounding_points and \
-            [point[0]+i, point[1]] not in [self.ship.attached_modules[n].module_coordinates for n in range(len(self.ship.attached_modules))]:
-                self.ship.surrounding_points.append([point[0]+i, point[1]])
-        for j in [-1,1]:
-            if [point[0], point[1]+j] not in self.ship.surrounding_points and \
-            [point[0], point[1]+j] not in [self.ship.attached_modules[n].module_coordinates for n in range(len(self.ship.attached_modules))]:
-                self.ship.surrounding_points.append([point[0], point[1]+j])
-        self.ship.surrounding_points.remove(point)
-        if [0,0] in self.ship.surrounding_points:
-            self.ship.surrounding_points.remove([0,0])
-
-        
+        self.ship.detach(old_module)
+        old_module.release()
@@ -0,0 +1,80 @@
+import time
+import numpy as np
+from contextlib import contextmanager
+
+class FrameProfiler():
+    # Wall time spent in each phase of a frame. Phases nest, and time is only charged to the
+    # innermost one, so gravity evaluated inside integration is not counted twice. A frame's
+    # total is the wall time since the last frame ended, and whatever no phase accounts for is
+    # its 'other'. The last window frames are kept in a ring buffer for percentiles, and every
+    # frame can also be streamed to a CSV file.
+
+    phases = ('events', 'controls', 'collisions', 'gravity', 'integration', 'follow', 'index', 'predict', 'draw', 'hud', 'flip', 'wait')
+
+    def __init__(self, window=600):
+        self.column = {name : k for k, name in enumerate(self.phases)}
+        self.current = np.zeros(len(self.phases))
+        self.samples = np.zeros((len(self.phases) + 2, window))
+        self.frames = 0
+        self.ended = None
+
+        self.stack = []
+        self.resumed = 0.
+        self.csv = None
+
+    def start(self, name):
+        now = time.perf_counter()
+        if self.stack:
+            self.current[self.stack[-1]] += now - self.resumed
+        self.stack.append(self.column[name])
+        self.resumed = now
+
+    def stop(self):
+        now = time.perf_counter()
+        self.current[self.stack.pop()] += now - self.resumed
+        self.resumed = now
+
+    @contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def frame(self):
+        #Closes the current frame; the last two rows of samples are the frame's other and total.
+        #The first frame has no previous end to measure from, so its total is its phases.
+        now = time.perf_counter()
+        phases = self.current.sum()
+        total = phases if self.ended is None else max(now - self.ended, phases)
+        self.ended = now
+
+        slot = self.frames % self.samples.shape[1]
+        self.samples[:-2, slot] = self.current
+        self.samples[-2, slot] = total - phases
+        self.samples[-1, slot] = total
+        self.frames += 1
+
+        if self.csv is not None:
+            self.csv.write("%d,%s\n" % (self.frames, ",".join("%.6f" % (t * 1000) for t in self.samples[:, slot])))
+        self.current[:] = 0
+
+    def percentiles(self, q=(50, 95, 99)):
+        # {phase : (p50, p95, p99)} in milliseconds over the frames in the window, with time
+        # outside every phase under 'other' and the whole frame under 'total'.
+        n = min(self.frames, self.samples.shape[1])
+        if n == 0:
+            return {}
+        p = np.percentile(self.samples[:, :n], q, axis=1).T * 1000
+        return dict(zip(self.phases + ('other', 'total'), map(tuple, p)))
+
+    def open_csv(self, path):
+        #Per-frame times in milliseconds, one column per phase.
+        self.csv = open(path, 'w')
+        self.csv.write("frame,%s,other,total\n" % ",".join(self.phases))
+
+    def close(self):
+        if self.csv is not None:
+            self.csv.close()
+            self.csv = None
@@ -0,0 +1,139 @@
+import sys
+import json
+import time
+import struct
+import hashlib
+import numpy as np
+import pygame
+
+from camera import *
+from player import *
+from scenarios import *
+
+### LOG FORMAT ###
+
+# A recording is an 8 byte magic, a format version and header length, a JSON header naming the
+# scenario, and then one record per frame: the frame time passed to World.update, the cursor in
+# display pixels, the number of events, a flag saying whether a state digest follows, then the
+# events (a type code and two integers each) and the 8 byte digest if there is one.
+
+MAGIC = b'SPACEREC'
+VERSION = 1
+
+frame_format = struct.Struct('<dhhHB')
+event_format = struct.Struct('<Bii')
+
+#Only the events Player.get_controls reacts to are kept, with the two fields each one needs.
+event_fields = [
+    (pygame.QUIT, ()),
+    (pygame.KEYDOWN, ('key',)),
+    (pygame.KEYUP, ('key',)),
+    (pygame.MOUSEBUTTONDOWN, ('button',)),
+    (pygame.MOUSEBUTTONUP, ('button',)),
+    (pygame.VIDEORESIZE, ('w', 'h')),
+]
+event_codes = {event_type : code for code, (event_type, fields) in enumerate(event_fields)}
+
+def digest(world):
+    # Fingerprint of the physical state of every live entity, which only matches if two runs
+    # agree to the last bit.
+    store = world.store
+    rows = np.nonzero(store.alive)[0]
+    h = hashlib.sha256(rows.tobytes())
+    for name in ('X_cm', 'v', 'theta', 'omega', 'm', 'I'):
+        h.update(np.ascontiguousarray(getattr(store, name)[rows]).tobytes())
+    for key, entry in world.p_obj.items():
+        h.update(("%s:%d" % (key, len(entry))).encode('utf-8'))
+    return h.digest()[:8]
+
+class Recorder():
+    # Appends every frame's control input to a log. Every digest_every frames the world state is
+    # fingerprinted as well, so that a replay can tell where it first went its own way.
+
+    def __init__(self, path, scenario='solar system', digest_every=60):
+        self.file = open(path, 'wb')
+        self.digest_every = digest_every
+        self.frames = 0
+
+        header = json.dumps({'scenario' : scenario, 'digest every' : digest_every}).encode('utf-8')
+        self.file.write(MAGIC + struct.pack('<II', VERSION, len(header)) + header)
+
+    def record(self, frame_time, events, mouse, world=None):
+        kept = [event for event in events if event.type in event_codes]
+        check = world is not None and self.frames % self.digest_every == self.digest_every - 1
+
+        self.file.write(frame_format.pack(frame_time, int(mouse[0]), int(mouse[1]), len(kept), check))
+        for event in kept:
+            fields = event_fields[event_codes[event.type]][1]
+            values = [getattr(event, field) for field in fields] + [0, 0]
+            self.file.write(event_format.pack(event_codes[event.type], values[0], values[1]))
+        if check:
+            self.file.write(digest(world))
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+def read(path):
+    # (header, frames), where each frame is (frame_time, mouse, events, digest or None).
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("%s is not a recording" % path)
+    version, length = struct.unpack_from('<II', data, len(MAGIC))
+    if version > VERSION:
+        raise ValueError("%s is recording version %d, this build reads up to %d" % (path, version, VERSION))
+    offset = len(MAGIC) + 8
+    header = json.loads(data[offset:offset + length].decode('utf-8'))
+    offset += length
+
+    frames = []
+    while offset < len(data):
+        frame_time, mx, my, n, check = frame_format.unpack_from(data, offset)
+        offset += frame_format.size
+
+        events = []
+        for i in range(n):
+            code, a, b = event_format.unpack_from(data, offset)
+            offset += event_format.size
+            event_type, fields = event_fields[code]
+            events.append(pygame.event.Event(event_type, dict(zip(fields, (a, b)))))
+
+        expected = None
+        if check:
+            expected = data[offset:offset + 8]
+            offset += 8
+        frames.append((frame_time, (mx, my), events, expected))
+
+    return header, frames
+
+### REPLAY ###
+
+def replay(path, viewport=None):
+    # Feeds a recording back through Player and World as fast as possible, with a Viewport
+    # standing in for the Camera unless one is given. Returns the world, the wall time spent in
+    # the loop, and the first frame whose state digest did not match (None if all of them did).
+    header, frames = read(path)
+    PhysicsObject.store = ComponentStore()
+    world = scenarios[header['scenario']](viewport if viewport is not None else Viewport())
+    player = Player(world.p_obj['player ship'][0])
+
+    diverged = None
+    t0 = time.perf_counter()
+    for i, (frame_time, mouse, events, expected) in enumerate(frames):
+        player.get_controls(world, events, mouse)
+        world.update(frame_time)
+        if expected is not None and diverged is None and digest(world) != expected:
+            diverged = i
+
+    return world, time.perf_counter() - t0, diverged
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'recording.rec'
+    header, frames = read(path)
+    world, elapsed, diverged = replay(path)
+
+    print("%s: %d frames, %.1f s of play replayed in %.2f s (%.0f frames/s)" % (path, len(frames), world.clock.time, elapsed, len(frames) / elapsed))
+    print("state matches the recording" if diverged is None else "state diverged at frame %d" % diverged)
+    sys.exit(0 if diverged is None else 1)
@@ -0,0 +1,47 @@
+from math import *
+import numpy as np
+
+from world import *
+from physics import *
+
+### SCENARIOS ###
+
+# Each scenario builds a fresh World. camera is None for headless runs; pass a Camera to render it.
+
+def solar_system(camera=None, v=np.array([0,-500]), sun_m=1.989*10**32, earth_m=10**19, layout=()):
+    #layout is a sequence of (x, y, orientation, module_type) to attach to the player ship.
+    initial_objects = [GravitationalBody(X = np.array([1.5*10**11, 0]), m = sun_m, sprites = {'default' : assets.get('Sun')}),
+                       GravitationalBody(X = np.array([-1500, 0]), m = earth_m, sprites = {'default' : assets.get('Earth')})]
+
+    player_ship = Ship(module_type="Core", v = v)
+    for x, y, orientation, module_type in layout:
+        player_ship.attach(module_types[module_type](core_module = player_ship, module_coordinates = [x, y],
+                                                     module_type = module_type, module_orientation = orientation))
+
+    world = World(player_ship, camera, initial_objects)
+    world.gravity = SphereOfInfluenceGravity()
+    return world
+
+def asteroid_belt(camera=None, n=10000, seed=0, **params):
+    #The solar system plus n small bodies on roughly circular orbits around the Earth.
+    world = solar_system(camera, **params)
+    world.gravity = BarnesHutGravity()
+
+    earth = world.p_obj['gravity sources'][1]
+    rng = np.random.default_rng(seed)
+    sprite = assets.get('Module')
+
+    for i in range(n):
+        r = rng.uniform(3000, 20000)
+        phi = rng.uniform(0, 2*pi)
+        speed = sqrt(GravitationalBody.G * earth.m / r)
+        world.add_obj('gravity sources', GravitationalBody(X = earth.X_cm + r * np.array([cos(phi), sin(phi)]),
+                                                           v = speed * np.array([-sin(phi), cos(phi)]),
+                                                           m = rng.uniform(10**9, 10**12), sprites = {'default' : sprite}))
+
+    return world
+
+scenarios = {
+    'solar system' : solar_system,
+    'asteroid belt' : asteroid_belt,
+}
@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import inspect
+import threading
+import numpy as np
+
+from world import *
+from physics import *
+
+### FORMAT ###
+
+# A snapshot is one binary file: an 8 byte magic, a format version and header length, a JSON
+# header, and then one contiguous array per column with every entity as a row. Columns start on
+# 64 byte boundaries so that each can be opened in place with numpy.memmap.
+
+MAGIC = b'SPACESNP'
+VERSION = 2
+ALIGN = 64
+
+#Physical state copied straight out of (and back into) the ComponentStore.
+state_columns = ('X', 'X_cm', 'v', 'theta', 'omega', 'm', 'I', 'rel_X_cm')
+
+gravity_engines = {'DirectGravity' : DirectGravity, 'BarnesHutGravity' : BarnesHutGravity,
+                   'SphereOfInfluenceGravity' : SphereOfInfluenceGravity}
+entity_types = dict(module_types, GravitationalBody=GravitationalBody)
+
+def settings(engine):
+    #An engine's constructor arguments, leaving out whatever it caches between evaluations.
+    parameters = inspect.signature(type(engine)).parameters
+    return {name : value for name, value in vars(engine).items() if name in parameters}
+
+def slot_values(obj):
+    # (shared, copied): every slot obj has set, as (name, value) pairs, split into values that
+    # copies of obj can share and lists, dicts and arrays that each copy needs its own of.
+    shared, copied = [], []
+    for klass in type(obj).__mro__:
+        for name in klass.__dict__.get('__slots__', ()):
+            if hasattr(obj, name):
+                value = getattr(obj, name)
+                (copied if isinstance(value, (list, dict, np.ndarray)) else shared).append((name, value))
+    return shared, copied
+
+def entities(world):
+    # Every entity in a fixed order, with the world list it belongs to (None for modules that
+    # are only reachable through their ship). Ship cores come right before their modules.
+    rows, seen = [], set()
+    for key, entry in world.p_obj.items():
+        for obj in entry:
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                rows.append((obj, key))
+            modules = obj.attached_modules if isinstance(obj, Ship) else ()
+            for module in modules:
+                if id(module) not in seen:
+                    seen.add(id(module))
+                    rows.append((module, key if key == 'player ship' else None))
+    return rows
+
+def capture(world):
+    # Copies the world into (header, columns). This is the only part of saving that has to run
+    # on the main thread; the copies can then be written out from anywhere.
+    rows = entities(world)
+    n = len(rows)
+    idx = np.array([obj.index for obj, key in rows], dtype=int)
+    row_of = {id(obj) : i for i, (obj, key) in enumerate(rows)}
+
+    groups = list(world.p_obj)
+    classes, sprites, module_type_names, behaviour_names = [], [], [], []
+    def code(names, name):
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    columns = {name : getattr(world.store, name)[idx].copy() for name in state_columns}
+    columns['class'] = np.zeros(n, dtype=np.uint8)
+    columns['group'] = np.full(n, -1, dtype=np.int8)
+    columns['ship'] = np.full(n, -1, dtype=np.int32)
+    columns['sprite'] = np.zeros(n, dtype=np.uint16)
+    columns['module_type'] = np.full(n, -1, dtype=np.int16)
+    columns['module_coordinates'] = np.zeros((n, 2), dtype=np.int32)
+    columns['module_orientation'] = np.zeros(n, dtype=np.int8)
+    columns['F_max'] = np.zeros(n)
+    columns['behaviour'] = np.full(n, -1, dtype=np.int8)
+
+    for i, (obj, key) in enumerate(rows):
+        columns['class'][i] = code(classes, type(obj).__name__)
+        columns['sprite'][i] = code(sprites, assets.name_of(obj.sprites['default']) or type(obj).__name__)
+        if key is not None:
+            columns['group'][i] = groups.index(key)
+
+        if isinstance(obj, Module):
+            columns['module_type'][i] = code(module_type_names, obj.module_type)
+            columns['module_orientation'][i] = obj.module_orientation
+        if isinstance(obj, AttachedModule):
+            columns['module_coordinates'][i] = obj.module_coordinates
+            core = obj.core_module
+            if isinstance(core, Ship) and core.blueprint.modules.get(tuple(obj.module_coordinates)) is obj:
+                columns['ship'][i] = row_of[id(core)]
+        if isinstance(obj, Thruster):
+            columns['F_max'][i] = np.abs(obj.F_max).max()
+        if isinstance(obj, Enemy):
+            columns['behaviour'][i] = code(behaviour_names, obj.behaviour)
+
+    header = {
+        'count' : n,
+        'player' : row_of[id(world.p_obj['player ship'][0])],
+        'groups' : groups,
+        'classes' : classes,
+        'sprites' : sprites,
+        'module_types' : module_type_names,
+        'behaviours' : behaviour_names,
+        'time' : world.clock.time,
+        'integrator' : world.integrator,
+        'substep_eta' : world.substep_eta,
+        'max_substeps' : world.max_substeps,
+        'gravity' : [type(world.gravity).__name__, settings(world.gravity)],
+    }
+    return header, columns
+
+def write(path, header, columns):
+    #Written to a temporary file first, so an interrupted save never clobbers the last good one.
+    layout = {}
+    offset = 0
+    for name, column in columns.items():
+        layout[name] = {'dtype' : column.dtype.str, 'shape' : list(column.shape), 'offset' : offset}
+        offset += -(-column.nbytes // ALIGN) * ALIGN
+
+    text = json.dumps(dict(header, columns=layout)).encode('utf-8')
+    start = -(-(len(MAGIC) + 12 + len(text)) // ALIGN) * ALIGN
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC + np.array([VERSION], dtype='<u4').tobytes() + np.array([len(text)], dtype='<u8').tobytes())
+        f.write(text)
+        for name, column in columns.items():
+            f.seek(start + layout[name]['offset'])
+            f.write(np.ascontiguousarray(column).tobytes())
+        f.truncate(start + offset)
+    os.replace(path + '.tmp', path)
+
+def save(world, path):
+    write(path, *capture(world))
+
+class Snapshot():
+    # Read side of a snapshot file. Opening only parses the header; every column is a read-only
+    # memmap, so nothing is read from disk until it is used, and columns can be inspected without
+    # building a World at all.
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a snapshot" % path)
+            version = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+            if version > VERSION:
+                raise ValueError("%s is snapshot version %d, this build reads up to %d" % (path, version, VERSION))
+            length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            self.header = json.loads(f.read(length).decode('utf-8'))
+
+        self.path = path
+        self.version = version
+        start = -(-(len(MAGIC) + 12 + length) // ALIGN) * ALIGN
+
+        self.columns = {}
+        for name, column in self.header['columns'].items():
+            shape = tuple(column['shape'])
+            if np.prod(shape) == 0:
+                self.columns[name] = np.zeros(shape, dtype=column['dtype'])
+            else:
+                self.columns[name] = np.memmap(path, dtype=column['dtype'], mode='r', offset=start + column['offset'], shape=shape)
+
+    def __len__(self):
+        return self.header['count']
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def world(self, camera=None):
+        # Rebuilds the World. Ships are constructed as usual, but every other entity is a copy of
+        # one built once for its kind, made with cls.__new__ and given a store row in bulk. The
+        # physical state is then copied into the store in bulk, and each ship gets its modules
+        # back in their saved order in one go.
+        h, c = self.header, self.columns
+        module_class, group, ship = np.asarray(c['class']), np.asarray(c['group']), np.asarray(c['ship'])
+        module_type, coordinates = np.asarray(c['module_type']), np.asarray(c['module_coordinates'])
+        orientation, F_max, X = np.asarray(c['module_orientation']), np.asarray(c['F_max']), np.asarray(c['X'])
+        sprite = np.asarray(c['sprite'])
+        #Snapshots from before behaviours were saved leave every enemy on its default.
+        behaviour = np.asarray(c['behaviour']) if 'behaviour' in c else np.full(len(self), -1)
+
+        def arguments(i, cls):
+            kwargs = {'X' : X[i], 'sprites' : {'default' : assets.get(h['sprites'][sprite[i]])}}
+            if issubclass(cls, Module):
+                kwargs['module_type'] = h['module_types'][module_type[i]]
+                kwargs['module_orientation'] = int(orientation[i])
+            if issubclass(cls, Thruster):
+                kwargs['F_max'] = F_max[i]
+            if issubclass(cls, Enemy) and behaviour[i] >= 0:
+                kwargs['behaviour'] = h['behaviours'][behaviour[i]]
+            return kwargs
+
+        objects = [None] * len(self)
+        copies, prototypes = [], {}
+        for i in range(len(self)):
+            cls = entity_types[h['classes'][module_class[i]]]
+            if issubclass(cls, Ship):
+                kwargs = arguments(i, cls)
+                kwargs['module_coordinates'] = coordinates[i].tolist()
+                if ship[i] >= 0 and ship[i] != i:
+                    kwargs['core_module'] = objects[ship[i]]
+                objects[i] = cls(**kwargs)
+                continue
+
+            key = (cls, sprite[i], module_type[i], orientation[i], F_max[i])
+            if key not in prototypes:
+                prototype = cls(**arguments(i, cls))
+                prototypes[key] = (prototype,) + slot_values(prototype)
+            prototype, shared, copied = prototypes[key]
+            obj = cls.__new__(cls)
+            for name, value in shared:
+                setattr(obj, name, value)
+            for name, value in copied:
+                setattr(obj, name, value.copy())
+            if issubclass(cls, AttachedModule):
+                obj.module_coordinates = coordinates[i].tolist()
+                obj.core_module = objects[ship[i]] if ship[i] >= 0 else obj
+            objects[i] = obj
+            copies.append(i)
+
+        #The prototypes' rows are handed back first, so the copies reuse them.
+        for prototype, shared, copied in prototypes.values():
+            prototype.release()
+        store = PhysicsObject.store
+        rows = store.add_many([objects[i] for i in copies])
+        for i, row in zip(copies, rows.tolist()):
+            objects[i].index = row
+
+        #Masses go in before the blueprints sum them; everything else once mass properties are settled.
+        idx = store.indices(objects)
+        store.m[idx] = c['m']
+        store.I[idx] = c['I']
+
+        cores = {}
+        for i in np.nonzero((ship >= 0) & (ship != np.arange(len(self))))[0]:
+            cores.setdefault(ship[i], []).append(objects[i])
+        for k, modules in cores.items():
+            objects[k].attached_modules.extend(modules)
+            objects[k].blueprint.add_many(modules, [module.module_coordinates for module in modules])
+
+        for obj in objects:
+            if isinstance(obj, Ship):
+                obj.update_mass_properties()
+
+        world = World(objects[h['player']], camera, [])
+        for i, obj in enumerate(objects):
+            key = h['groups'][group[i]] if group[i] >= 0 else None
+            if key is not None and key != 'player ship':
+                world.add_obj(key, obj)
+        for key in h['groups']:
+            world.p_obj.setdefault(key, [])
+
+        for name in state_columns:
+            getattr(world.store, name)[idx] = c[name]
+        world.edited()
+        world.clock.time = h['time']
+        world.integrator = h['integrator']
+        world.substep_eta = h['substep_eta']
+        world.max_substeps = h['max_substeps']
+        name, settings = h['gravity']
+        world.gravity = gravity_engines[name](**settings)
+
+        for obj in objects:
+            if isinstance(obj, Ship):
+                obj.place_modules()
+        return world
+
+def load(path, camera=None):
+    return Snapshot(path).world(camera)
+
+### AUTOSAVE ###
+
+class Autosave():
+    # World observer that saves every interval seconds of wall time. The state is copied on the
+    # main thread and the file is written by a background thread, so a frame only pays for the
+    # copy. A save is skipped while the previous one is still being written.
+
+    def __init__(self, path, interval=60.):
+        self.path = path
+        self.interval = interval
+        self.last = time.perf_counter()
+        self.thread = None
+
+    def render(self, world):
+        now = time.perf_counter()
+        if now - self.last < self.interval or (self.thread is not None and self.thread.is_alive()):
+            return
+
+        self.last = now
+        self.thread = threading.Thread(target=write, args=(self.path,) + capture(world), daemon=True)
+        self.thread.start()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+if __name__ == '__main__':
+    #python snapshot.py save [scenario] [path], or python snapshot.py info path
+    if len(sys.argv) > 1 and sys.argv[1] == 'save':
+        from scenarios import scenarios
+        scenario = sys.argv[2] if len(sys.argv) > 2 else 'solar system'
+        path = sys.argv[3] if len(sys.argv) > 3 else 'world.snap'
+        save(scenarios[scenario](), path)
+        print("Saved %s to %s (%d bytes)" % (scenario, path, os.path.getsize(path)))
+    else:
+        snapshot = Snapshot(sys.argv[-1])
+        print("%s: version %d, %d entities, t = %.1f s" % (snapshot.path, snapshot.version, len(snapshot), snapshot.header['time']))
+        for name, column in snapshot.columns.items():
+            print("%20s %10s %14s" % (name, column.dtype, column.shape))
@@ -0,0 +1,61 @@
+from math import *
+import numpy as np
+
+class SpatialHash():
+    # Uniform grid over store rows. Rows are only moved between cells when their cell changes,
+    # which is found for all rows at once, so a frame where little crosses a cell border is cheap.
+
+    def __init__(self, cell_size=512.):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.keys = np.zeros((0, 2), dtype=np.int64)
+        self.present = np.zeros(0, dtype=bool)
+
+    def update(self, rows, X):
+        if len(self.present) < len(X):
+            self.keys = np.concatenate([self.keys, np.zeros((len(X) - len(self.keys), 2), dtype=np.int64)])
+            self.present = np.concatenate([self.present, np.zeros(len(X) - len(self.present), dtype=bool)])
+
+        keys = np.floor(X[rows] / self.cell_size).astype(np.int64)
+
+        #Rows that are gone since the last update
+        seen = np.zeros(len(self.present), dtype=bool)
+        seen[rows] = True
+        for row in np.nonzero(self.present & ~seen)[0]:
+            self.remove(row)
+
+        moved = ~self.present[rows] | np.any(keys != self.keys[rows], axis=1)
+        for row, key in zip(rows[moved], keys[moved]):
+            if self.present[row]:
+                self.remove(row)
+            key = (int(key[0]), int(key[1]))
+            self.cells.setdefault(key, set()).add(int(row))
+            self.keys[row] = key
+            self.present[row] = True
+
+    def remove(self, row):
+        key = (int(self.keys[row, 0]), int(self.keys[row, 1]))
+        cell = self.cells[key]
+        cell.discard(int(row))
+        if not cell:
+            del self.cells[key]
+        self.present[row] = False
+
+    def query(self, lo, hi):
+        #Rows whose position falls in a cell overlapping the rectangle lo..hi.
+        x0, y0 = np.floor(np.asarray(lo) / self.cell_size).astype(np.int64)
+        x1, y1 = np.floor(np.asarray(hi) / self.cell_size).astype(np.int64)
+
+        rows = []
+        if (x1 - x0 + 1) * (y1 - y0 + 1) < len(self.cells):
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    rows.extend(self.cells.get((cx, cy), ()))
+        else:
+            for (cx, cy), cell in self.cells.items():
+                if x0 <= cx <= x1 and y0 <= cy <= y1:
+                    rows.extend(cell)
+        return rows
+
+    def query_point(self, point, radius):
+        return self.query(np.subtract(point, radius), np.add(point, radius))
@@ -0,0 +1,116 @@
+from math import *
+from collections import OrderedDict
+import pygame
+
+def surface_bytes(value):
+    #Memory held by a surface, or by a list of them.
+    if isinstance(value, list):
+        return sum(surface_bytes(surface) for surface in value)
+    return value.get_width() * value.get_height() * value.get_bytesize()
+
+class SurfaceCache():
+    # Least-recently-used cache of surfaces, each made from a source (a surface, or a ship's
+    # layout), holding at most budget bytes of them. Each entry keeps its source, so that a key
+    # built from a recycled id() can't return something made from someone else's surface.
+
+    def __init__(self, budget):
+        self.budget = budget
+
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key, source):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is source:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def store(self, key, source, value):
+        self.discard(key)
+        size = surface_bytes(value)
+        self.entries[key] = (source, value, size)
+        self.bytes += size
+
+        while self.bytes > self.budget and len(self.entries) > 1:
+            old_key, (old_source, old_value, old_size) = self.entries.popitem(last=False)
+            self.bytes -= old_size
+            self.evictions += 1
+
+        return value
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def discard_source(self, source):
+        #Everything made from source, for when source itself is about to be thrown away.
+        for key in [key for key, entry in self.entries.items() if entry[0] is source]:
+            self.discard(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions,
+                'entries' : len(self.entries), 'bytes' : self.bytes,
+                'hit rate' : self.hits / lookups if lookups else 0.}
+
+class SpriteCache(SurfaceCache):
+    # Transformed sprites, keyed by (source surface, quantized angle, quantized scale). Every
+    # module of a ship shares its orientation, so one rotate and scale per sprite per frame is
+    # enough no matter how many modules use it.
+
+    def __init__(self, transform, budget=32 * 2**20, angle_step=1., scale_step=0.001):
+        #scale_step is relative, so that zooming far out still tells neighbouring scales apart.
+        super().__init__(budget)
+        self.transform = transform
+        self.angle_step = angle_step
+        self.scale_step = scale_step
+
+    def get(self, surface, angle, scale):
+        angle = round(angle / self.angle_step) * self.angle_step % 360
+        scale = exp(round(log(scale) / self.scale_step) * self.scale_step)
+        key = (id(surface), angle, scale)
+
+        sprite = self.lookup(key, surface)
+        if sprite is None:
+            sprite = self.store(key, surface, self.transform(surface, angle, scale))
+        return sprite
+
+class Mipmaps(SurfaceCache):
+    # Every sprite at half, quarter, ... size down to a single pixel, made once with smooth
+    # scaling. A sprite drawn at scale s is rotated and scaled from the smallest level that is
+    # still at least as large as it will be on screen, so a distant sprite costs about as much
+    # as its size on screen rather than its size in the atlas.
+
+    def __init__(self, budget=32 * 2**20):
+        super().__init__(budget)
+
+    def build(self, surface):
+        levels = [surface]
+        w, h = surface.get_size()
+        smooth = surface.get_bitsize() in (24, 32)
+        while w > 1 or h > 1:
+            w, h = max(w // 2, 1), max(h // 2, 1)
+            levels.append((pygame.transform.smoothscale if smooth else pygame.transform.scale)(levels[-1], (w, h)))
+        return levels
+
+    def get(self, surface, scale):
+        # (level, remaining scale): the level to start from, and the scale (in (0.5, 1] below
+        # full size, unchanged above it) still to apply to it.
+        levels = self.lookup(id(surface), surface)
+        if levels is None:
+            levels = self.store(id(surface), surface, self.build(surface))
+
+        k = min(max(int(floor(-log2(scale))), 0), len(levels) - 1) if scale > 0 else len(levels) - 1
+        return levels[k], scale * surface.get_width() / levels[k].get_width()
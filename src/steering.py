@@ -0,0 +1,97 @@
+from math import *
+import numpy as np
+
+from gravity import G
+
+### STEERING ###
+
+# Batched steering for AI ships. Every function works on arrays with one row per ship, so a
+# whole swarm is steered with a handful of array operations instead of a Python loop.
+
+behaviours = ('flee', 'seek', 'orbit', 'brake')
+
+class SteeringParams():
+    # Tuning shared by every AI ship.
+
+    def __init__(self):
+        #Ships flee from a threat closer than flee_radius, and seek one while farther than arrive_radius.
+        self.flee_radius = 300.
+        self.arrive_radius = 200.
+        self.max_speed = 400.
+
+        #How quickly (1/s) a ship tries to close the gap to its desired velocity.
+        self.gain = 2.
+
+        #Heading control: proportional and damping gains, and the largest angular acceleration.
+        self.turn_gain = 4.
+        self.turn_damping = 3.
+        self.max_alpha = 2.
+
+def primaries(X, sources_X, sources_m):
+    #Index of the source pulling hardest on each position in X.
+    d = sources_X[np.newaxis, :, :] - X[:, np.newaxis, :]
+    pull = sources_m[np.newaxis, :] / np.maximum(np.einsum('ijk,ijk->ij', d, d), 1e-9)
+    return np.argmax(pull, axis=1)
+
+def desired_velocity(code, X, v, threat_X, threat_v, primary_X, primary_v, primary_m, params):
+    # Velocity each ship would like to have, in world coordinates, for its behaviour code
+    # (an index into behaviours). Ships with nothing to do ask for the velocity they have.
+    away = X - threat_X
+    distance = np.sqrt(np.einsum('ij,ij->i', away, away))
+    direction = away / np.maximum(distance, 1e-9)[:, np.newaxis]
+
+    #flee: run straight away from a threat that is close.
+    flee = np.where((distance < params.flee_radius)[:, np.newaxis], threat_v + direction * params.max_speed, v)
+
+    #seek: close in on the threat, slowing down to match it inside arrive_radius.
+    approach = np.minimum(1., np.maximum(0., distance - params.arrive_radius) / params.arrive_radius)
+    seek = threat_v - direction * (params.max_speed * approach)[:, np.newaxis]
+
+    #orbit: circular orbit velocity about the primary, in the direction the ship already goes round.
+    r = X - primary_X
+    u = v - primary_v
+    radius = np.maximum(np.sqrt(np.einsum('ij,ij->i', r, r)), 1e-9)
+    sense = np.where(r[:, 0] * u[:, 1] - r[:, 1] * u[:, 0] < 0, -1., 1.)
+    tangent = np.stack([-r[:, 1], r[:, 0]], axis=1) / radius[:, np.newaxis] * sense[:, np.newaxis]
+    orbit = primary_v + tangent * np.sqrt(G * primary_m / radius)[:, np.newaxis]
+
+    #brake: come to rest relative to the primary.
+    brake = primary_v
+
+    return np.choose(code[:, np.newaxis], [flee, seek, orbit, brake])
+
+def available_thrust(direction, theta, thruster_F, owner):
+    # Largest force each ship can put out along direction (unit vectors in world coordinates),
+    # with every thruster that points that way at full power. thruster_F holds the body-frame
+    # F_max of every ship's thrusters one after the other, and owner says whose each one is.
+    c, s = np.cos(theta), np.sin(theta)
+    body = np.stack([direction[:, 0] * c - direction[:, 1] * s, direction[:, 0] * s + direction[:, 1] * c], axis=1)
+    along = np.maximum(np.einsum('ij,ij->i', thruster_F, body[owner]), 0.)
+    return np.bincount(owner, weights=along, minlength=len(direction))
+
+def torque_range(thruster_tau, owner, n):
+    # (lowest, highest) torque each of n ships can put out, from every thruster that turns it
+    # the one way or the other at full power. thruster_tau is per thruster, as thruster_F.
+    return (np.bincount(owner, weights=np.minimum(thruster_tau, 0.), minlength=n),
+            np.bincount(owner, weights=np.maximum(thruster_tau, 0.), minlength=n))
+
+def steering_forces(code, X, v, theta, omega, m, I, thruster_F, thruster_tau, owner, threat_X, threat_v, primary_X, primary_v, primary_m, params):
+    # Force and torque for every ship. The force is what it takes to reach the desired velocity
+    # in 1/gain seconds, clamped to the thrust the ship can put out in that direction as it
+    # faces now; the torque turns the ship so that its nose points along the unclamped force,
+    # clamped to what its thrusters can turn it with.
+    v_desired = desired_velocity(code, X, v, threat_X, threat_v, primary_X, primary_v, primary_m, params)
+    F = m[:, np.newaxis] * (v_desired - v) * params.gain
+
+    F_norm = np.sqrt(np.einsum('ij,ij->i', F, F))
+    direction = F / np.maximum(F_norm, 1e-9)[:, np.newaxis]
+    thrust = available_thrust(direction, theta, thruster_F, owner)
+
+    #A ship faces (cos theta, -sin theta), the same convention as Ship.apply_thrust.
+    heading = np.arctan2(-F[:, 1], F[:, 0])
+    error = (heading - theta + pi) % (2*pi) - pi
+    error = np.where(F_norm > 0, error, 0.)
+    alpha = np.clip(params.turn_gain * error - params.turn_damping * omega, -params.max_alpha, params.max_alpha)
+    tau_lo, tau_hi = torque_range(thruster_tau, owner, len(X))
+
+    return direction * np.minimum(F_norm, thrust)[:, np.newaxis], np.clip(I * alpha, tau_lo, tau_hi)
@@ -0,0 +1,126 @@
+from math import *
+import numpy as np
+
+class ComponentStore():
+    # Structure-of-arrays storage for the physical state of every entity. Each PhysicsObject owns
+    # one row, and its X, v, F, theta, m, etc. are views into the arrays below, so the whole
+    # world can be integrated with a handful of vectorized operations.
+
+    vectors = ('X', 'X_cm', 'v', 'a', 'F', 'rel_X_cm')
+    scalars = ('theta', 'omega', 'alpha', 'tau', 'm', 'I')
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.count = 0
+        self.free_rows = []
+
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.objects = [None] * capacity
+
+        for name in self.vectors:
+            setattr(self, name, np.zeros((capacity, 2)))
+        for name in self.scalars:
+            setattr(self, name, np.zeros(capacity))
+
+    def grow(self, capacity):
+        for name in self.vectors + self.scalars + ('alive',):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.capacity] = old
+            setattr(self, name, new)
+
+        self.objects += [None] * (capacity - self.capacity)
+        self.capacity = capacity
+
+    def add(self, obj):
+        if self.free_rows:
+            index = self.free_rows.pop()
+        else:
+            if self.count == self.capacity:
+                self.grow(2 * self.capacity)
+            index = self.count
+            self.count += 1
+
+        for name in self.vectors + self.scalars:
+            getattr(self, name)[index] = 0
+
+        self.alive[index] = True
+        self.objects[index] = obj
+        return index
+
+    def add_many(self, objects):
+        # Rows for several objects at once: free rows are reused first, and the arrays grow at
+        # most once for the rest.
+        reused = self.free_rows[max(len(self.free_rows) - len(objects), 0):][::-1]
+        del self.free_rows[len(self.free_rows) - len(reused):]
+        fresh = len(objects) - len(reused)
+
+        capacity = self.capacity
+        while self.count + fresh > capacity:
+            capacity *= 2
+        if capacity > self.capacity:
+            self.grow(capacity)
+        rows = np.concatenate([np.array(reused, dtype=int), np.arange(self.count, self.count + fresh)])
+        self.count += fresh
+
+        for name in self.vectors + self.scalars:
+            getattr(self, name)[rows] = 0
+
+        self.alive[rows] = True
+        for row, obj in zip(rows.tolist(), objects):
+            self.objects[row] = obj
+        return rows
+
+    def remove(self, index):
+        self.alive[index] = False
+        self.objects[index] = None
+        self.free_rows.append(index)
+
+    def indices(self, objects):
+        return np.fromiter((obj.index for obj in objects), dtype=int)
+
+    def integrate(self, idx, dt):
+        # Same update as PhysicsObject.update_physics, applied to every row in idx at once.
+        self.rotate(idx, dt)
+
+        self.a[idx] = self.F[idx] / self.m[idx, np.newaxis]
+        self.v[idx] += self.a[idx] * dt
+        self.X_cm[idx] += self.v[idx] * dt
+
+        self.place(idx)
+
+        self.F[idx] = 0
+        self.tau[idx] = 0
+
+    def rotate(self, idx, dt):
+        self.alpha[idx] = self.tau[idx] / self.I[idx]
+        self.omega[idx] += self.alpha[idx] * dt
+        self.theta[idx] = (self.theta[idx] + self.omega[idx] * dt) % (2*pi)
+
+    def place(self, idx):
+        #Sprite position, found by rotating rel_X_cm about X_cm
+        c, s = np.cos(self.theta[idx]), np.sin(self.theta[idx])
+        rel = self.rel_X_cm[idx]
+        self.X[idx, 0] = self.X_cm[idx, 0] - (rel[:, 0]*c + rel[:, 1]*s)
+        self.X[idx, 1] = self.X_cm[idx, 1] + (rel[:, 0]*s - rel[:, 1]*c)
+
+    def pose(self, core, rows, offsets, orientations):
+        # Rigid-body transform of modules fixed to the core row: offsets (n,2) are the modules'
+        # positions on the ship's grid and orientations are in quarter turns. core can also be
+        # an array with each module's core row, to pose several ships at once.
+        c, s = np.cos(self.theta[core]), np.sin(self.theta[core])
+        d = self.rel_X_cm[core] - offsets
+        self.X[rows, 0] = self.X_cm[core, 0] - (d[:, 0]*c + d[:, 1]*s)
+        self.X[rows, 1] = self.X_cm[core, 1] + (d[:, 0]*s - d[:, 1]*c)
+        self.theta[rows] = self.theta[core] + orientations * (pi/2)
+
+def component(name):
+    # Attribute that reads and writes the owner's row of the store. Vector components come back
+    # as views, so in-place updates like obj.X[0] = x land in the store.
+    def get(self):
+        return getattr(self.store, name)[self.index]
+
+    def set(self, value):
+        getattr(self.store, name)[self.index] = value
+
+    return property(get, set)
@@ -0,0 +1,108 @@
+from math import *
+import numpy as np
+
+from gravity import *
+from integrators import *
+
+### TRAJECTORY PREDICTION ###
+
+class TrajectoryPredictor():
+    # The player ship's future path, coasting through the gravity of the heaviest sources, which
+    # are propagated along with it. With only a handful of sources their pull is summed
+    # directly. The path is a cached polyline with one point every dt seconds of game time:
+    # each frame the points that are now in the past are dropped and a few more steps are
+    # added to the end, until horizon points are cached. It is only started over when
+    # the ship's thrust turns on or off, its blueprint changes (a module was attached or
+    # detached, so its mass changed), or it strays from the prediction by more than tolerance
+    # plus drift times the distance flown since, as it does after a collision. The allowance for
+    # drift covers the difference between the world's integration and this one.
+
+    def __init__(self, dt=0.25, horizon=2000, steps_per_frame=25, heaviest=8, tolerance=2., drift=0.01):
+        self.dt = dt
+        self.horizon = horizon
+        self.steps_per_frame = steps_per_frame
+        self.heaviest = heaviest
+        self.tolerance = tolerance
+        self.drift = drift
+
+        self.gravity = DirectGravity()
+        self.key = None
+        self.points = np.zeros((0, 2))
+        self.t0 = 0.
+        self.ended = False
+        self.restarts = 0
+
+    def invalidate(self):
+        self.key = None
+
+    def start(self, world, key):
+        #Row 0 of the propagated state is the ship, the rest are the sources it coasts past.
+        ship = world.p_obj['player ship'][0]
+        sources = sorted(world.p_obj['gravity sources'], key=lambda source: -source.m)[:self.heaviest]
+        rows = world.store.indices([ship] + sources)
+
+        self.X = world.store.X_cm[rows].copy()
+        self.v = world.store.v[rows].copy()
+        self.m = world.store.m[rows].copy()
+        self.sources = np.arange(1, len(rows))
+        self.radius = np.array([source.size[0] / 2 for source in sources])
+
+        self.points = self.X[:1].copy()
+        self.velocities = self.v[:1].copy()
+        self.t0 = world.clock.time
+        self.flown = 0.
+        self.ended = False
+        self.key = key
+        self.restarts += 1
+
+    def extend(self, steps):
+        #Appends up to steps more points with RK4, stopping for good where the path runs into a source.
+        accel = lambda X: self.gravity.accelerations(X, self.m, self.sources)
+
+        new, new_v = [], []
+        for i in range(steps):
+            self.X, self.v, a = integrators['rk4'](self.X, self.v, accel, self.dt)
+            new.append(self.X[0].copy())
+            new_v.append(self.v[0].copy())
+
+            d = self.X[1:] - self.X[0]
+            if np.any(np.einsum('ij,ij->i', d, d) < self.radius**2):
+                self.ended = True
+                break
+
+        if new:
+            self.points = np.concatenate([self.points, new])
+            self.velocities = np.concatenate([self.velocities, new_v])
+
+    def update(self, world):
+        ship = world.p_obj['player ship'][0]
+        thrusting = bool(np.any(ship.net_thrust))
+        key = (ship.blueprint.version, thrusting)
+        if key != self.key or thrusting:
+            self.start(world, key)
+
+        #Points that are now in the past are dropped; if all of them are, or the ship is no
+        #longer where the path says it should be, the prediction starts over.
+        k = int((world.clock.time - self.t0) / self.dt)
+        if k > 0 and k >= len(self.points) - 1:
+            self.start(world, key)
+        elif k > 0:
+            step = np.diff(self.points[:k + 1], axis=0)
+            self.flown += np.sqrt(np.einsum('ij,ij->i', step, step)).sum()
+            self.points = self.points[k:]
+            self.velocities = self.velocities[k:]
+            self.t0 += k * self.dt
+
+        #Where the ship should be now, by cubic Hermite interpolation between the first two points.
+        here = self.points[0]
+        if len(self.points) > 1:
+            s = (world.clock.time - self.t0) / self.dt
+            (p0, p1), (v0, v1) = self.points[:2], self.velocities[:2] * self.dt
+            here = (2*s**3 - 3*s**2 + 1) * p0 + (s**3 - 2*s**2 + s) * v0 + (-2*s**3 + 3*s**2) * p1 + (s**3 - s**2) * v1
+        if np.any(np.abs(here - ship.X_cm) > self.tolerance + self.drift * self.flown):
+            self.start(world, key)
+
+        if not self.ended and len(self.points) < self.horizon:
+            self.extend(min(self.steps_per_frame, self.horizon - len(self.points)))
+
+        return self.points
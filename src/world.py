@@ -1,6 +1,16 @@
+from math import *
 import pygame
 import numpy as np
 
+from gravity import *
+from integrators import *
+from spatial import *
+from profiler import *
+from steering import *
+from collision import *
+from kepler import *
+from trajectory import *
+
 class World():
 
     def __init__(self, player_ship, camera, initial_objects):
@@ -11,14 +21,60 @@ class World():
                       }
 
         self.camera = camera
+        self.store = player_ship.store
+
+        #Renderers and other per-frame observers; the world itself never touches the display.
+        self.observers = []
+        if camera is not None:
+            self.attach(camera)
 
         self.game_over = True
         self.game_exit = False
 
+        #Gravity engine used by apply_gravitation, either DirectGravity or BarnesHutGravity.
+        self.gravity = DirectGravity()
+
+        #(rows, masses, engine, gravity-only acceleration) at the end of the last step, which
+        #verlet reuses at the start of the next. Anything that moves bodies outside the
+        #integrator calls edited(), and only those bodies are evaluated again; attaching or
+        #detaching changes the masses, which drops it altogether.
+        self.last_gravity = None
+        self.edited_rows = []
+
+        #Physics advances in fixed steps of clock.dt, independent of the frame rate.
+        self.clock = SimulationClock()
+        self.integrator = 'verlet'
+        self.substep_eta = 0.02
+        self.max_substeps = 64
+
+        #Time warp: above 1, frames advance warp times faster with every body on Keplerian rails.
+        self.warp = 1
+        self.max_warp = 10**5
+        self.rails = Rails()
+
+        #Spatial index over the sprite positions of every live entity, for culling and picking.
+        self.index = SpatialHash()
+
+        #Contact detection and response between every module, ship and gravity source.
+        self.collisions = Collisions()
+
+        #Tuning for the AI ships in 'other ships'.
+        self.steering = SteeringParams()
+        self.fleet = None
+
+        #The player ship's predicted path, extended a little every frame by whoever draws it.
+        self.trajectory = TrajectoryPredictor()
+
+        #Per-phase frame times, filled in by the world, its observers and the main loop.
+        self.profiler = FrameProfiler()
+
         for obj in initial_objects:
             if type(obj).__name__ == 'GravitationalBody':
                 self.add_obj('gravity sources', obj)
 
+    def attach(self, observer):
+        self.observers.append(observer)
+
     def add_obj(self, key, obj):
         if key in self.p_obj.keys():
             self.p_obj[key].append(obj)
@@ -29,6 +85,18 @@ class World():
     ### UNIVERSAL FORCE FUNCTIONS ###
 
     def apply_gravitation(self):
+        objects = [obj for entry in self.p_obj.values() for obj in entry]
+        if not objects or not self.p_obj['gravity sources']:
+            return
+
+        idx = self.store.indices(objects)
+        row = {obj.index : i for i, obj in enumerate(objects)}
+        sources = [row[g_source.index] for g_source in self.p_obj['gravity sources']]
+
+        self.store.F[idx] += self.gravity.forces(self.store.X_cm[idx], self.store.m[idx], sources)
+
+    def apply_gravitation_pairwise(self):
+        #Reference path: one GravitationalBody.gravitate call per (source, object) pair.
         for g_source in self.p_obj['gravity sources']:
             for entry in self.p_obj.values():
                 for obj in entry:
@@ -36,47 +104,168 @@ class World():
                         g_source.gravitate(obj)
 
     def apply_other_thrusters(self):
-        pass
+        #Steers every AI ship in one batch, with the player's ship as the threat or target.
+        ships = self.p_obj['other ships']
+        sources = self.p_obj['gravity sources']
+        if not ships:
+            return
+
+        #Rows, behaviour codes and thrusters are only gathered again when a ship comes or goes,
+        #changes behaviour or has its layout changed.
+        store = self.store
+        versions = [ship.blueprint.version for ship in ships]
+        names = [ship.behaviour for ship in ships]
+        fleet = self.fleet
+        if fleet is None or fleet[0] != ships or fleet[1] != versions or fleet[2] != names:
+            idx = store.indices(ships)
+            code = np.array([behaviours.index(name) for name in names], dtype=int)
+            thruster_F = np.concatenate([ship.blueprint.F[:len(ship.blueprint.thrusters)] for ship in ships])
+            thruster_tau = np.concatenate([ship.blueprint.torques() for ship in ships])
+            owner = np.repeat(np.arange(len(ships)), [len(ship.blueprint.thrusters) for ship in ships])
+            fleet = self.fleet = (list(ships), versions, names, idx, code, thruster_F, thruster_tau, owner)
+        idx, code, thruster_F, thruster_tau, owner = fleet[3:]
+
+        #Without any sources, a ship is its own primary: one that orbits or brakes keeps the velocity it has.
+        player = self.p_obj['player ship'][0].index
+        if sources:
+            source_idx = store.indices(sources)
+            primary = source_idx[primaries(store.X_cm[idx], store.X_cm[source_idx], store.m[source_idx])]
+            primary_m = store.m[primary]
+        else:
+            primary, primary_m = idx, np.zeros(len(idx))
+
+        F, tau = steering_forces(code, store.X_cm[idx], store.v[idx], store.theta[idx], store.omega[idx], store.m[idx], store.I[idx], thruster_F, thruster_tau, owner,
+                                 store.X_cm[player], store.v[player], store.X_cm[primary], store.v[primary], primary_m,
+                                 self.steering)
+        store.F[idx] += F
+        store.tau[idx] += tau
 
-    def update(self, dt):
+    def moving_objects(self):
+        #Everything that moves freely, as opposed to attached modules or modules held by the mouse.
+        return [self.p_obj['player ship'][0]] + self.p_obj['other ships'] + self.p_obj['gravity sources'] + \
+               [module for module in self.p_obj['free modules'] if not module.following_mouse]
+
+    def substeps(self, X, m, sources, dt):
+        #Bodies deep in a gravity well are stepped more finely than the fixed dt.
+        t = dynamical_time(X, m, sources)
+        return int(min(self.max_substeps, max(1, ceil(dt / (self.substep_eta * t)))))
+
+    def step(self, dt):
 
         ### APPLYING FORCES ###
-        
-        self.apply_gravitation()
-        self.p_obj['player ship'][0].controls()
-        self.apply_other_thrusters()
+
+        profiler = self.profiler
+        with profiler.phase('controls'):
+            self.p_obj['player ship'][0].controls()
+            self.apply_other_thrusters()
+
+        with profiler.phase('collisions'):
+            self.collisions.resolve(self)
 
         ### UPDATING PHYSICS ###
 
-        self.p_obj['player ship'][0].update_physics(dt)
+        profiler.start('integration')
+        moving = self.moving_objects()
+        idx = self.store.indices(moving)
+        row = {obj.index : i for i, obj in enumerate(moving)}
+        sources = [row[g_source.index] for g_source in self.p_obj['gravity sources']]
+
+        #Thrust is held constant over the step, gravity is re-evaluated wherever the integrator needs it.
+        m = self.store.m[idx]
+        a_thrust = self.store.F[idx] / m[:, np.newaxis]
+        last = {}
+
+        def accel(X):
+            with profiler.phase('gravity'):
+                last['gravity'] = self.gravity.accelerations(X, m, sources)
+            return a_thrust + last['gravity']
+
+        #Gravity at the end of the last step still holds at the start of this one, except for
+        #bodies moved since. Only sources pull, so moving anything else changes its own alone.
+        X, v, a = self.store.X_cm[idx], self.store.v[idx], None
+        cached = self.last_gravity
+        if cached is not None and cached[2] is self.gravity and np.array_equal(cached[0], idx) and np.array_equal(cached[1], m):
+            moved = np.isin(idx, np.concatenate(self.edited_rows)) if self.edited_rows else np.zeros(len(idx), dtype=bool)
+            if not np.any(moved[sources]):
+                g = cached[3]
+                if np.any(moved):
+                    k = np.nonzero(moved)[0]
+                    near = np.concatenate([k, np.asarray(sources, dtype=int)])
+                    g = g.copy()
+                    with profiler.phase('gravity'):
+                        g[k] = self.gravity.accelerations(X[near], m[near], np.arange(len(k), len(near)))[:len(k)]
+                a = a_thrust + g
+                last['gravity'] = g
+        self.edited_rows = []
+
+        n = self.substeps(X, m, sources, dt)
+        for i in range(n):
+            X, v, a = integrators[self.integrator](X, v, accel, dt / n, a)
 
-        for module in self.p_obj['player ship'][0].attached_modules:
-            module.follow(module.module_coordinates, module.module_orientation, module.core_module)
+        #Only an integrator that hands back the acceleration at the new positions leaves one to reuse.
+        self.last_gravity = (idx, m, self.gravity, last['gravity']) if a is not None else None
 
-        for ship in self.p_obj['other ships']:
-            ship.update_physics(dt)
+        self.store.X_cm[idx] = X
+        self.store.v[idx] = v
+        self.store.a[idx] = a_thrust + last['gravity']
+        self.store.rotate(idx, dt)
+        self.store.place(idx)
+
+        self.store.F[idx] = 0
+        self.store.tau[idx] = 0
+        profiler.stop()
+
+        with profiler.phase('follow'):
+            self.place_ships()
+
+    def place_ships(self):
+        #Moves the modules of every ship, the player's and the AI's, with their cores in one batch.
+        ships = [self.p_obj['player ship'][0]] + [ship for ship in self.p_obj['other ships'] if len(ship.blueprint.posed) > 1]
+        poses = [ship.blueprint.pose_arrays() for ship in ships]
+        cores = np.repeat(self.store.indices(ships), [len(rows) for rows, offsets, orientations in poses])
+        rows, offsets, orientations = (np.concatenate(column) for column in zip(*poses))
+        self.store.pose(cores, rows, offsets, orientations)
+
+    def edited(self, rows=None):
+        #Bodies at store rows were moved outside the integrator, so the next step evaluates their
+        #gravity afresh; everyone's, without rows.
+        if rows is None:
+            self.last_gravity = None
+        else:
+            self.edited_rows.append(np.asarray(rows, dtype=int))
+
+    def set_warp(self, warp):
+        #Any change of warp starts over from the current state.
+        self.warp = min(max(warp, 1), self.max_warp)
+        self.rails.clear()
+        self.rails.reason = None
+
+    def update(self, frame_time):
+
+        if self.warp > 1:
+            self.edited()
+            with self.profiler.phase('integration'):
+                self.rails.advance(self, min(frame_time, self.clock.max_frame_time) * self.warp)
+        else:
+            for i in range(self.clock.advance(frame_time)):
+                self.step(self.clock.dt)
 
-        for large_body in self.p_obj['gravity sources']:
-            large_body.update_physics(dt)
+        for observer in self.observers:
+            observer.render(self)
 
-        self.camera.track(self.p_obj['player ship'][0] if self.camera.mode == 0 else self.p_obj['gravity sources'][1])
+        self.profiler.frame()
 
-        for module in self.p_obj['free modules']:
-            if module.following_mouse:
-                module.follow_mouse(self.camera.get_mouse_pos() + self.camera.position)
-                new_point = self.camera.mouse_to_relative_point(self.p_obj['player ship'][0])
-                if new_point:
-                    module.follow(new_point, module.module_orientation, self.p_obj['player ship'][0])
-            else:
-                module.update_physics(dt)
+    def update_index(self):
+        self.index.update(np.nonzero(self.store.alive)[0], self.store.X)
 
-        self.camera.clock.tick(self.camera.FPS)
-        pygame.display.set_caption(str(self.camera.clock.get_fps()))
+    def objects_in(self, lo, hi):
+        return [self.store.objects[row] for row in sorted(self.index.query(lo, hi))]
 
-        self.camera.display.fill(self.camera.white)
-        self.camera.draw_world(self)
-        self.camera.print_stats(self.p_obj['player ship'][0])
-        pygame.display.update()
+    def run(self, steps):
+        #Advances the simulation as fast as possible, without waiting on the clock or the display.
+        for i in range(steps):
+            self.step(self.clock.dt)
+        self.clock.time += steps * self.clock.dt
 
     def welcome(self):
         self.camera.print_welcome()